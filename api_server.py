@@ -3,87 +3,606 @@ FastAPI server for PDF processing with OpenAI.
 
 Endpoints:
     POST /upload - Upload PDF file and start processing
+    POST /batch - Upload several PDFs with shared parameters in one request
+    GET /batch/{batch_id} - Aggregate status of a batch
+    GET /organizations - Organizations (funding programs) with their rules files
+    GET /events - Server-Sent Events with status changes and results of tasks
+    GET /result/{task_id}/stream - Server-Sent Events with model output as it is generated
     GET /result/{task_id} - Get processing result by task ID
     GET /health - Health check endpoint
+    GET /metrics - Prometheus metrics (stage latencies, tasks, caches, model calls)
 
 Usage:
     OPENAI_API_KEY=... uvicorn api_server:app --host 0.0.0.0 --port 8000
+
+With JOB_QUEUE=sqlite (and TASK_STORE=sqlite) uploads are only queued here
+and processed by separate worker processes (see job_queue.py, worker.py):
+    JOB_QUEUE=sqlite TASK_STORE=sqlite python -m worker --concurrency 4
 """
 from __future__ import annotations
 
 import asyncio
+import functools
+import hashlib
+import json
 import os
+import time
 import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
-from typing import Dict, Optional
-
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
-from fastapi.responses import JSONResponse
-from openai import OpenAI
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set, Tuple
 
-from pdf_utils import extract_pdf_text
-from prompt_utils import build_messages
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from extraction_cache import file_sha256, get_extraction_cache
+from fair_queue import PRIORITIES, FairQueue
+from job_queue import JOB_POLL_INTERVAL, JOB_QUEUE_BACKEND, get_job_queue
+from llm_client import call_model, call_model_stream, close_client, get_client, usage_stats
+from llm_scheduler import LLM_COMPLETION_TOKENS_ESTIMATE, ModelScheduler
+from metrics import PDF_PAGES, REGISTRY, REPLY_REPAIRS, TASK_STAGE_SECONDS, TASKS_COALESCED, TASKS_FINISHED
+from pdf_utils import count_pdf_pages, extract_page_range, join_pages, page_ranges
+from map_reduce import MAP_MAX_PARALLEL, fits_context, split_into_chunks
+from tokens import count_message_tokens
+from prompt_utils import build_map_messages, build_messages, build_reduce_messages, preload_rules
+from reply_schema import (
+    JSON_REPAIR_ATTEMPTS,
+    all_unknown,
+    build_repair_messages,
+    invalid_fields,
+    merge_reply,
+    parse_reply,
+    prompt_criteria,
+)
+from response_cache import get_response_cache, make_cache_key
+from rules_registry import get_rules_registry
+from task_store import FINISHED_STATUSES, TASK_STORE_BACKEND, get_batch_store, get_task_store
 from dotenv import load_dotenv 
 
 load_dotenv()
 
-app = FastAPI(title="PDF Processing API", version="1.0.0")
+# Настройки исполнения (переопределяются переменными окружения)
+# Извлечение текста из PDF — CPU-bound, выполняется в пуле процессов
+MAX_CONCURRENT_EXTRACTIONS = int(os.getenv("MAX_CONCURRENT_EXTRACTIONS", "2"))
+# Вызовы модели — блокирующий I/O, выполняются в ограниченном пуле потоков
+# через планировщик с лимитами RPM/TPM и повторами (см. llm_scheduler.py)
+MAX_CONCURRENT_MODEL_CALLS = int(os.getenv("MAX_CONCURRENT_MODEL_CALLS", "8"))
+# Предельный размер загружаемого PDF; проверяется по ходу записи на диск
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+PDF_MAGIC = b"%PDF-"
+# Максимальное число файлов в одном запросе POST /batch
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "100"))
+# Интервал keep-alive комментариев в потоке /events, сек
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+# Как часто частичный ответ модели сохраняется в запись задачи (partial_result), сек
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "1"))
+# Сколько задач обрабатывается одновременно (JOB_QUEUE=inline); остальные ждут в очереди
+# по приоритету и по кругу между отправителями (см. fair_queue.py)
+MAX_ACTIVE_TASKS = int(
+    os.getenv("MAX_ACTIVE_TASKS", str(MAX_CONCURRENT_MODEL_CALLS + MAX_CONCURRENT_EXTRACTIONS))
+)
+# Формат ответа задачи: "json" — структурированная оценка эксперта (см. reply_schema.py)
+OUTPUT_FORMATS = ("text", "json")
+
+# Пулы и семафоры создаются при старте приложения (см. lifespan)
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+_model_pool: Optional[ThreadPoolExecutor] = None
+_extraction_slots: Optional[asyncio.Semaphore] = None
+_scheduler: Optional[ModelScheduler] = None
+_extractions_running = 0
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_tasks: Set[asyncio.Task] = set()
+
+# Очередь задач, ожидающих начала обработки (JOB_QUEUE=inline), и их аргументы
+_waiting = FairQueue()
+_waiting_args: Dict[str, tuple] = {}
+_active_tasks = 0
+# Скользящее среднее времени обработки задачи, сек (для оценки ожидания)
+_task_seconds: Optional[float] = None
+# Снимок позиций в очереди JOB_QUEUE=sqlite: (время, позиции, выполняется, среднее время)
+_queue_snapshot: Optional[tuple] = None
+
+# Объединение одинаковых задач (JOB_QUEUE=inline): отпечаток -> ведущая задача,
+# ведущая задача -> присоединённые к ней задачи
+_inflight: Dict[str, str] = {}
+_followers: Dict[str, List[str]] = {}
+# Поля результата, которые получают присоединённые задачи
+SHARED_FIELDS = ("status", "result", "parsed", "invalid_fields", "error", "cached", "pages")
+
+# Событие "какая-то задача изменилась": при каждом изменении текущее событие
+# взводится и заменяется новым, так что подписчики /events просыпаются без опроса
+_task_changed = asyncio.Event()
+
+
+@asynccontextmanager
+async def runtime():
+    """
+    Create execution pools, the scheduler and the LLM client, release them on
+    exit. Used by the API server (see lifespan) and by queue workers.
+    """
+    global _extraction_pool, _model_pool, _extraction_slots, _scheduler
+
+    _extraction_pool = ProcessPoolExecutor(max_workers=MAX_CONCURRENT_EXTRACTIONS)
+    _model_pool = ThreadPoolExecutor(
+        max_workers=MAX_CONCURRENT_MODEL_CALLS, thread_name_prefix="model-call"
+    )
+    _extraction_slots = asyncio.Semaphore(MAX_CONCURRENT_EXTRACTIONS)
+    _scheduler = ModelScheduler(_model_pool, MAX_CONCURRENT_MODEL_CALLS)
+
+    # Индекс рекомендаций строится один раз при старте, а не в первом запросе
+    preload_rules()
+
+    # Прогреваем общий клиент, чтобы первый запрос не платил за его создание
+    try:
+        get_client()
+    except RuntimeError as e:
+        print(f"Предупреждение: LLM-клиент не создан при старте: {e}")
+
+    try:
+        yield
+    finally:
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+        _model_pool.shutdown(wait=False, cancel_futures=True)
+        close_client()
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            response_cache.close()
+        task_results.close()
+        batch_results.close()
+        if JOB_QUEUE_BACKEND == "sqlite":
+            get_job_queue().close()
+
+
+async def _watch_task_store() -> None:
+    """
+    Wake /events subscribers when another process (a queue worker) changes
+    a task: the store is polled every JOB_POLL_INTERVAL seconds.
+    """
+    version = task_results.data_version()
+    while True:
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+        current = task_results.data_version()
+        if current != version:
+            version = current
+            notify_task_changed()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the runtime (and the task store watcher in queue mode) for the app."""
+    if JOB_QUEUE_BACKEND not in ("inline", "sqlite"):
+        raise RuntimeError(f"Unknown JOB_QUEUE backend: {JOB_QUEUE_BACKEND}")
+    if JOB_QUEUE_BACKEND == "sqlite" and TASK_STORE_BACKEND != "sqlite":
+        raise RuntimeError("JOB_QUEUE=sqlite requires TASK_STORE=sqlite (tasks are shared with workers)")
+
+    async with runtime():
+        watcher = None
+        if JOB_QUEUE_BACKEND == "sqlite":
+            get_job_queue()
+            watcher = asyncio.create_task(_watch_task_store())
+        try:
+            yield
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+
+class BodySizeLimitMiddleware:
+    """
+    Reject upload requests larger than their limit with 413 before FastAPI
+    parses the multipart form (which would spool the whole body to disk):
+    by Content-Length up front, and by counting body bytes as they arrive
+    for requests without it. `limits` maps a path to its limit in bytes;
+    `slack` allows for multipart headers and the other form fields.
+    """
+
+    def __init__(self, app, limits: Dict[str, int], slack: int = UPLOAD_CHUNK_SIZE):
+        self.app = app
+        self.limits = limits
+        self.slack = slack
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if limit is None or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        allowed = limit + self.slack
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > allowed:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > allowed:
+                    # Отвечаем сразу, а приложению сообщаем об обрыве, чтобы оно бросило разбор формы
+                    rejected = True
+                    await self._reject(send, limit)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+    @staticmethod
+    async def _reject(send, limit: int) -> None:
+        body = json.dumps({"detail": f"Request is larger than {limit // (1024 * 1024)} MB"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
 
-# In-memory storage for task results
-# In production, use a proper database or cache (Redis, etc.)
-task_results: Dict[str, Dict] = {}
+
+app = FastAPI(title="PDF Processing API", version="1.0.0", lifespan=lifespan)
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={"/upload": MAX_UPLOAD_BYTES, "/batch": MAX_BATCH_FILES * MAX_UPLOAD_BYTES},
+)
+
+# Task records (status, result, error); bounded and optionally persisted,
+# see task_store.py
+# С очередью задачи, прерванные перезапуском API, доделывают воркеры — ошибкой их не помечаем
+task_results = get_task_store(recover_interrupted=JOB_QUEUE_BACKEND == "inline")
+batch_results = get_batch_store(recover_interrupted=JOB_QUEUE_BACKEND == "inline")
+
+
+def _cache_counters():
+    for name, cache in (("extraction", get_extraction_cache()), ("response", get_response_cache())):
+        if cache is not None:
+            stats = cache.stats()
+            yield {"cache": name, "result": "hit"}, stats["hits"]
+            yield {"cache": name, "result": "miss"}, stats["misses"]
+
+
+def _waiting_tasks() -> int:
+    if JOB_QUEUE_BACKEND == "sqlite":
+        return get_job_queue().stats()["queued"]
+    return len(_waiting)
+
+
+# Значения, которые уже считаются в других местах, читаются при каждом запросе /metrics
+REGISTRY.collected(
+    "grant_tasks", "Tasks in the task store, by status.",
+    lambda: [({"status": s}, n) for s, n in Counter(t["status"] for t in task_results.list()).items()],
+)
+REGISTRY.collected("grant_tasks_waiting", "Tasks waiting to start processing.", _waiting_tasks)
+REGISTRY.collected(
+    "grant_cache_requests_total", "Extraction and response cache lookups by result.",
+    lambda: list(_cache_counters()), type="counter",
+)
+REGISTRY.collected(
+    "grant_llm_tokens_total", "Tokens reported by the model provider (prompt, completion, cached).",
+    lambda: [({"kind": k.replace("_tokens", "")}, v) for k, v in usage_stats().items() if k != "calls"],
+    type="counter",
+)
+REGISTRY.collected("grant_extractions_in_flight", "PDF extractions running now.", lambda: _extractions_running)
+REGISTRY.collected(
+    "grant_model_calls_in_flight", "Model calls running now.",
+    lambda: _scheduler.running if _scheduler is not None else None,
+)
+REGISTRY.collected(
+    "grant_model_calls_queued", "Model calls waiting for a slot or the rate budget.",
+    lambda: _scheduler.queued if _scheduler is not None else None,
+)
+REGISTRY.collected(
+    "grant_model_retries_total", "Model call retries (429, timeouts, 5xx).",
+    lambda: _scheduler.retries if _scheduler is not None else None, type="counter",
+)
+REGISTRY.collected(
+    "grant_model_rate_limited_total", "Model calls rejected with 429.",
+    lambda: _scheduler.rate_limited if _scheduler is not None else None, type="counter",
+)
 
 # Temporary directory for uploaded files
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 
-'''def call_model(messages, model: str = "gpt-5-mini", temperature: float = 0.2) -> str:
+async def save_upload(file: UploadFile, dest: Path) -> str:
     """
-    Call the OpenAI chat completion API and return the assistant reply text.
+    Stream an uploaded file to `dest` chunk by chunk and return its SHA-256.
+
+    The whole file is never held in memory. Raises HTTPException 413 as soon
+    as MAX_UPLOAD_BYTES is exceeded and 400 if the content does not start with
+    the PDF signature; in both cases the partial file is removed.
     """
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY is not set in the environment.")
+    loop = asyncio.get_running_loop()
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest, "wb") as f:
+            first = True
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if first:
+                    if not chunk.startswith(PDF_MAGIC):
+                        raise HTTPException(status_code=400, detail="File content is not a PDF")
+                    first = False
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB",
+                    )
+                digest.update(chunk)
+                await loop.run_in_executor(None, f.write, chunk)
+            if first:
+                raise HTTPException(status_code=400, detail="Uploaded file is empty")
+    except HTTPException:
+        dest.unlink(missing_ok=True)
+        raise
+    except Exception as e:
+        dest.unlink(missing_ok=True)
+        raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+    return digest.hexdigest()
+
+
+def notify_task_changed() -> None:
+    """Wake up /events subscribers."""
+    global _task_changed
+    changed, _task_changed = _task_changed, asyncio.Event()
+    changed.set()
 
-    client = OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-    )
-    return response.choices[0].message.content'''
 
-#Вариант через Openrouter
-def call_model(messages, model: str = "openai/gpt-4o", temperature: float = 0.2) -> str:
+def set_task_state(task_id: str, **fields) -> None:
+    """Update a task record and wake up /events subscribers."""
+    task_results.update(task_id, **fields)
+    notify_task_changed()
+
+
+class OutputStream:
     """
-    Call OpenRouter (OpenAI-compatible) chat completion API and return assistant reply text.
+    Model output of one task while it is being generated.
+
+    Fragments are appended on the event loop (the model thread hands them
+    over with call_soon_threadsafe); readers keep their own offset into
+    `parts` and wait on `changed`, which is replaced after every append.
     """
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENROUTER_API_KEY is not set in the environment.")
 
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://openrouter.ai/api/v1",
-        # Рекомендуемые OpenRouter заголовки (идентификация приложения)
-        default_headers={
-            "HTTP-Referer": os.getenv("OPENROUTER_SITE_URL", "https://cu-grant-analyzis-project.onrender.com"),
-            "X-Title": os.getenv("OPENROUTER_APP_NAME", "CU Grant Analysis Project"),
-        },
+    def __init__(self):
+        self.parts: List[str] = []
+        self.finished = False
+        self.changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def append(self, delta: str) -> None:
+        self.parts.append(delta)
+        self._notify()
+
+    def finish(self) -> None:
+        self.finished = True
+        self._notify()
+
+
+# Потоки вывода задач, для которых модель сейчас генерирует ответ
+_output_streams: Dict[str, OutputStream] = {}
+
+
+async def call_model_streaming(
+    task_id: str,
+    messages,
+    model: str,
+    temperature: float,
+    usage: Optional[Dict[str, int]] = None,
+    json_output: bool = False,
+    **schedule,
+) -> str:
+    """
+    Run a streaming model call through the scheduler, relaying fragments to
+    /result/{task_id}/stream readers and periodically to `partial_result`.
+    A failed call is retried only if no fragment has been delivered yet.
+    """
+    loop = asyncio.get_running_loop()
+    output = OutputStream()
+    _output_streams[task_id] = output
+    last_flush = loop.time()
+
+    def on_fragment(delta: str) -> None:
+        nonlocal last_flush
+        output.append(delta)
+        if loop.time() - last_flush >= STREAM_FLUSH_INTERVAL:
+            last_flush = loop.time()
+            set_task_state(task_id, partial_result="".join(output.parts))
+
+    try:
+        return await _scheduler.run(
+            lambda: call_model_stream(
+                messages,
+                lambda delta: loop.call_soon_threadsafe(on_fragment, delta),
+                model=model,
+                temperature=temperature,
+                usage=usage,
+                json_output=json_output,
+            ),
+            can_retry=lambda: not output.parts,
+            **schedule,
+        )
+    finally:
+        _output_streams.pop(task_id, None)
+        # Даём дойти фрагментам, поставленным в очередь из потока модели
+        await asyncio.sleep(0)
+        output.finish()
+
+
+async def run_model_call(
+    task_id: str,
+    messages,
+    model: str,
+    temperature: float,
+    usage: Optional[Dict[str, int]] = None,
+    stream: bool = False,
+    start_message: str = "Calling OpenAI API...",
+    json_output: bool = False,
+) -> str:
+    """
+    One model call of a task through the scheduler (queue, RPM/TPM budget,
+    retries). The task message shows the queue and retries while it waits.
+    """
+    loop = asyncio.get_running_loop()
+    tokens = await loop.run_in_executor(None, count_message_tokens, messages)
+
+    def on_retry(attempt: int, delay: float, error: Exception) -> None:
+        set_task_state(
+            task_id,
+            message=f"Model call failed ({error.__class__.__name__}), retry {attempt} in {delay:.0f}s...",
+        )
+
+    schedule = dict(
+        tokens=tokens + LLM_COMPLETION_TOKENS_ESTIMATE,
+        on_start=lambda: set_task_state(task_id, message=start_message),
+        on_retry=on_retry,
+    )
+    if stream:
+        return await call_model_streaming(
+            task_id, messages, model, temperature, usage, json_output, **schedule
+        )
+    return await _scheduler.run(
+        lambda: call_model(
+            messages, model=model, temperature=temperature, usage=usage, json_output=json_output
+        ),
+        **schedule,
     )
 
-    # Увеличенный таймаут для больших PDF и сложных промптов
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        timeout=300,  # 5 минут таймаут для API вызова
-        # Примечание: некоторые модели/провайдеры в OpenRouter могут не поддерживать temperature.
-        # Если словишь 400 — попробуй убрать temperature полностью.
-        # temperature=0.2,
+
+async def structure_reply(
+    task_id: str,
+    messages,
+    reply: str,
+    model: str,
+    temperature: float,
+    usage: Optional[Dict[str, int]] = None,
+    reask: bool = True,
+) -> Tuple[str, Optional[Dict], List[str]]:
+    """
+    Turn a model reply into the structured evaluation (see reply_schema.py).
+
+    The reply is repaired locally first (code fences, cut-off JSON); fields
+    that are still missing or invalid are asked for again, up to
+    JSON_REPAIR_ATTEMPTS times, with the same messages as a cached prefix,
+    instead of re-running the whole evaluation. Returns the reply as
+    normalized JSON text, the parsed object and the fields left invalid.
+    """
+    criteria = prompt_criteria(messages)
+    data, repairs = parse_reply(reply)
+    for kind in repairs:
+        REPLY_REPAIRS.inc(kind=kind)
+    problems = invalid_fields(data, criteria)
+    attempts = JSON_REPAIR_ATTEMPTS if reask else 0
+    while problems and attempts > 0:
+        attempts -= 1
+        REPLY_REPAIRS.inc(kind="reask")
+        fix = await run_model_call(
+            task_id, build_repair_messages(messages, reply, problems), model, temperature, usage,
+            start_message=f"Re-asking the model for reply fields: {', '.join(problems)}...",
+            json_output=True,
+        )
+        data = merge_reply(data, parse_reply(fix)[0], criteria)
+        problems = invalid_fields(data, criteria)
+    if data is None:
+        # Ничего не удалось разобрать — отдаём ответ как есть, UI покажет его текстом
+        REPLY_REPAIRS.inc(kind="failed")
+        return reply, None, problems
+    if problems:
+        REPLY_REPAIRS.inc(kind="failed")
+    return json.dumps(data, ensure_ascii=False), data, problems
+
+
+async def evaluate_chunked(
+    task_id: str,
+    pdf_text: str,
+    prompt: str,
+    organization: str,
+    model: str,
+    temperature: float,
+    stream: bool = False,
+    usage: Optional[Dict[str, int]] = None,
+    json_output: bool = False,
+) -> Tuple[str, Optional[Dict], List[str]]:
+    """
+    Map-reduce evaluation of a document that does not fit into one request.
+
+    Chunks are evaluated concurrently (at most MAP_MAX_PARALLEL per task,
+    within the shared scheduler limits), then one reduce call builds the
+    answer. Returns the answer as `structure_reply` does (with `json_output`
+    the reduce reply is validated and repaired, otherwise it is returned as is).
+    """
+    loop = asyncio.get_running_loop()
+    chunks = await loop.run_in_executor(None, split_into_chunks, pdf_text)
+    total = len(chunks)
+    done = 0
+    map_slots = asyncio.Semaphore(MAP_MAX_PARALLEL)
+    set_task_state(task_id, message=f"Document is too long for one request, analysing {total} fragments...")
+
+    async def map_chunk(index: int, chunk: str) -> str:
+        nonlocal done
+        messages = await loop.run_in_executor(
+            None, functools.partial(build_map_messages, chunk, prompt, index, total, organization=organization)
+        )
+        async with map_slots:
+            note = await run_model_call(
+                task_id, messages, model, temperature, usage,
+                start_message=f"Analysing fragments ({done}/{total} done)...",
+            )
+        done += 1
+        set_task_state(task_id, message=f"Analysed {done}/{total} fragments...")
+        return note or ""
+
+    notes = await asyncio.gather(*(map_chunk(i, c) for i, c in enumerate(chunks, start=1)))
+
+    messages = await loop.run_in_executor(
+        None, functools.partial(build_reduce_messages, notes, prompt, organization=organization)
+    )
+    reply = await run_model_call(
+        task_id, messages, model, temperature, usage, stream,
+        start_message="Combining fragment notes...", json_output=json_output,
     )
+    if not json_output:
+        return reply, None, []
+    return await structure_reply(task_id, messages, reply, model, temperature, usage)
+
+
+@contextmanager
+def stage(timings: Dict[str, float], name: str) -> Iterator[None]:
+    """Record the duration of a pipeline stage in `timings` (seconds)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(timings.get(name, 0) + time.perf_counter() - started, 3)
+
 
-    return response.choices[0].message.content
+def record_task_metrics(status: str, timings: Dict[str, float], pages: Optional[int]) -> None:
+    TASKS_FINISHED.inc(status=status)
+    for name, seconds in timings.items():
+        TASK_STAGE_SECONDS.observe(seconds, stage=name)
+    if pages is not None:
+        PDF_PAGES.observe(pages)
 
 
 async def process_pdf_task(
@@ -94,52 +613,418 @@ async def process_pdf_task(
     temperature: float = 0.2,
     organization: str = "ФПИ",
     pdf_type: str = "application",
+    bypass_cache: bool = False,
+    content_hash: Optional[str] = None,
+    stream: bool = False,
+    output_format: str = "text",
 ):
     """
     Asynchronously process PDF file and store result.
+
+    Blocking work never runs on the event loop: text extraction is sent to
+    the process pool (page ranges of a large document in parallel), building the messages (rules retrieval) and the model
+    call to the thread pool. Extraction is
+    gated by a semaphore, model calls by the scheduler (queue, rate budget,
+    retries of 429/5xx), so waiting tasks stay "processing" with a message.
+
+    Stage durations (queued, extraction, build_messages, model, total), the
+    page count and token usage are stored in the task and in the metrics.
+    With output_format="json" the reply is requested as JSON, validated and
+    repaired (`structure_reply`); the parsed object is stored as `parsed`.
     """
+    global _extractions_running
+    loop = asyncio.get_running_loop()
+    timings: Dict[str, float] = {}
+    pages: Optional[int] = None
+    json_output = output_format == "json"
+    task_data = task_results.get(task_id)
+    if task_data is not None and task_data.get("created_at"):
+        # created_at — время постановки задачи (в режиме очереди его записал процесс API)
+        timings["queued"] = round(max(time.time() - task_data["created_at"], 0.0), 3)
+    started = time.perf_counter()
     try:
-        # Update task status
-        task_results[task_id]["status"] = "processing"
-        task_results[task_id]["message"] = "Extracting text from PDF..."
+        # Extract text from PDF (or take it from the extraction cache)
+        set_task_state(task_id, status="processing")
+        with stage(timings, "extraction"):
+            pdf_text = None
+            extraction_cache = get_extraction_cache()
+            if extraction_cache is not None:
+                if content_hash is None:
+                    content_hash = await loop.run_in_executor(None, file_sha256, pdf_path)
+                text_key = extraction_cache.make_key(content_hash, pdf_type)
+                pdf_text = await loop.run_in_executor(None, extraction_cache.get, text_key)
+            pages = await loop.run_in_executor(None, count_pdf_pages, pdf_path)
 
-        # Extract text from PDF
-        pdf_text = extract_pdf_text(pdf_path, type=pdf_type)
+            if pdf_text is None:
+                async with _extraction_slots:
+                    set_task_state(task_id, message="Extracting text from PDF...")
+                    _extractions_running += 1
+                    try:
+                        # Диапазоны страниц большого документа извлекаются параллельно
+                        # в общем пуле процессов, а не во вложенном пуле на каждый документ
+                        parts = await asyncio.gather(*(
+                            loop.run_in_executor(
+                                _extraction_pool, extract_page_range, str(pdf_path), pdf_type, start, stop
+                            )
+                            for start, stop in page_ranges(pages)
+                        ))
+                    finally:
+                        _extractions_running -= 1
+                pdf_text = join_pages(text for part in parts for text in part)
+                if extraction_cache is not None:
+                    await loop.run_in_executor(None, extraction_cache.put, text_key, pdf_text)
 
-        # Update status
-        task_results[task_id]["message"] = "Calling OpenAI API..."
+        # Build messages and call model (or take the reply from the response cache)
+        with stage(timings, "build_messages"):
+            # Выбор разделов рекомендаций (BM25) занимает CPU — не на цикле событий
+            messages = await loop.run_in_executor(
+                None, functools.partial(build_messages, pdf_text, prompt, organization=organization)
+            )
+        with stage(timings, "model"):
+            result = None
+            parsed: Optional[Dict] = None
+            problems: List[str] = []
+            response_cache = get_response_cache()
+            if response_cache is not None:
+                reply_key = make_cache_key(messages, model, temperature, json_output)
+                if not bypass_cache:
+                    result = await loop.run_in_executor(None, response_cache.get, reply_key)
 
-        # Build messages and call model
-        messages = build_messages(pdf_text, prompt, organization=organization)
-        result = call_model(messages, model=model, temperature=temperature)
+            cached = result is not None
+            usage: Dict[str, int] = {}
+            if cached and json_output:
+                # В кэш JSON-ответы попадают уже проверенными, повторно модель не спрашиваем
+                result, parsed, problems = await structure_reply(
+                    task_id, messages, result, model, temperature, reask=False
+                )
+            elif not cached:
+                if not await loop.run_in_executor(None, fits_context, messages):
+                    result, parsed, problems = await evaluate_chunked(
+                        task_id, pdf_text, prompt, organization, model, temperature, stream, usage, json_output
+                    )
+                else:
+                    set_task_state(task_id, message="Waiting for a free model slot...")
+                    result = await run_model_call(
+                        task_id, messages, model, temperature, usage, stream, json_output=json_output
+                    )
+                    if json_output:
+                        result, parsed, problems = await structure_reply(
+                            task_id, messages, result, model, temperature, usage
+                        )
+                # Итог map-reduce кэшируем под тем же ключом, что и ответ одного запроса.
+                # Ответ, который так и не удалось привести к схеме или в котором нет ни одного
+                # заполненного поля, не кэшируем
+                if response_cache is not None and result and not problems and not (
+                    json_output and all_unknown(parsed)
+                ):
+                    await loop.run_in_executor(None, response_cache.put, reply_key, result)
+        timings["total"] = round(time.perf_counter() - started, 3)
 
         # Store result
-        task_results[task_id]["status"] = "completed"
-        task_results[task_id]["result"] = result
-        task_results[task_id]["message"] = "Processing completed successfully"
+        set_task_state(
+            task_id,
+            status="completed",
+            result=result,
+            parsed=parsed,
+            invalid_fields=problems or None,
+            cached=cached,
+            usage=usage or None,
+            timings=timings,
+            pages=pages,
+            partial_result=None,
+            message=(
+                f"Processing completed, reply fields still invalid: {', '.join(problems)}"
+                if problems else "Processing completed successfully"
+            ),
+        )
+        record_task_metrics("completed", timings, pages)
 
         # Clean up uploaded file
         if pdf_path.exists():
             pdf_path.unlink()
 
     except Exception as e:
-        task_results[task_id]["status"] = "error"
-        task_results[task_id]["error"] = str(e)
-        task_results[task_id]["message"] = f"Error during processing: {str(e)}"
+        timings["total"] = round(time.perf_counter() - started, 3)
+        set_task_state(
+            task_id,
+            status="error",
+            error=str(e),
+            timings=timings,
+            pages=pages,
+            message=f"Error during processing: {str(e)}",
+        )
+        record_task_metrics("error", timings, pages)
 
         # Clean up uploaded file on error
         if pdf_path.exists():
             pdf_path.unlink()
 
 
+def validate_task_params(
+    organization: str, pdf_type: str, priority: str = "normal", output_format: str = "text"
+) -> None:
+    """Raise HTTPException 400 for an unknown organization, pdf_type, priority or output_format."""
+    # Validate organization parameter (organizations come from parsed_texts/organizations.json)
+    organizations = get_rules_registry().names()
+    if organization not in organizations:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"organization must be one of: {', '.join(organizations)}"
+        )
+
+    # Validate pdf_type parameter
+    if pdf_type not in ["application", "presentation"]:
+        raise HTTPException(
+            status_code=400,
+            detail="pdf_type must be either 'application' or 'presentation'"
+        )
+
+    if priority not in PRIORITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"priority must be one of: {', '.join(PRIORITIES)}"
+        )
+
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"output_format must be one of: {', '.join(OUTPUT_FORMATS)}"
+        )
+
+
+def start_task(
+    task_id: str,
+    pdf_path: Path,
+    prompt: str,
+    model: str,
+    temperature: float,
+    organization: str,
+    pdf_type: str,
+    bypass_cache: bool,
+    content_hash: Optional[str] = None,
+    stream: bool = False,
+    priority: str = "normal",
+    submitter: str = "",
+    output_format: str = "text",
+    **extra,
+) -> None:
+    """
+    Register a pending task and queue it for processing on the shared pools
+    or, with JOB_QUEUE=sqlite, put it into the job queue for the workers.
+    Tasks start by priority, then round-robin across submitters.
+
+    A task identical to one that is still queued or running (same PDF
+    content and parameters) is not processed again: it is attached to that
+    task, which takes over the higher of the two priorities, and receives
+    its result (see `share_result`).
+    """
+    task_results.create(task_id, {
+        "status": "pending",
+        "message": "Task created, waiting to start processing",
+        "result": None,
+        "error": None,
+        "cached": False,
+        "priority": priority,
+        "submitter": submitter,
+        **extra,
+    })
+    fingerprint = None
+    if content_hash is not None:
+        fingerprint = task_fingerprint(
+            content_hash, prompt, model, temperature, organization, pdf_type, bypass_cache, output_format
+        )
+
+    if JOB_QUEUE_BACKEND == "sqlite":
+        leader_id = get_job_queue().enqueue(task_id, {
+            "pdf_path": str(pdf_path),
+            "prompt": prompt,
+            "model": model,
+            "temperature": temperature,
+            "organization": organization,
+            "pdf_type": pdf_type,
+            "bypass_cache": bypass_cache,
+            "content_hash": content_hash,
+            "stream": stream,
+            "output_format": output_format,
+        }, priority=PRIORITIES[priority], group=submitter, fingerprint=fingerprint)
+        if leader_id is not None:
+            attach_to_task(task_id, leader_id, pdf_path)
+        return
+
+    leader_id = _inflight.get(fingerprint) if fingerprint is not None else None
+    if leader_id is not None:
+        _followers.setdefault(leader_id, []).append(task_id)
+        # Срочная задача не должна ждать за пакетом, к задаче которого присоединилась
+        _waiting.raise_priority(leader_id, PRIORITIES[priority])
+        attach_to_task(task_id, leader_id, pdf_path)
+        return
+    if fingerprint is not None:
+        _inflight[fingerprint] = task_id
+
+    _waiting_args[task_id] = (
+        task_id, pdf_path, prompt, model, temperature, organization, pdf_type, bypass_cache,
+        content_hash, stream, output_format,
+    )
+    _waiting.push(task_id, PRIORITIES[priority], submitter)
+    dispatch_waiting()
+
+
+def dispatch_waiting() -> None:
+    """Start waiting tasks while fewer than MAX_ACTIVE_TASKS are being processed."""
+    global _active_tasks
+    loop = asyncio.get_running_loop()
+    while _active_tasks < MAX_ACTIVE_TASKS:
+        task_id = _waiting.pop()
+        if task_id is None:
+            break
+        _active_tasks += 1
+        started = loop.time()
+        task = asyncio.create_task(process_pdf_task(*_waiting_args.pop(task_id)))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        task.add_done_callback(lambda _, task_id=task_id: _release_followers(task_id))
+        task.add_done_callback(lambda _, started=started: _task_finished(loop.time() - started))
+
+
+def task_fingerprint(
+    content_hash: str,
+    prompt: str,
+    model: str,
+    temperature: float,
+    organization: str,
+    pdf_type: str,
+    bypass_cache: bool,
+    output_format: str = "text",
+) -> str:
+    """Identify a task by everything that influences its result."""
+    # bypass_cache входит в отпечаток: такая задача не должна получать ответ обычной (и наоборот)
+    raw = json.dumps(
+        [content_hash, prompt, model, temperature, organization, pdf_type, bypass_cache, output_format],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def attach_to_task(task_id: str, leader_id: str, pdf_path: Path) -> None:
+    """Mark `task_id` as waiting for the result of the identical task `leader_id`."""
+    # Файл не понадобится: PDF обработает ведущая задача
+    pdf_path.unlink(missing_ok=True)
+    set_task_state(
+        task_id,
+        coalesced_with=leader_id,
+        message=f"Identical task {leader_id} is already in progress, waiting for its result",
+    )
+    TASKS_COALESCED.inc()
+
+
+def share_result(leader_id: str, followers: List[str]) -> None:
+    """Copy the final state of task `leader_id` to the tasks attached to it."""
+    if not followers:
+        return
+    leader = task_results.get(leader_id)
+    if leader is not None and leader["status"] in FINISHED_STATUSES:
+        fields = {name: leader.get(name) for name in SHARED_FIELDS}
+        fields["message"] = f"Result shared from identical task {leader_id}"
+    else:
+        fields = {
+            "status": "error",
+            "error": f"Identical task {leader_id} did not finish",
+            "message": f"Identical task {leader_id} did not finish",
+        }
+    for follower_id in followers:
+        set_task_state(follower_id, **fields)
+        TASKS_FINISHED.inc(status=fields["status"])
+
+
+def _release_followers(task_id: str) -> None:
+    fingerprint = next((f for f, leader_id in _inflight.items() if leader_id == task_id), None)
+    if fingerprint is not None:
+        del _inflight[fingerprint]
+    share_result(task_id, _followers.pop(task_id, []))
+
+
+def _task_finished(seconds: float) -> None:
+    global _active_tasks, _task_seconds
+    _active_tasks -= 1
+    # Скользящее среднее: новые задачи весят больше старых
+    _task_seconds = seconds if _task_seconds is None else 0.8 * _task_seconds + 0.2 * seconds
+    dispatch_waiting()
+
+
+def queue_info(task_id: str) -> Optional[Dict]:
+    """
+    Position of a pending task in the queue (0 = next to start) and the
+    estimated wait in seconds (None until some task has finished).
+    """
+    global _queue_snapshot
+    if JOB_QUEUE_BACKEND == "sqlite":
+        loop_time = asyncio.get_running_loop().time()
+        # Позиции считаются по всей очереди — не чаще раза в JOB_POLL_INTERVAL
+        if _queue_snapshot is None or loop_time - _queue_snapshot[0] >= JOB_POLL_INTERVAL:
+            _queue_snapshot = (loop_time, *get_job_queue().positions())
+        _, positions, running, avg_seconds = _queue_snapshot
+        position = positions.get(task_id)
+        parallel = max(running, 1)
+    else:
+        position = _waiting.position(task_id)
+        avg_seconds = _task_seconds
+        parallel = MAX_ACTIVE_TASKS
+    if position is None:
+        return None
+    estimated_wait = None
+    if avg_seconds is not None:
+        estimated_wait = round((position + 1) * avg_seconds / parallel, 1)
+    return {"queue_position": position, "estimated_wait": estimated_wait}
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "ok", "message": "API is running"}
+    response = {"status": "ok", "message": "API is running", "tasks_stored": len(task_results)}
+    cache = get_extraction_cache()
+    if cache is not None:
+        response["extraction_cache"] = cache.stats()
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        response["response_cache"] = response_cache.stats()
+    response["llm_usage"] = usage_stats()
+    if _scheduler is not None:
+        response["model_scheduler"] = _scheduler.stats()
+    if JOB_QUEUE_BACKEND == "sqlite":
+        response["job_queue"] = get_job_queue().stats()
+    else:
+        response["task_queue"] = {
+            "waiting": len(_waiting),
+            "active": _active_tasks,
+            "max_active": MAX_ACTIVE_TASKS,
+            "avg_task_seconds": round(_task_seconds, 1) if _task_seconds is not None else None,
+        }
+    return response
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics of this process (text exposition format)."""
+    loop = asyncio.get_running_loop()
+    # Сборщики читают хранилище задач и кэши — не блокируем event loop
+    body = await loop.run_in_executor(None, REGISTRY.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/organizations")
+async def list_organizations():
+    """
+    Organizations (funding programs) known to the server, with the token
+    count and hash of their current rules. Read from the manifest on every
+    call, so newly added programs appear without a restart.
+    """
+    registry = get_rules_registry()
+    return {"default": registry.default, "organizations": registry.list()}
 
 
 @app.post("/upload")
 async def upload_pdf(
+    request: Request,
     file: UploadFile = File(..., description="PDF file to process"),
     prompt: Optional[str] = Form(
         default="Сделай краткую суммаризацию проекта, представленного в документе.",
@@ -152,11 +1037,26 @@ async def upload_pdf(
         default=0.2, description="Sampling temperature (0.0-2.0)"
     ),
     organization: Optional[str] = Form(
-        default="ФПИ", description="Организация: 'ФПИ' или 'ЦУ'"
+        default="ФПИ", description="Организация из GET /organizations (например, 'ФПИ' или 'ЦУ')"
     ),
     pdf_type: Optional[str] = Form(
         default="application", description="Тип PDF: 'application' или 'presentation'"
     ),
+    bypass_cache: Optional[bool] = Form(
+        default=False, description="Не брать ответ из кэша, а заново вызвать модель"
+    ),
+    stream: Optional[bool] = Form(
+        default=False, description="Получать ответ модели по мере генерации (GET /result/{task_id}/stream)"
+    ),
+    priority: Optional[str] = Form(
+        default="normal", description="Приоритет: 'high', 'normal' или 'low'"
+    ),
+    submitter: Optional[str] = Form(
+        default=None, description="Идентификатор эксперта/клиента для честной очереди (по умолчанию — IP клиента)"
+    ),
+    output_format: Optional[str] = Form(
+        default="text", description="Формат ответа: 'text' или 'json' (структурированная оценка с проверкой схемы)"
+    ),
 ):
     """
     Upload PDF file and start processing.
@@ -167,90 +1067,348 @@ async def upload_pdf(
     if not file.filename.endswith(".pdf"):
         raise HTTPException(status_code=400, detail="File must be a PDF")
 
+    validate_task_params(organization, pdf_type, priority, output_format)
+    submitter = submitter or (request.client.host if request.client else "")
+
     # Generate unique task ID
     task_id = str(uuid.uuid4())
 
-    # Save uploaded file
+    # Stream uploaded file to disk, hashing it on the fly
     file_path = UPLOAD_DIR / f"{task_id}.pdf"
-    try:
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+    content_hash = await save_upload(file, file_path)
 
-    # Initialize task result
-    task_results[task_id] = {
-        "status": "pending",
-        "message": "Task created, waiting to start processing",
-        "result": None,
-        "error": None,
-    }
+    start_task(
+        task_id, file_path, prompt, model, temperature, organization, pdf_type, bypass_cache,
+        content_hash, stream, priority=priority, submitter=submitter, output_format=output_format,
+    )
+
+    return JSONResponse(
+        status_code=202,
+        content={
+            "task_id": task_id,
+            "status": "pending",
+            "message": "File uploaded successfully, processing started",
+        },
+    )
+
+
+@app.post("/batch")
+async def upload_batch(
+    request: Request,
+    files: List[UploadFile] = File(..., description="PDF files to process"),
+    prompt: Optional[str] = Form(
+        default="Сделай краткую суммаризацию проекта, представленного в документе.",
+        description="User prompt for the model (shared by all files)",
+    ),
+    model: Optional[str] = Form(
+        default="openai/gpt-4o", description="OpenAI model to use"
+    ),
+    temperature: Optional[float] = Form(
+        default=0.2, description="Sampling temperature (0.0-2.0)"
+    ),
+    organization: Optional[str] = Form(
+        default="ФПИ", description="Организация из GET /organizations (например, 'ФПИ' или 'ЦУ')"
+    ),
+    pdf_type: Optional[str] = Form(
+        default="application", description="Тип PDF: 'application' или 'presentation'"
+    ),
+    bypass_cache: Optional[bool] = Form(
+        default=False, description="Не брать ответ из кэша, а заново вызвать модель"
+    ),
+    stream: Optional[bool] = Form(
+        default=False, description="Получать ответ модели по мере генерации (GET /result/{task_id}/stream)"
+    ),
+    priority: Optional[str] = Form(
+        default="low", description="Приоритет задач пакета: 'high', 'normal' или 'low'"
+    ),
+    submitter: Optional[str] = Form(
+        default=None, description="Идентификатор эксперта/клиента для честной очереди (по умолчанию — IP клиента)"
+    ),
+    output_format: Optional[str] = Form(
+        default="text", description="Формат ответа: 'text' или 'json' (структурированная оценка с проверкой схемы)"
+    ),
+):
+    """
+    Upload several PDF files with one shared prompt/model/organization/pdf_type.
 
-    # Validate organization parameter
-    if organization not in ["ФПИ", "ЦУ"]:
+    Every accepted file becomes a regular task processed on the shared pools.
+    A file that is rejected (not a PDF, too large) does not fail the whole
+    batch: it is reported with status "rejected" and its error.
+    Returns batch_id that can be used with GET /batch/{batch_id}.
+    """
+    if len(files) > MAX_BATCH_FILES:
         raise HTTPException(
-            status_code=400, 
-            detail="organization must be either 'ФПИ' or 'ЦУ'"
+            status_code=400, detail=f"At most {MAX_BATCH_FILES} files per batch"
         )
+    validate_task_params(organization, pdf_type, priority, output_format)
+    submitter = submitter or (request.client.host if request.client else "")
 
-    # Validate pdf_type parameter
-    if pdf_type not in ["application", "presentation"]:
-        raise HTTPException(
-            status_code=400,
-            detail="pdf_type must be either 'application' or 'presentation'"
+    batch_id = str(uuid.uuid4())
+    items = []
+    for file in files:
+        filename = file.filename or ""
+        if not filename.endswith(".pdf"):
+            items.append({"filename": filename, "task_id": None, "status": "rejected", "error": "File must be a PDF"})
+            continue
+
+        task_id = str(uuid.uuid4())
+        file_path = UPLOAD_DIR / f"{task_id}.pdf"
+        try:
+            content_hash = await save_upload(file, file_path)
+        except HTTPException as e:
+            items.append({"filename": filename, "task_id": None, "status": "rejected", "error": e.detail})
+            continue
+
+        start_task(
+            task_id, file_path, prompt, model, temperature, organization, pdf_type, bypass_cache,
+            content_hash, stream, priority=priority, submitter=submitter, output_format=output_format,
+            filename=filename, batch_id=batch_id,
         )
+        items.append({"filename": filename, "task_id": task_id, "status": "pending", "error": None})
 
-    # Start async processing
-    asyncio.create_task(
-        process_pdf_task(task_id, file_path, prompt, model, temperature, organization, pdf_type)
-    )
+    # Запись о пакете неизменяема: статус пакета вычисляется по его задачам в GET /batch
+    batch_results.create(batch_id, {"status": "completed", "message": "Batch submitted", "items": items})
 
     return JSONResponse(
         status_code=202,
         content={
-            "task_id": task_id,
-            "status": "pending",
-            "message": "File uploaded successfully, processing started",
+            "batch_id": batch_id,
+            "tasks": items,
+            "accepted": sum(1 for item in items if item["task_id"]),
+            "rejected": sum(1 for item in items if not item["task_id"]),
         },
     )
 
 
-@app.get("/result/{task_id}")
-async def get_result(task_id: str):
+@app.get("/batch/{batch_id}")
+async def get_batch(batch_id: str):
     """
-    Get processing result by task ID.
+    Aggregate status of a batch: per-file task statuses and counts by status.
 
-    Returns:
-        - If status is "completed": returns the result
-        - If status is "processing": returns current status
-        - If status is "error": returns error message
-        - If task_id not found: returns 404
+    The batch status is "completed" once every task has finished
+    (successfully or with an error), otherwise "processing".
     """
-    if task_id not in task_results:
-        raise HTTPException(status_code=404, detail="Task not found")
+    batch = batch_results.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    tasks = []
+    counts = {}
+    for item in batch["items"]:
+        entry = dict(item)
+        if item["task_id"]:
+            task_data = task_results.get(item["task_id"])
+            if task_data is None:
+                entry.update(status="expired", error="Task result is no longer stored")
+            else:
+                entry.update(status=task_data["status"], message=task_data.get("message", ""))
+                if task_data["status"] == "error":
+                    entry["error"] = task_data.get("error", "Unknown error")
+        tasks.append(entry)
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+
+    running = sum(
+        n for status, n in counts.items()
+        if status not in FINISHED_STATUSES and status not in ("rejected", "expired")
+    )
+    return {
+        "batch_id": batch_id,
+        "status": "processing" if running else "completed",
+        "total": len(tasks),
+        "counts": counts,
+        "tasks": tasks,
+    }
 
-    task_data = task_results[task_id]
 
+def task_payload(task_id: str, task_data: Dict) -> Dict:
+    """Public view of a task record, as returned by /result/{task_id} and /events."""
     if task_data["status"] == "completed":
-        return {
+        payload = {
             "task_id": task_id,
             "status": "completed",
             "result": task_data["result"],
+            "cached": task_data.get("cached", False),
+            "usage": task_data.get("usage"),
+            "pages": task_data.get("pages"),
+            "timings": task_data.get("timings"),
         }
+        if task_data.get("parsed") is not None:
+            # Структурированный ответ (output_format=json) и поля, которые не удалось починить
+            payload["parsed"] = task_data["parsed"]
+            payload["invalid_fields"] = task_data.get("invalid_fields") or []
     elif task_data["status"] == "error":
-        return {
+        payload = {
             "task_id": task_id,
             "status": "error",
             "error": task_data.get("error", "Unknown error"),
             "message": task_data.get("message", ""),
+            "timings": task_data.get("timings"),
         }
     else:
-        return {
+        payload = {
             "task_id": task_id,
             "status": task_data["status"],
             "message": task_data.get("message", "Processing in progress"),
         }
+        if task_data.get("partial_result"):
+            payload["partial_result"] = task_data["partial_result"]
+        if task_data["status"] == "pending":
+            payload.update(queue_info(task_id) or {})
+    if task_data.get("coalesced_with"):
+        payload["coalesced_with"] = task_data["coalesced_with"]
+    return payload
+
+
+@app.get("/result/{task_id}")
+async def get_result(task_id: str):
+    """
+    Get processing result by task ID.
+
+    Returns:
+        - If status is "completed": returns the result
+        - If status is "processing": returns current status
+        - If status is "error": returns error message
+        - If task_id not found: returns 404
+    """
+    task_data = task_results.get(task_id)
+    if task_data is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+
+    return task_payload(task_id, task_data)
+
+
+@app.get("/result/{task_id}/stream")
+async def stream_result(request: Request, task_id: str):
+    """
+    Server-Sent Events stream of the model output of one task.
+
+    "delta" events carry text fragments as the model generates them (a late
+    subscriber first gets everything generated so far in one delta), then a
+    "result" event with the same payload as /result/{task_id} and "done".
+    Tasks submitted without `stream=true` or answered from the cache produce
+    no deltas, only the final result. With JOB_QUEUE=sqlite the output is
+    generated by a worker process, and deltas follow `partial_result`
+    (every STREAM_FLUSH_INTERVAL seconds) instead of every fragment.
+    """
+    if task_results.get(task_id) is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return StreamingResponse(
+        _output_events(request, task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _output_events(request: Request, task_id: str) -> AsyncIterator[str]:
+    sent = 0
+    # Если ответ генерирует воркер другого процесса, фрагменты берём из partial_result
+    sent_chars = 0
+    output: Optional[OutputStream] = None
+    while True:
+        output = _output_streams.get(task_id, output)
+        changed = output.changed if output is not None else _task_changed
+        if output is not None and len(output.parts) > sent:
+            yield _sse("delta", {"task_id": task_id, "text": "".join(output.parts[sent:])})
+            sent = len(output.parts)
+
+        if output is None or output.finished:
+            task_data = task_results.get(task_id)
+            if task_data is None:
+                yield _sse("missing", {"task_id": task_id})
+                return
+            if task_data["status"] in FINISHED_STATUSES:
+                yield _sse("result", task_payload(task_id, task_data))
+                yield _sse("done", {})
+                return
+            partial = task_data.get("partial_result") or ""
+            if output is None and len(partial) > sent_chars:
+                yield _sse("delta", {"task_id": task_id, "text": partial[sent_chars:]})
+                sent_chars = len(partial)
+            if output is not None:
+                # Поток закончился, а итог ещё не записан — ждём изменения задачи
+                changed = _task_changed
+
+        try:
+            await asyncio.wait_for(changed.wait(), timeout=EVENTS_KEEPALIVE)
+        except asyncio.TimeoutError:
+            if await request.is_disconnected():
+                return
+            yield ": keep-alive\n\n"
+
+
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _task_events(request: Request, task_ids: List[str]) -> AsyncIterator[str]:
+    """
+    Yield SSE messages for the given tasks until all of them are finished.
+
+    "status" is sent on every status/message change, "result" once per task
+    when it completes or fails (same payload as /result/{task_id}), "done"
+    when nothing is left to wait for. Unknown or expired tasks are reported
+    with a "missing" event.
+    """
+    last_seen: Dict[str, tuple] = {}
+    pending = list(dict.fromkeys(task_ids))
+    while pending:
+        # Берём текущее событие до чтения состояния, чтобы не пропустить изменение
+        changed = _task_changed
+        still_pending = []
+        for task_id in pending:
+            task_data = task_results.get(task_id)
+            if task_data is None:
+                yield _sse("missing", {"task_id": task_id})
+                continue
+            state = (task_data["status"], task_data.get("message", ""))
+            if task_data["status"] in FINISHED_STATUSES:
+                yield _sse("result", task_payload(task_id, task_data))
+                continue
+            if last_seen.get(task_id) != state:
+                last_seen[task_id] = state
+                yield _sse("status", task_payload(task_id, task_data))
+            still_pending.append(task_id)
+        pending = still_pending
+        if not pending:
+            break
+
+        try:
+            await asyncio.wait_for(changed.wait(), timeout=EVENTS_KEEPALIVE)
+        except asyncio.TimeoutError:
+            if await request.is_disconnected():
+                return
+            yield ": keep-alive\n\n"
+
+    yield _sse("done", {})
+
+
+@app.get("/events")
+async def stream_events(
+    request: Request,
+    task_ids: Optional[str] = None,
+    batch_id: Optional[str] = None,
+):
+    """
+    Server-Sent Events stream of status changes and final results.
+
+    Pass comma-separated `task_ids`, a `batch_id`, or both. The stream closes
+    after every requested task has finished, so clients do not need to poll
+    /result/{task_id}.
+    """
+    ids = [t.strip() for t in (task_ids or "").split(",") if t.strip()]
+    if batch_id:
+        batch = batch_results.get(batch_id)
+        if batch is None:
+            raise HTTPException(status_code=404, detail="Batch not found")
+        ids.extend(item["task_id"] for item in batch["items"] if item["task_id"])
+    if not ids:
+        raise HTTPException(status_code=400, detail="task_ids or batch_id is required")
+
+    return StreamingResponse(
+        _task_events(request, ids),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/tasks")
@@ -258,16 +1416,7 @@ async def list_tasks():
     """
     List all tasks with their statuses.
     """
-    return {
-        "tasks": [
-            {
-                "task_id": task_id,
-                "status": data["status"],
-                "message": data.get("message", ""),
-            }
-            for task_id, data in task_results.items()
-        ]
-    }
+    return {"tasks": task_results.list()}
 
 
 if __name__ == "__main__":
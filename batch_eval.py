@@ -0,0 +1,260 @@
+"""
+Offline evaluation of a whole folder of applications (`main.py --batch`).
+
+The input is a directory with PDFs or a manifest: a text file with one PDF
+path per line (relative paths are resolved against the manifest's folder,
+empty lines and lines starting with `#` are ignored). Text is extracted in
+a process pool, model calls run in a thread pool of `concurrency` workers
+and are retried with backoff on rate limits and transient errors
+(`llm_client.call_with_retries`); documents that do not fit into the model
+context are evaluated by map-reduce. Replies are parsed, repaired and
+validated with reply_schema like in the API; fields still missing after the
+local repair are asked for again (JSON_REPAIR_ATTEMPTS, not for map-reduce).
+
+For every application a JSON file `<out_dir>/<pdf name>.json` is written as
+soon as it is done, and at the end `<out_dir>/expert_decisions.csv` with the
+same columns as the export in ui.py. A result is identified by a
+fingerprint of the PDF content, prompt, model, organization and extraction
+mode: re-running the same command skips applications that already have a
+completed result, so an interrupted run continues where it stopped.
+"""
+from __future__ import annotations
+
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from extraction_cache import extract_pdf_text_cached, file_sha256
+from llm_client import call_with_retries
+from map_reduce import fits_context, run_map_reduce
+from prompt_utils import build_messages
+from reply_schema import (
+    JSON_REPAIR_ATTEMPTS,
+    build_repair_messages,
+    invalid_fields,
+    merge_reply,
+    parse_reply,
+    prompt_criteria,
+)
+from response_cache import call_model_cached
+
+CSV_NAME = "expert_decisions.csv"
+CSV_COLUMNS = ["filename", "task_id", "status", "decision", "expert_comment"]
+
+
+def collect_batch(source: Path) -> List[Path]:
+    """PDF files of a directory (sorted by name) or of a manifest file."""
+    if source.is_dir():
+        return sorted(p for p in source.iterdir() if p.is_file() and p.suffix.lower() == ".pdf")
+
+    paths = []
+    for line in source.read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        path = Path(line)
+        paths.append(path if path.is_absolute() else source.parent / path)
+    return paths
+
+
+def make_fingerprint(content_hash: str, prompt: str, model: str, organization: str, type: str) -> str:
+    """Identify a result by everything that influences it."""
+    raw = json.dumps([content_hash, prompt, model, organization, type], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def structure_reply(
+    messages, reply: str, call: Optional[Callable[..., Tuple[str, bool]]] = None
+) -> Tuple[str, Optional[Dict], List[str]]:
+    """
+    The reply as the structured evaluation (see reply_schema.py): repaired
+    locally, then, if `call` is given, the fields still missing or invalid
+    are asked for again up to JSON_REPAIR_ATTEMPTS times. Returns the reply
+    (normalized JSON if it could be parsed), the parsed object and the
+    fields left invalid — the same as api_server.structure_reply.
+    """
+    criteria = prompt_criteria(messages)
+    data, _ = parse_reply(reply)
+    problems = invalid_fields(data, criteria)
+    for _ in range(JSON_REPAIR_ATTEMPTS if call is not None else 0):
+        if not problems:
+            break
+        fix, _ = call(build_repair_messages(messages, reply, problems), json_output=True)
+        data = merge_reply(data, parse_reply(fix)[0], criteria)
+        problems = invalid_fields(data, criteria)
+    if data is None:
+        return reply, None, problems
+    return json.dumps(data, ensure_ascii=False), data, problems
+
+
+def load_result(path: Path) -> Optional[Dict]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path: Path, data: Dict) -> None:
+    """Write JSON atomically, so an interrupted run never leaves a half-written result."""
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def csv_row(result: Dict) -> Dict[str, str]:
+    """Row of expert_decisions.csv: the model's recommendation as a draft decision."""
+    recommendation = (result.get("parsed") or {}).get("recommendation")
+    if not isinstance(recommendation, dict):
+        recommendation = {}
+    if result.get("status") == "completed":
+        comment = recommendation.get("why") or ""
+    else:
+        comment = result.get("error") or ""
+    return {
+        "filename": result.get("filename", ""),
+        "task_id": result.get("task_id", ""),
+        "status": result.get("status", ""),
+        "decision": recommendation.get("decision") or "",
+        "expert_comment": comment,
+    }
+
+
+def write_summary(path: Path, results: List[Dict]) -> None:
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    # Та же кодировка и те же колонки, что у выгрузки в ui.py
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(csv_row(result))
+    os.replace(tmp_path, path)
+
+
+def run_batch(
+    source: Path,
+    out_dir: Path,
+    prompt: str,
+    model: str,
+    organization: str,
+    type: str = "application",
+    concurrency: int = 4,
+    extract_workers: Optional[int] = None,
+    bypass_cache: bool = False,
+    resume: bool = True,
+) -> List[Dict]:
+    """
+    Evaluate every PDF of `source` and write the results to `out_dir`.
+    Returns the results in input order.
+    """
+    pdf_paths = collect_batch(source)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    concurrency = max(1, concurrency)
+    extract_workers = extract_workers or min(concurrency, os.cpu_count() or 1)
+    # Общий лимит одновременных запросов к модели, включая map-шаги длинных документов
+    model_slots = threading.Semaphore(concurrency)
+
+    def call(messages, json_output: bool = False) -> Tuple[str, bool]:
+        with model_slots:
+            return call_with_retries(
+                call_model_cached, messages, model=model, bypass_cache=bypass_cache, json_output=json_output
+            )
+
+    results: Dict[int, Dict] = {}
+    names: Dict[str, Path] = {}
+    total = len(pdf_paths)
+    done = 0
+    done_lock = threading.Lock()
+
+    def report(index: int, result: Dict) -> None:
+        nonlocal done
+        with done_lock:
+            done += 1
+            results[index] = result
+            mark = "✓" if result["status"] == "completed" else "✗"
+            note = result.get("error") or ("(из предыдущего запуска)" if result.get("resumed") else "")
+            print(f"[{done}/{total}] {mark} {result['filename']} {note}".rstrip())
+
+    def evaluate(index: int, pdf_path: Path, pool: ProcessPoolExecutor) -> None:
+        result_path = out_dir / f"{pdf_path.stem}.json"
+        result: Dict = {
+            "filename": pdf_path.name,
+            "pdf": str(pdf_path),
+            "model": model,
+            "organization": organization,
+            "type": type,
+        }
+        started = time.perf_counter()
+        try:
+            content_hash = file_sha256(pdf_path)
+            fingerprint = make_fingerprint(content_hash, prompt, model, organization, type)
+            result.update(sha256=content_hash, fingerprint=fingerprint, task_id=fingerprint[:16])
+
+            previous = load_result(result_path) if resume else None
+            if previous and previous.get("status") == "completed" and previous.get("fingerprint") == fingerprint:
+                previous["resumed"] = True
+                report(index, previous)
+                return
+
+            # Диапазоны страниц большого документа извлекаются параллельно в общем пуле процессов
+            pdf_text = extract_pdf_text_cached(pdf_path, type, content_hash, pool=pool)
+            messages = build_messages(pdf_text, prompt, organization)
+            if fits_context(messages):
+                reply, cached = call(messages, json_output=True)
+                result["cached"] = cached
+            else:
+                reply = run_map_reduce(
+                    pdf_text, prompt, lambda m: call(m)[0], organization=organization
+                )
+                result["cached"] = False
+                result["map_reduce"] = True
+            # Переспрашивать можно только по сообщениям одного запроса: у map-reduce их нет
+            reply, parsed, problems = structure_reply(
+                messages, reply, call if not result.get("map_reduce") else None
+            )
+            result.update(status="completed", result=reply, parsed=parsed, invalid_fields=problems)
+        except Exception as e:
+            result.update(status="error", error=f"{e.__class__.__name__}: {e}")
+        result["seconds"] = round(time.perf_counter() - started, 2)
+
+        try:
+            write_json(result_path, result)
+        except OSError as e:
+            result.update(status="error", error=f"не удалось сохранить {result_path}: {e}")
+        report(index, result)
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=extract_workers) as extract_pool, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        futures = []
+        for index, pdf_path in enumerate(pdf_paths):
+            if not pdf_path.is_file():
+                report(index, {"filename": pdf_path.name, "pdf": str(pdf_path),
+                               "status": "error", "error": "файл не найден"})
+                continue
+            if pdf_path.stem in names:
+                report(index, {"filename": pdf_path.name, "pdf": str(pdf_path), "status": "error",
+                               "error": f"имя результата совпадает с {names[pdf_path.stem]}"})
+                continue
+            names[pdf_path.stem] = pdf_path
+            futures.append(pool.submit(evaluate, index, pdf_path, extract_pool))
+        try:
+            for future in as_completed(futures):
+                future.result()
+        finally:
+            # Сводку пишем и при прерывании: в ней всё, что успело завершиться
+            ordered = [results[i] for i in sorted(results)]
+            write_summary(out_dir / CSV_NAME, ordered)
+
+    elapsed = time.perf_counter() - started
+    completed = sum(1 for r in ordered if r["status"] == "completed")
+    resumed = sum(1 for r in ordered if r.get("resumed"))
+    print(f"\nГотово: {completed}/{total} заявок (из предыдущего запуска: {resumed}), "
+          f"ошибок: {total - completed}, время: {elapsed:.1f} с")
+    print(f"Результаты: {out_dir}, сводка: {out_dir / CSV_NAME}")
+    return ordered
@@ -0,0 +1,419 @@
+"""
+Reproducible benchmarks of the processing hot paths.
+
+`extract` measures text extraction (`pdf_utils.extract_pdf_text`) of the PDFs
+in grant_files/ and of synthetic 10/100/500-page documents, in `application`
+and `presentation` mode: wall time, pages/s and peak RSS. Every run happens
+in a fresh process, so peak RSS belongs to that run only; the extraction
+cache is not used. It also times `prompt_utils.build_messages` and the
+context check (`map_reduce.fits_context`) on the extracted texts.
+
+`api` runs the API server end to end against the local model stub
+(stub_llm.py): it starts both, submits `--requests` uploads with
+`--concurrency` clients and reports throughput, p50/p95/p99 latency from
+upload to result and the server-side stage timings of the tasks.
+
+Results are written as JSON (default bench_results/<kind>-<time>.json),
+together with the environment and settings, so runs can be compared.
+
+Usage:
+    python -m benchmark extract [--pages 10 100 500] [--repeat 3]
+    python -m benchmark api [--requests 50] [--concurrency 8] [--latency 1]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Dict, List, Optional
+
+SCRIPT_DIR = Path(__file__).parent
+GRANT_FILES = SCRIPT_DIR / "grant_files"
+SYNTHETIC_DIR = SCRIPT_DIR / ".cache" / "bench_pdfs"
+RESULTS_DIR = SCRIPT_DIR / "bench_results"
+# Текстовые документы, из страниц которых собираются синтетические PDF
+SYNTHETIC_SOURCES = ["application_project.pdf", "rules_grant.pdf", "second_generated_grant.pdf"]
+BENCH_PROMPT = (
+    "Оцени заявку по критериям: техническая реализуемость, реалистичность сроков, "
+    "команда, рынок. Верни ответ строго в JSON."
+)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Percentile `q` (0..100) with linear interpolation, None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def environment() -> Dict:
+    """What the numbers depend on: interpreter, machine, library versions, commit."""
+    import pypdf
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR,
+            capture_output=True, text=True, timeout=10,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    try:
+        import tiktoken  # noqa: F401
+        tokenizer = "tiktoken"
+    except ImportError:
+        tokenizer = "estimate"
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "pypdf": pypdf.__version__,
+        "tokenizer": tokenizer,
+        "commit": commit,
+    }
+
+
+def write_results(results: Dict, output: Optional[Path]) -> Path:
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"{results['kind']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    return output
+
+
+def make_synthetic_pdf(num_pages: int) -> Path:
+    """A `num_pages` PDF built by cycling the pages of the text documents in grant_files/."""
+    from pypdf import PdfReader, PdfWriter
+
+    path = SYNTHETIC_DIR / f"synthetic_{num_pages}.pdf"
+    if path.exists():
+        return path
+    pages = [page for name in SYNTHETIC_SOURCES for page in PdfReader(str(GRANT_FILES / name)).pages]
+    writer = PdfWriter()
+    for i in range(num_pages):
+        writer.add_page(pages[i % len(pages)])
+    SYNTHETIC_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        writer.write(f)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        # Windows: модуля resource нет
+        return None
+    # Параллельное извлечение идёт в дочерних процессах — учитываем и их
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # Linux отдаёт килобайты, macOS — байты
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _extraction_run(pdf_path: str, type: str, workers: Optional[int]) -> Dict:
+    """Worker (fresh process): extract one PDF and measure it."""
+    from pdf_utils import count_pdf_pages, extract_pdf_text
+
+    started = time.perf_counter()
+    text = extract_pdf_text(Path(pdf_path), type, workers)
+    seconds = time.perf_counter() - started
+    return {
+        "seconds": seconds,
+        "pages": count_pdf_pages(Path(pdf_path)),
+        "chars": len(text),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def bench_extraction(pdfs: List[Path], types: List[str], repeat: int, workers: Optional[int]) -> List[Dict]:
+    results = []
+    spawn = get_context("spawn")
+    for pdf_path in pdfs:
+        for type in types:
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                    runs.append(pool.submit(_extraction_run, str(pdf_path), type, workers).result())
+            seconds = statistics.median(r["seconds"] for r in runs)
+            pages = runs[0]["pages"]
+            rss = [r["peak_rss_mb"] for r in runs if r["peak_rss_mb"] is not None]
+            result = {
+                "pdf": pdf_path.name,
+                "type": type,
+                "pages": pages,
+                "chars": runs[0]["chars"],
+                "wall_seconds": round(seconds, 4),
+                "pages_per_second": round(pages / seconds, 2) if seconds > 0 else None,
+                "peak_rss_mb": max(rss) if rss else None,
+                "runs_seconds": [round(r["seconds"], 4) for r in runs],
+            }
+            results.append(result)
+            print(f"  {pdf_path.name:32} {type:12} {pages:4} стр.  {seconds:8.3f} с  "
+                  f"{result['pages_per_second'] or 0:8.1f} стр/с  RSS {result['peak_rss_mb']} МБ")
+    return results
+
+
+def bench_build_messages(pdfs: List[Path], organization: str, calls: int) -> List[Dict]:
+    from map_reduce import fits_context
+    from pdf_utils import extract_pdf_text
+    from prompt_utils import build_messages, preload_rules
+
+    preload_rules()
+    results = []
+    for pdf_path in pdfs:
+        text = extract_pdf_text(pdf_path, "application")
+        build_ms, check_ms = [], []
+        for _ in range(calls):
+            started = time.perf_counter()
+            messages = build_messages(text, BENCH_PROMPT, organization=organization)
+            build_ms.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            fits_context(messages)
+            check_ms.append((time.perf_counter() - started) * 1000)
+        result = {
+            "pdf": pdf_path.name,
+            "chars": len(text),
+            "calls": calls,
+            "build_messages_ms": {
+                "mean": round(statistics.mean(build_ms), 3),
+                "p50": round(percentile(build_ms, 50), 3),
+                "p95": round(percentile(build_ms, 95), 3),
+            },
+            "fits_context_ms": {
+                "mean": round(statistics.mean(check_ms), 3),
+                "p50": round(percentile(check_ms, 50), 3),
+                "p95": round(percentile(check_ms, 95), 3),
+            },
+        }
+        results.append(result)
+        print(f"  {pdf_path.name:32} build_messages {result['build_messages_ms']['p50']:8.3f} мс  "
+              f"fits_context {result['fits_context_ms']['p50']:8.3f} мс")
+    return results
+
+
+def run_extract(args) -> Dict:
+    pdfs = sorted(GRANT_FILES.glob("*.pdf"))
+    print("Синтетические PDF...")
+    pdfs += [make_synthetic_pdf(n) for n in args.pages]
+    print(f"Извлечение текста (повторов: {args.repeat}):")
+    extraction = bench_extraction(pdfs, args.types, args.repeat, args.page_workers)
+    print(f"Сборка сообщений (вызовов: {args.calls}):")
+    prompt = bench_build_messages(pdfs, args.organization, args.calls)
+    return {
+        "kind": "extract",
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "settings": {
+            "repeat": args.repeat,
+            "types": args.types,
+            "synthetic_pages": args.pages,
+            "page_workers": args.page_workers,
+            "PDF_PARALLEL_MIN_PAGES": os.getenv("PDF_PARALLEL_MIN_PAGES"),
+            "RULES_MODE": os.getenv("RULES_MODE"),
+            "organization": args.organization,
+        },
+        "extraction": extraction,
+        "build_messages": prompt,
+    }
+
+
+def _wait_http(url: str, timeout: float) -> None:
+    import requests
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.RequestException:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} не отвечает {timeout:.0f} с")
+            time.sleep(0.2)
+
+
+def run_api(args) -> Dict:
+    import requests
+
+    pdfs = [Path(p) for p in args.pdf] if args.pdf else [
+        GRANT_FILES / "application_project.pdf", GRANT_FILES / "second_generated_grant.pdf"
+    ]
+    contents = [(p.name, p.read_bytes()) for p in pdfs]
+    api_url = f"http://127.0.0.1:{args.api_port}"
+    env = dict(
+        os.environ,
+        LLM_BACKEND="openai",
+        LLM_BASE_URL=f"http://127.0.0.1:{args.stub_port}/v1",
+        LLM_API_KEY="stub",
+        RESPONSE_CACHE="0",
+        EXTRACTION_CACHE="1" if args.extraction_cache else "0",
+        TASK_STORE="memory",
+        JOB_QUEUE="inline",
+    )
+    processes = []
+    try:
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "stub_llm", "--port", str(args.stub_port), "--latency", str(args.latency),
+             "--latency-dist", args.latency_dist, "--error-rate", str(args.error_rate),
+             "--rate-limit-rate", str(args.rate_limit_rate)],
+            cwd=SCRIPT_DIR, env=env,
+        ))
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api_server:app", "--port", str(args.api_port),
+             "--log-level", "warning"],
+            cwd=SCRIPT_DIR, env=env,
+        ))
+        _wait_http(f"http://127.0.0.1:{args.stub_port}/docs", 60)
+        _wait_http(f"{api_url}/health", 120)
+
+        local = threading.local()
+
+        def one_task(index: int) -> Dict:
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            session = local.session
+            filename, content = contents[index % len(contents)]
+            started = time.perf_counter()
+            r = session.post(
+                f"{api_url}/upload",
+                files={"file": (filename, content, "application/pdf")},
+                # Номер запроса в промпте: одинаковые задачи сервер объединил бы в одну
+                data={"prompt": f"{BENCH_PROMPT}\nЗапрос №{index}", "stream": str(args.stream).lower()},
+                timeout=120,
+            )
+            r.raise_for_status()
+            task_id = r.json()["task_id"]
+            while True:
+                payload = session.get(f"{api_url}/result/{task_id}", timeout=120).json()
+                if payload["status"] in ("completed", "error"):
+                    break
+                time.sleep(args.poll_interval)
+            return {
+                "seconds": time.perf_counter() - started,
+                "status": payload["status"],
+                "timings": payload.get("timings") or {},
+            }
+
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            if args.warmup:
+                print(f"Прогрев: {args.warmup} задач...")
+                list(pool.map(one_task, range(args.warmup)))
+            print(f"Нагрузка: {args.requests} задач, клиентов: {args.concurrency}, "
+                  f"задержка модели: {args.latency} с")
+            started = time.perf_counter()
+            tasks = list(pool.map(one_task, range(args.warmup, args.warmup + args.requests)))
+            wall = time.perf_counter() - started
+        health = requests.get(f"{api_url}/health", timeout=30).json()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    latencies = [t["seconds"] for t in tasks if t["status"] == "completed"]
+    stages = sorted({name for t in tasks for name in t["timings"]})
+    summary = {
+        "requests": len(tasks),
+        "completed": len(latencies),
+        "errors": len(tasks) - len(latencies),
+        "wall_seconds": round(wall, 3),
+        "throughput_per_second": round(len(latencies) / wall, 3) if wall > 0 else None,
+        "latency_seconds": {
+            "mean": round(statistics.mean(latencies), 3) if latencies else None,
+            **{f"p{q}": round(percentile(latencies, q), 3) if latencies else None for q in (50, 95, 99)},
+            "max": round(max(latencies), 3) if latencies else None,
+        },
+        # Средние длительности этапов по данным сервера (см. timings в /result)
+        "server_stage_seconds": {
+            name: round(statistics.mean(t["timings"][name] for t in tasks if name in t["timings"]), 3)
+            for name in stages
+        },
+    }
+    print(f"  Готово: {summary['completed']}/{summary['requests']}, "
+          f"{summary['throughput_per_second']} задач/с, latency p50/p95/p99: "
+          f"{summary['latency_seconds']['p50']}/{summary['latency_seconds']['p95']}/"
+          f"{summary['latency_seconds']['p99']} с")
+    return {
+        "kind": "api",
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "settings": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "stub_latency": args.latency,
+            "stub_latency_dist": args.latency_dist,
+            "stub_error_rate": args.error_rate,
+            "stub_rate_limit_rate": args.rate_limit_rate,
+            "stream": args.stream,
+            "extraction_cache": args.extraction_cache,
+            "pdfs": [name for name, _ in contents],
+            "MAX_CONCURRENT_MODEL_CALLS": os.getenv("MAX_CONCURRENT_MODEL_CALLS"),
+            "MAX_CONCURRENT_EXTRACTIONS": os.getenv("MAX_CONCURRENT_EXTRACTIONS"),
+            "MAX_ACTIVE_TASKS": os.getenv("MAX_ACTIVE_TASKS"),
+        },
+        "summary": summary,
+        "server_health": health,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of PDF extraction, prompt building and the API.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract = commands.add_parser("extract", help="Text extraction and build_messages.")
+    extract.add_argument("--pages", type=int, nargs="*", default=[10, 100, 500],
+                         help="Page counts of synthetic PDFs (default: 10 100 500).")
+    extract.add_argument("--types", nargs="+", default=["application", "presentation"],
+                         choices=["application", "presentation"])
+    extract.add_argument("--repeat", type=int, default=3, help="Runs per PDF and mode; the median is reported.")
+    extract.add_argument("--page-workers", type=int, default=None,
+                         help="Processes per PDF (default: PDF_PARALLEL_WORKERS).")
+    extract.add_argument("--calls", type=int, default=20, help="build_messages calls per PDF.")
+    extract.add_argument("--organization", default="ФПИ")
+    extract.add_argument("--output", type=Path, default=None, help="JSON file for the results.")
+
+    api = commands.add_parser("api", help="End-to-end API throughput and latency against the model stub.")
+    api.add_argument("--requests", type=int, default=50)
+    api.add_argument("--concurrency", type=int, default=8)
+    api.add_argument("--warmup", type=int, default=2)
+    api.add_argument("--latency", type=float, default=1.0, help="Mean seconds per stub completion.")
+    api.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal"], default="fixed")
+    api.add_argument("--error-rate", type=float, default=0.0, help="Share of stub completions failing with 500.")
+    api.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of stub completions rejected with 429.")
+    api.add_argument("--stream", action="store_true", help="Upload with stream=true.")
+    api.add_argument("--extraction-cache", action="store_true",
+                     help="Keep the extraction cache on (default: off, every task extracts).")
+    api.add_argument("--pdf", nargs="*", help="PDFs to upload (default: two applications from grant_files/).")
+    api.add_argument("--api-port", type=int, default=8765)
+    api.add_argument("--stub-port", type=int, default=8766)
+    api.add_argument("--poll-interval", type=float, default=0.1)
+    api.add_argument("--output", type=Path, default=None, help="JSON file for the results.")
+
+    args = parser.parse_args()
+    results = run_extract(args) if args.command == "extract" else run_api(args)
+    print(f"Результаты: {write_results(results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Content-addressed on-disk cache for text extracted from PDFs.
+
+Entries are keyed by SHA-256 of the PDF bytes, the extraction mode
+("application" / "presentation") and the installed pypdf version, so the
+same document re-uploaded with another prompt or model is never parsed twice.
+The cache directory is bounded in size; least recently used entries are
+evicted first (an entry's mtime is refreshed on every hit).
+
+Settings (environment variables):
+    EXTRACTION_CACHE         - "0" to disable the cache (default "1")
+    EXTRACTION_CACHE_DIR     - cache directory (default .cache/extraction)
+    EXTRACTION_CACHE_MAX_MB  - size limit in megabytes (default 512)
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import threading
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Dict, Optional
+
+import pypdf
+
+from pdf_utils import extract_pdf_text, extract_pdf_text_in_pool, write_pdf_text
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE", "1") == "1"
+EXTRACTION_CACHE_DIR = Path(
+    os.getenv("EXTRACTION_CACHE_DIR", str(Path(__file__).parent / ".cache" / "extraction"))
+)
+EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    """Return the hex SHA-256 of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    """Size-bounded LRU cache of extracted texts stored as files in a directory."""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(content_hash: str, type: str) -> str:
+        """Build the cache key for a document hash and an extraction mode."""
+        raw = f"{content_hash}:{type}:pypdf-{pypdf.__version__}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.txt"
+
+    def get(self, key: str) -> Optional[str]:
+        """Return cached text for the key or None, updating hit/miss counters."""
+        path = self._entry_path(key)
+        try:
+            text = path.read_text(encoding="utf-8")
+        except (FileNotFoundError, OSError, UnicodeDecodeError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Обновляем mtime, чтобы запись считалась недавно использованной (LRU)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return text
+
+    def get_path(self, key: str) -> Optional[Path]:
+        """Like `get`, but return the path of the cached entry instead of its text."""
+        path = self._entry_path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put_file(self, key: str, src: Path) -> None:
+        """Store a copy of a text file under the key (no need to load it into memory)."""
+        path = self._entry_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            shutil.copyfile(src, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Предупреждение: не удалось записать кэш извлечения {path}: {e}")
+            return
+        self.evict()
+
+    def put(self, key: str, text: str) -> None:
+        """Store text under the key and evict old entries if over the size limit."""
+        path = self._entry_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Пишем во временный файл и атомарно переименовываем,
+            # чтобы параллельные процессы не прочитали недописанную запись
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_text(text, encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Предупреждение: не удалось записать кэш извлечения {path}: {e}")
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits into max_bytes."""
+        entries = []
+        total = 0
+        for path in self.directory.glob("*/*.txt"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                continue
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters of this process."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+_cache: Optional[ExtractionCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Return the process-wide cache, or None if caching is disabled."""
+    global _cache
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache(EXTRACTION_CACHE_DIR, EXTRACTION_CACHE_MAX_BYTES)
+    return _cache
+
+
+def extract_pdf_text_cached(
+    pdf_path: Path,
+    type: str = "application",
+    content_hash: Optional[str] = None,
+    workers: Optional[int] = None,
+    pool: Optional[Executor] = None,
+) -> str:
+    """
+    Same as `pdf_utils.extract_pdf_text`, but served from the cache when possible.
+    `content_hash` may be passed if the SHA-256 of the file is already known.
+    With `pool` the pages are extracted in that process pool
+    (`pdf_utils.extract_pdf_text_in_pool`).
+    """
+
+    def extract() -> str:
+        if pool is not None:
+            return extract_pdf_text_in_pool(pool, pdf_path, type=type, workers=workers)
+        return extract_pdf_text(pdf_path, type=type, workers=workers)
+
+    cache = get_extraction_cache()
+    if cache is None:
+        return extract()
+
+    key = cache.make_key(content_hash or file_sha256(pdf_path), type)
+    text = cache.get(key)
+    if text is None:
+        text = extract()
+        cache.put(key, text)
+    return text
+
+
+def write_pdf_text_cached(
+    pdf_path: Path,
+    out_path: Path,
+    type: str = "application",
+    content_hash: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> Optional[int]:
+    """
+    Same as `pdf_utils.write_pdf_text`, but copies the cached text when
+    possible. On a miss the text is streamed to `out_path` page by page and
+    the resulting file is copied into the cache. Either way `out_path` is
+    replaced atomically, only once the full text has been written.
+    Returns the number of pages, or None if the text came from the cache.
+    """
+    cache = get_extraction_cache()
+    if cache is None:
+        return write_pdf_text(pdf_path, out_path, type=type, workers=workers)
+
+    key = cache.make_key(content_hash or file_sha256(pdf_path), type)
+    cached_path = cache.get_path(key)
+    if cached_path is not None:
+        # Копируем через временный файл: прерванное копирование не должно оставить обрезанный результат
+        out_path = Path(out_path)
+        tmp_path = out_path.with_name(f"{out_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            shutil.copyfile(cached_path, tmp_path)
+            os.replace(tmp_path, out_path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return None
+    num_pages = write_pdf_text(pdf_path, out_path, type=type, workers=workers)
+    cache.put_file(key, out_path)
+    return num_pages
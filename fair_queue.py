@@ -0,0 +1,117 @@
+"""
+Dispatch order of waiting tasks: priority first, then fair share.
+
+A task with a higher priority always goes before a task with a lower one.
+Among tasks of the same priority, fair-share groups (submitters) take turns:
+the group that was served least recently goes next, and within a group tasks
+keep their submission order. One expert submitting 200 PDFs therefore delays
+another expert's single document by at most one task per group, not by the
+whole bulk round.
+
+`FairQueue` is the in-memory queue of the API server (JOB_QUEUE=inline);
+the SQLite job queue claims jobs in the same order and uses
+`dispatch_order` to report queue positions.
+"""
+from __future__ import annotations
+
+import heapq
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+# Приоритеты задач: чем больше число, тем раньше задача берётся в работу
+PRIORITIES = {"high": 2, "normal": 1, "low": 0}
+
+
+def dispatch_order(
+    items: Iterable[Tuple[str, int, str, float]], last_served: Dict[str, float]
+) -> List[str]:
+    """
+    Ids of waiting items in the order they will be dispatched.
+
+    `items` are (item_id, priority, group, submitted_at); `last_served`
+    maps a group to the time (or counter) it was last served.
+    """
+    by_priority: Dict[int, Dict[str, List[Tuple[float, str]]]] = {}
+    for item_id, priority, group, submitted_at in items:
+        by_priority.setdefault(priority, {}).setdefault(group, []).append((submitted_at, item_id))
+
+    served = dict(last_served)
+    tick = max(served.values(), default=0)
+    order: List[str] = []
+    for priority in sorted(by_priority, reverse=True):
+        heap = []
+        queues: Dict[str, Deque[Tuple[float, str]]] = {}
+        for group, entries in by_priority[priority].items():
+            queues[group] = deque(sorted(entries))
+            # Группа, которую дольше всех не обслуживали, идёт первой; при равенстве — более ранняя задача
+            heapq.heappush(heap, (served.get(group, float("-inf")), queues[group][0][0], group))
+        while heap:
+            _, _, group = heapq.heappop(heap)
+            _, item_id = queues[group].popleft()
+            order.append(item_id)
+            tick += 1
+            served[group] = tick
+            if queues[group]:
+                heapq.heappush(heap, (tick, queues[group][0][0], group))
+    return order
+
+
+class FairQueue:
+    """In-memory priority + fair-share queue of item ids (used on the event loop)."""
+
+    def __init__(self):
+        self._items: Dict[str, Tuple[int, str, float]] = {}
+        self._last_served: Dict[str, float] = {}
+        self._seq = 0
+        self._tick = 0
+        self._positions: Optional[Dict[str, int]] = None
+
+    def push(self, item_id: str, priority: int, group: str) -> None:
+        self._seq += 1
+        self._items[item_id] = (priority, group, self._seq)
+        self._positions = None
+
+    def raise_priority(self, item_id: str, priority: int) -> None:
+        """Raise the priority of a waiting item to `priority`, keeping its place in its group."""
+        if item_id not in self._items:
+            return
+        current, group, seq = self._items[item_id]
+        if priority > current:
+            self._items[item_id] = (priority, group, seq)
+            self._positions = None
+
+    def pop(self) -> Optional[str]:
+        """Remove and return the next item, or None if the queue is empty."""
+        order = self.order()
+        if not order:
+            return None
+        item_id = order[0]
+        _, group, _ = self._items.pop(item_id)
+        self._tick += 1
+        self._last_served[group] = self._tick
+        self._positions = None
+        # Историю храним только для групп с ожидающими задачами и для только что обслуженной:
+        # иначе загрузка, пришедшая сразу после начала обработки первого файла, обогнала бы других
+        waiting = {g for _, g, _ in self._items.values()}
+        for g in [g for g in self._last_served if g != group and g not in waiting]:
+            del self._last_served[g]
+        return item_id
+
+    def order(self) -> List[str]:
+        """Ids of all waiting items in dispatch order."""
+        return dispatch_order(
+            ((item_id, p, g, seq) for item_id, (p, g, seq) in self._items.items()),
+            self._last_served,
+        )
+
+    def position(self, item_id: str) -> Optional[int]:
+        """Number of items ahead of `item_id`, or None if it is not waiting."""
+        if self._positions is None:
+            self._positions = {item_id: i for i, item_id in enumerate(self.order())}
+        return self._positions.get(item_id)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
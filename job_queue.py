@@ -0,0 +1,323 @@
+"""
+Durable queue of processing jobs, shared by the API server and workers.
+
+With JOB_QUEUE=sqlite the API server does not process uploads itself:
+`POST /upload` and `POST /batch` put a job into a local SQLite queue and
+worker processes (`python -m worker --concurrency N`, see worker.py) claim
+jobs from it. A claimed job is leased to one worker for JOB_LEASE_SECONDS;
+the worker extends the lease with heartbeats while it runs the job. If a
+worker dies, its lease expires and the job is delivered to another worker,
+up to JOB_MAX_ATTEMPTS deliveries. Task records are shared through the
+SQLite task store (TASK_STORE=sqlite), so any number of API and worker
+processes on one machine, or on machines sharing the `.cache/` and
+`uploads/` directories, see the same tasks.
+
+Jobs are claimed by priority, then round-robin across submitters (see
+fair_queue.py); `positions` reports the queue position of every waiting
+job and the average job duration for wait estimates.
+
+A job may carry a fingerprint of its work. Enqueueing a job whose
+fingerprint matches a job that is still queued or running attaches the new
+task to it as a follower instead; `complete` returns the followers, which
+receive the same result.
+
+With JOB_QUEUE=inline (default) tasks run inside the API process, as before.
+
+Settings (environment variables):
+    JOB_QUEUE               - "inline" or "sqlite" (default "inline")
+    JOB_QUEUE_PATH          - SQLite file (default .cache/jobs.sqlite3)
+    JOB_LEASE_SECONDS       - lease of a claimed job, renewed by heartbeats (default 60)
+    JOB_MAX_ATTEMPTS        - deliveries of a job before it is given up (default 3)
+    JOB_POLL_INTERVAL       - how often idle workers poll the queue and the API
+                              polls the task store for changes, seconds (default 1)
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from fair_queue import dispatch_order
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE", "inline")
+JOB_QUEUE_PATH = Path(
+    os.getenv("JOB_QUEUE_PATH", str(Path(__file__).parent / ".cache" / "jobs.sqlite3"))
+)
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+
+@dataclass
+class Job:
+    """A claimed job: the task id, arguments of `process_pdf_task` and the delivery number."""
+
+    job_id: str
+    payload: Dict[str, Any]
+    attempts: int
+
+
+class JobQueue:
+    """SQLite-backed job queue with leases; safe to use from several processes."""
+
+    def __init__(self, path: Path, lease_seconds: float, max_attempts: int):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None — транзакции открываем сами (BEGIN IMMEDIATE в claim)
+        self._conn = sqlite3.connect(
+            str(self.path), timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker_id TEXT,
+                lease_expires REAL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        # Колонки планирования (приоритет, группа справедливой очереди, начало выполнения)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for name, definition in (
+            ("priority", "INTEGER NOT NULL DEFAULT 1"),
+            ("grp", "TEXT NOT NULL DEFAULT ''"),
+            ("leased_at", "REAL"),
+            ("fingerprint", "TEXT"),
+        ):
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_fingerprint ON jobs (fingerprint)")
+        # Задачи, присоединённые к выполняющейся задаче с тем же отпечатком
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_followers (job_id TEXT NOT NULL, follower_id TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS job_followers_job ON job_followers (job_id)")
+        # Когда группу (отправителя) обслуживали последний раз — для очереди по кругу
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_groups (grp TEXT PRIMARY KEY, last_served REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_stats (name TEXT PRIMARY KEY, value REAL NOT NULL)"
+        )
+
+    def enqueue(
+        self,
+        job_id: str,
+        payload: Dict[str, Any],
+        priority: int = 1,
+        group: str = "",
+        fingerprint: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Add a job with a priority and a fair-share group (the submitter).
+
+        If a queued or running job has the same `fingerprint`, no job is
+        added: `job_id` becomes its follower and the id of that job is returned.
+        The leader's priority is raised to `priority` if that is higher, so an
+        urgent follower does not wait behind a bulk round.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                leader = None
+                if fingerprint is not None:
+                    leader = self._conn.execute(
+                        "SELECT job_id FROM jobs WHERE fingerprint = ? AND attempts < ? LIMIT 1",
+                        (fingerprint, self.max_attempts),
+                    ).fetchone()
+                if leader is not None:
+                    self._conn.execute(
+                        "INSERT INTO job_followers (job_id, follower_id) VALUES (?, ?)", (leader[0], job_id)
+                    )
+                    self._conn.execute(
+                        "UPDATE jobs SET priority = MAX(priority, ?) WHERE job_id = ?", (priority, leader[0])
+                    )
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO jobs "
+                        "(job_id, payload, status, attempts, created_at, priority, grp, fingerprint) "
+                        "VALUES (?, ?, 'queued', 0, ?, ?, ?, ?)",
+                        (job_id, json.dumps(payload, ensure_ascii=False), time.time(), priority, group,
+                         fingerprint),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return leader[0] if leader is not None else None
+
+    def claim(self, worker_id: str) -> Optional[Job]:
+        """
+        Lease the next available job to `worker_id`, or return None.
+
+        The job with the highest priority is taken; among equal priorities
+        the group served least recently, then the oldest job of that group.
+        Jobs whose lease has expired (their worker died) are available again.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    """
+                    SELECT j.job_id, j.payload, j.attempts, j.grp FROM jobs j
+                    LEFT JOIN job_groups g ON g.grp = j.grp
+                    WHERE (j.status = 'queued' OR (j.status = 'leased' AND j.lease_expires < ?))
+                      AND j.attempts < ?
+                    ORDER BY j.priority DESC, COALESCE(g.last_served, 0), j.created_at
+                    LIMIT 1
+                    """,
+                    (now, self.max_attempts),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                job_id, payload, attempts, group = row
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'leased', worker_id = ?, lease_expires = ?, attempts = ?, "
+                    "leased_at = ? WHERE job_id = ?",
+                    (worker_id, now + self.lease_seconds, attempts + 1, now, job_id),
+                )
+                self._conn.execute(
+                    "INSERT INTO job_groups (grp, last_served) VALUES (?, ?) "
+                    "ON CONFLICT(grp) DO UPDATE SET last_served = excluded.last_served",
+                    (group, now),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return Job(job_id=job_id, payload=json.loads(payload), attempts=attempts + 1)
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Extend the lease; False if the job is no longer leased to this worker."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? "
+                "WHERE job_id = ? AND worker_id = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, job_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def _pop_followers(self, job_id: str) -> List[str]:
+        rows = self._conn.execute(
+            "SELECT follower_id FROM job_followers WHERE job_id = ?", (job_id,)
+        ).fetchall()
+        self._conn.execute("DELETE FROM job_followers WHERE job_id = ?", (job_id,))
+        return [follower_id for (follower_id,) in rows]
+
+    def complete(self, job_id: str, worker_id: str) -> List[str]:
+        """
+        Remove a finished job (the result itself lives in the task store),
+        update the average job duration used for wait estimates and return
+        the followers that should receive the same result.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT leased_at FROM jobs WHERE job_id = ? AND worker_id = ?", (job_id, worker_id)
+                ).fetchone()
+                followers = []
+                if row is not None:
+                    # Удаление и выборка последователей в одной транзакции: новый дубликат
+                    # либо успел присоединиться и будет возвращён, либо станет новой задачей
+                    self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+                    followers = self._pop_followers(job_id)
+                if row is not None and row[0] is not None:
+                    seconds = time.time() - row[0]
+                    # Скользящее среднее: новые задачи весят больше старых
+                    self._conn.execute(
+                        "INSERT INTO job_stats (name, value) VALUES ('avg_seconds', ?) "
+                        "ON CONFLICT(name) DO UPDATE SET value = 0.8 * value + 0.2 * excluded.value",
+                        (seconds,),
+                    )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return followers
+
+    def reap(self) -> Dict[str, List[str]]:
+        """
+        Give up jobs whose last delivery also expired; return their ids with
+        their followers so that the caller can mark the tasks as failed.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT job_id FROM jobs WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                    (time.time(), self.max_attempts),
+                ).fetchall()
+                self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", rows)
+                abandoned = {job_id: self._pop_followers(job_id) for (job_id,) in rows}
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return abandoned
+
+    def positions(self) -> Tuple[Dict[str, int], int, Optional[float]]:
+        """
+        Queue position of every waiting job (0 = next), the number of jobs
+        being processed right now and the average job duration in seconds
+        (None until a job has completed).
+        """
+        now = time.time()
+        with self._lock:
+            waiting = self._conn.execute(
+                """
+                SELECT job_id, priority, grp, created_at FROM jobs
+                WHERE (status = 'queued' OR (status = 'leased' AND lease_expires < ?)) AND attempts < ?
+                """,
+                (now, self.max_attempts),
+            ).fetchall()
+            last_served = dict(self._conn.execute("SELECT grp, last_served FROM job_groups").fetchall())
+            running = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'leased' AND lease_expires >= ?", (now,)
+            ).fetchone()[0]
+            row = self._conn.execute("SELECT value FROM job_stats WHERE name = 'avg_seconds'").fetchone()
+        order = dispatch_order(waiting, last_served)
+        return {job_id: i for i, job_id in enumerate(order)}, running, row[0] if row else None
+
+    def stats(self) -> Dict[str, int]:
+        """Number of queued and leased jobs."""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {"queued": 0, "leased": 0}
+        counts.update(dict(rows))
+        return counts
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide queue, creating it on first use."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(JOB_QUEUE_PATH, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS)
+    return _queue
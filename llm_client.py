@@ -0,0 +1,341 @@
+"""
+Shared OpenAI-compatible model client used by the CLI and the API server.
+
+The client is created once and reused, so TLS handshakes and TCP connections
+to the provider are kept alive in an HTTP connection pool between calls.
+
+The backend is chosen by LLM_BACKEND:
+    openrouter - OpenRouter with OPENROUTER_API_KEY (default)
+    openai     - any OpenAI-compatible API at LLM_BASE_URL with LLM_API_KEY
+                 (OpenAI, vLLM, Ollama, the stub server of stub_llm.py, ...)
+    stub       - built-in fake model answering in process (stub_llm.StubTransport):
+                 no network and no key, for offline load tests and demos
+
+Settings (environment variables):
+    LLM_BACKEND            - "openrouter", "openai" or "stub" (default "openrouter",
+                             or "openai" if LLM_BASE_URL is set)
+    LLM_BASE_URL           - API root for LLM_BACKEND=openai (default https://api.openai.com/v1)
+    LLM_API_KEY            - API key for LLM_BACKEND=openai (may be empty for local servers)
+    LLM_MAX_CONNECTIONS    - max simultaneous HTTP connections (default 20)
+    LLM_MAX_KEEPALIVE      - max idle keep-alive connections (default 10)
+    LLM_KEEPALIVE_EXPIRY   - seconds an idle connection is kept open (default 60)
+    LLM_HTTP2              - "1" to enable HTTP/2 (needs the `h2` package)
+    LLM_TIMEOUT            - request timeout in seconds (default 300)
+    LLM_CACHE_HINTS        - "0" to stop sending prompt caching hints (default "1")
+    LLM_JSON_MODE          - "0" to stop requesting JSON output (`response_format`) for
+                             structured replies (default "1"); a model that rejects it
+                             with 400 is asked again without it and is not sent it again
+    LLM_MAX_RETRIES        - retries of a rate-limited or failed call in `call_with_retries` (default 5)
+    LLM_RETRY_BASE_DELAY   - first backoff delay in seconds, doubled on every retry (default 2)
+    LLM_RETRY_MAX_DELAY    - upper bound of one backoff delay in seconds (default 60)
+
+Prompt caching: messages are built so that everything but the last message
+is a stable prefix (see prompt_utils.build_messages). OpenAI-family models
+cache such prefixes automatically; for providers that need an explicit
+marker (Anthropic, Gemini via OpenRouter) the end of the prefix gets a
+`cache_control` breakpoint. Token usage of every call, including cached
+prompt tokens, is accumulated in `usage_stats()`.
+"""
+from __future__ import annotations
+
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, Set, TypeVar
+
+import httpx
+import openai
+from openai import OpenAI
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai" if os.getenv("LLM_BASE_URL") else "openrouter")
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "0") == "1"
+# Увеличенный таймаут для больших PDF и сложных промптов
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "300"))
+LLM_CACHE_HINTS = os.getenv("LLM_CACHE_HINTS", "1") == "1"
+LLM_JSON_MODE = os.getenv("LLM_JSON_MODE", "1") == "1"
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "2"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "60"))
+
+# Провайдеры OpenRouter, которым нужна явная точка кэширования cache_control
+_CACHE_CONTROL_PREFIXES = ("anthropic/", "google/")
+
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
+
+_usage_totals: Dict[str, int] = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+_usage_lock = threading.Lock()
+
+# Модели, отклонившие response_format: JSON-ответ у них запрашивается только промптом
+_json_mode_rejected: Set[str] = set()
+
+T = TypeVar("T")
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _build_client() -> OpenAI:
+    transport = None
+    default_headers = None
+    if LLM_BACKEND == "openrouter":
+        api_key = os.getenv("OPENROUTER_API_KEY")
+        if not api_key:
+            raise RuntimeError("OPENROUTER_API_KEY is not set in the environment.")
+        base_url = OPENROUTER_BASE_URL
+        # Рекомендуемые OpenRouter заголовки (идентификация приложения)
+        default_headers = {
+            "HTTP-Referer": os.getenv("OPENROUTER_SITE_URL", "https://cu-grant-analyzis-project.onrender.com"),
+            "X-Title": os.getenv("OPENROUTER_APP_NAME", "CU Grant Analysis Project"),
+        }
+    elif LLM_BACKEND == "openai":
+        # Локальным серверам ключ не нужен, но клиент OpenAI требует непустую строку
+        api_key = os.getenv("LLM_API_KEY") or "EMPTY"
+        base_url = LLM_BASE_URL
+    elif LLM_BACKEND == "stub":
+        from stub_llm import StubModel, StubTransport
+
+        api_key = "stub"
+        base_url = "http://stub.local/v1"
+        transport = StubTransport(StubModel.from_env())
+    else:
+        raise RuntimeError(f"Unknown LLM_BACKEND: {LLM_BACKEND} (expected openrouter, openai or stub)")
+
+    http2 = LLM_HTTP2
+    if http2 and not _http2_available():
+        print("Предупреждение: LLM_HTTP2=1, но пакет h2 не установлен. Используется HTTP/1.1.")
+        http2 = False
+
+    http_client = httpx.Client(
+        http2=http2,
+        timeout=LLM_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        transport=transport,
+    )
+
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        http_client=http_client,
+        # Повторы делает наш код (call_with_retries, llm_scheduler) с учётом общего бюджета запросов
+        max_retries=0,
+        default_headers=default_headers,
+    )
+
+
+def get_client() -> OpenAI:
+    """
+    Return the process-wide client, creating it on first use.
+    Safe to call from several threads at once.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def close_client() -> None:
+    """Close the shared client and its connection pool (e.g. on app shutdown)."""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def with_cache_hints(messages, model: str):
+    """
+    Return messages with a `cache_control` breakpoint on the last message of
+    the stable prefix (all messages but the last) for providers that need it.
+    Other models get the messages unchanged.
+    """
+    if not LLM_CACHE_HINTS or len(messages) < 2 or not model.startswith(_CACHE_CONTROL_PREFIXES):
+        return messages
+    marked = [dict(m) for m in messages]
+    prefix_end = marked[-2]
+    prefix_end["content"] = [
+        {"type": "text", "text": prefix_end["content"], "cache_control": {"type": "ephemeral"}}
+    ]
+    return marked
+
+
+def _record_usage(raw_usage, usage: Optional[Dict[str, int]]) -> None:
+    """Add the usage block of a response to the totals and to `usage`, if given."""
+    if raw_usage is None:
+        return
+    details = getattr(raw_usage, "prompt_tokens_details", None)
+    values = {
+        "prompt_tokens": raw_usage.prompt_tokens or 0,
+        "completion_tokens": raw_usage.completion_tokens or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+    }
+    with _usage_lock:
+        _usage_totals["calls"] += 1
+        for name, value in values.items():
+            _usage_totals[name] += value
+            # Один словарь usage могут пополнять несколько потоков (map-шаг)
+            if usage is not None:
+                usage[name] = usage.get(name, 0) + value
+
+
+def usage_stats() -> Dict[str, int]:
+    """Token usage summed over all model calls of this process."""
+    with _usage_lock:
+        return dict(_usage_totals)
+
+
+def _create_completion(model: str, json_output: bool, **kwargs):
+    """
+    `chat.completions.create`, with JSON mode requested if `json_output`.
+    A model that rejects `response_format` with 400 is called again without
+    it and remembered, so later calls do not send it; the reply is then
+    validated against the schema by the caller as usual.
+    """
+    client = get_client()
+    # JSON mode поддерживают OpenAI и большинство моделей OpenRouter, но не все
+    if not (json_output and LLM_JSON_MODE) or model in _json_mode_rejected:
+        return client.chat.completions.create(model=model, **kwargs)
+    try:
+        return client.chat.completions.create(
+            model=model, response_format={"type": "json_object"}, **kwargs
+        )
+    except openai.BadRequestError as e:
+        if "response_format" not in str(e):
+            raise
+    _json_mode_rejected.add(model)
+    print(f"Предупреждение: модель {model} не поддерживает response_format, JSON запрашивается только промптом")
+    return client.chat.completions.create(model=model, **kwargs)
+
+
+def call_model(
+    messages,
+    model: str = "openai/gpt-4o",
+    temperature: float = 0.2,
+    usage: Optional[Dict[str, int]] = None,
+    json_output: bool = False,
+) -> str:
+    """
+    Call OpenRouter (OpenAI-compatible) chat completion API and return assistant reply text.
+    If `usage` is given, prompt/completion/cached token counts are added to it.
+    With `json_output` the reply is requested as a JSON object (see LLM_JSON_MODE).
+    """
+    response = _create_completion(
+        model,
+        json_output,
+        messages=with_cache_hints(messages, model),
+        timeout=LLM_TIMEOUT,
+        # Примечание: некоторые модели/провайдеры в OpenRouter могут не поддерживать temperature.
+        # Если словишь 400 — попробуй убрать temperature полностью.
+        # temperature=temperature,
+    )
+
+    _record_usage(response.usage, usage)
+    return response.choices[0].message.content
+
+
+def call_model_stream(
+    messages,
+    on_delta: Callable[[str], None],
+    model: str = "openai/gpt-4o",
+    temperature: float = 0.2,
+    usage: Optional[Dict[str, int]] = None,
+    json_output: bool = False,
+) -> str:
+    """
+    Call the chat completion API in streaming mode.
+
+    `on_delta` is called with every text fragment as it arrives (from the
+    calling thread); the full reply text is returned at the end.
+    `json_output` requests a JSON object as in `call_model`.
+    """
+    stream = _create_completion(
+        model,
+        json_output,
+        messages=with_cache_hints(messages, model),
+        timeout=LLM_TIMEOUT,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+
+    parts = []
+    try:
+        for chunk in stream:
+            # Последний чанк приходит без choices и содержит usage
+            if getattr(chunk, "usage", None) is not None:
+                _record_usage(chunk.usage, usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                on_delta(delta)
+    finally:
+        stream.close()
+
+    return "".join(parts)
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    Seconds to wait before retrying a failed call, or None if the error is
+    not worth retrying (bad request, auth, unknown model, ...).
+
+    Rate limits (429), timeouts, connection errors and 5xx responses are
+    retried. A Retry-After header sent by the provider is honoured;
+    otherwise the delay grows exponentially from LLM_RETRY_BASE_DELAY with
+    full jitter, so parallel workers do not retry in lockstep.
+    """
+    if isinstance(error, openai.APIStatusError):
+        if not (isinstance(error, openai.RateLimitError) or error.status_code >= 500):
+            return None
+        headers = error.response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return min(float(headers["retry-after-ms"]) / 1000, LLM_RETRY_MAX_DELAY)
+            if headers.get("retry-after"):
+                return min(float(headers["retry-after"]), LLM_RETRY_MAX_DELAY)
+        except ValueError:
+            # Retry-After в формате HTTP-даты — считаем задержку сами
+            pass
+    elif not isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return None
+    return random.uniform(0, min(LLM_RETRY_BASE_DELAY * 2 ** attempt, LLM_RETRY_MAX_DELAY))
+
+
+def call_with_retries(func: Callable[..., T], *args, retries: Optional[int] = None, **kwargs) -> T:
+    """
+    Call `func(*args, **kwargs)`, retrying rate-limited and transient
+    failures with backoff (see `retry_delay`). The last error is raised
+    when the retries are exhausted.
+    """
+    retries = LLM_MAX_RETRIES if retries is None else retries
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            delay = retry_delay(e, attempt) if attempt < retries else None
+            if delay is None:
+                raise
+            print(f"Предупреждение: вызов модели не удался ({e.__class__.__name__}), "
+                  f"повтор {attempt + 1}/{retries} через {delay:.1f} с")
+            time.sleep(delay)
+            attempt += 1
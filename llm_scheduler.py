@@ -0,0 +1,186 @@
+"""
+Scheduler between API tasks and the model client.
+
+Every model call of the API server goes through `ModelScheduler.run`, which
+
+* limits the number of simultaneous calls (MAX_CONCURRENT_MODEL_CALLS),
+* keeps the requests and tokens sent during the last minute within the
+  LLM_RPM / LLM_TPM budget, holding excess calls in a FIFO queue,
+* retries rate-limited (429) and transient failures (timeouts, connection
+  errors, 5xx) with jittered exponential backoff, honouring Retry-After
+  (see `llm_client.retry_delay`). A 429 pauses all calls until the
+  provider's Retry-After has passed, not only the one that got it.
+
+The slot is released while a call waits for its retry, so backoff never
+blocks other tasks. Queue depth and counters are reported by `stats()`.
+
+Time spent in the queue and in each call attempt is recorded in
+`metrics.py` (`grant_model_queue_seconds`, `grant_model_call_seconds`).
+
+The token cost of a call is estimated before it is sent: prompt tokens of
+the messages plus LLM_COMPLETION_TOKENS_ESTIMATE for the reply.
+
+Settings (environment variables):
+    LLM_RPM                         - requests per minute, 0 = no limit (default 0)
+    LLM_TPM                         - tokens per minute, 0 = no limit (default 0)
+    LLM_COMPLETION_TOKENS_ESTIMATE  - reply tokens assumed per call for LLM_TPM (default 1500)
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+import openai
+
+from llm_client import LLM_MAX_RETRIES, retry_delay
+from metrics import MODEL_CALL_SECONDS, MODEL_CALLS, MODEL_QUEUE_SECONDS
+
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", "1500"))
+
+_WINDOW = 60.0
+
+T = TypeVar("T")
+
+
+class ModelScheduler:
+    """Concurrency, rate budget and retries for blocking model calls run in an executor."""
+
+    def __init__(
+        self,
+        executor: Optional[Executor],
+        max_concurrent: int,
+        rpm: int = LLM_RPM,
+        tpm: int = LLM_TPM,
+        max_retries: int = LLM_MAX_RETRIES,
+    ):
+        self.executor = executor
+        self.max_concurrent = max_concurrent
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_retries = max_retries
+        self.queued = 0
+        self.running = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self._slots = asyncio.Semaphore(max_concurrent)
+        # asyncio.Lock будит ожидающих по очереди — вызовы проходят в порядке поступления
+        self._admission = asyncio.Lock()
+        # (время отправки, оценка токенов) вызовов за последнюю минуту
+        self._sent: Deque[Tuple[float, int]] = deque()
+        self._paused_until = 0.0
+
+    def _window(self, now: float) -> None:
+        while self._sent and self._sent[0][0] <= now - _WINDOW:
+            self._sent.popleft()
+
+    def _budget_delay(self, tokens: int, now: float) -> float:
+        """Seconds until a call of `tokens` fits into the per-minute budget."""
+        self._window(now)
+        delay = self._paused_until - now
+        if self.rpm and len(self._sent) >= self.rpm:
+            delay = max(delay, self._sent[len(self._sent) - self.rpm][0] + _WINDOW - now)
+        if self.tpm and self._sent:
+            used = sum(t for _, t in self._sent)
+            # Вызов больше всего бюджета пропускаем, когда окно опустеет
+            for sent_at, sent_tokens in self._sent:
+                if used + tokens <= self.tpm:
+                    break
+                used -= sent_tokens
+                delay = max(delay, sent_at + _WINDOW - now)
+        return delay
+
+    async def _acquire(self, tokens: int) -> None:
+        loop = asyncio.get_running_loop()
+        self.queued += 1
+        try:
+            async with self._admission:
+                await self._slots.acquire()
+                try:
+                    while True:
+                        delay = self._budget_delay(tokens, loop.time())
+                        if delay <= 0:
+                            break
+                        await asyncio.sleep(delay)
+                except BaseException:
+                    self._slots.release()
+                    raise
+                self._sent.append((loop.time(), tokens))
+        finally:
+            self.queued -= 1
+        self.running += 1
+
+    def _release(self) -> None:
+        self.running -= 1
+        self._slots.release()
+
+    async def run(
+        self,
+        func: Callable[[], T],
+        tokens: int = 0,
+        can_retry: Optional[Callable[[], bool]] = None,
+        on_start: Optional[Callable[[], None]] = None,
+        on_retry: Optional[Callable[[int, float, Exception], None]] = None,
+    ) -> T:
+        """
+        Run `func()` in the executor once a slot and budget are available.
+
+        `tokens` is the estimated cost of the call. `can_retry()` may veto a
+        retry (e.g. when a streamed reply has already been partly delivered).
+        `on_start()` is called when the call leaves the queue and
+        `on_retry(attempt, delay, error)` before each backoff.
+        """
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            queued_at = loop.time()
+            await self._acquire(tokens)
+            started = loop.time()
+            MODEL_QUEUE_SECONDS.observe(started - queued_at)
+            try:
+                if on_start is not None:
+                    on_start()
+                reply = await loop.run_in_executor(self.executor, func)
+                MODEL_CALLS.inc(outcome="ok")
+                return reply
+            except Exception as e:
+                MODEL_CALLS.inc(outcome="error")
+                error = e
+                delay = None
+                if attempt < self.max_retries and (can_retry is None or can_retry()):
+                    delay = retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                if isinstance(e, openai.RateLimitError):
+                    self.rate_limited += 1
+                    self._paused_until = max(self._paused_until, loop.time() + delay)
+            finally:
+                MODEL_CALL_SECONDS.observe(loop.time() - started)
+                self._release()
+
+            attempt += 1
+            self.retries += 1
+            if on_retry is not None:
+                on_retry(attempt, delay, error)
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, float]:
+        """Queue depth, load and counters (for GET /health)."""
+        now = asyncio.get_running_loop().time()
+        self._window(now)
+        return {
+            "queued": self.queued,
+            "running": self.running,
+            "max_concurrent": self.max_concurrent,
+            "rpm_limit": self.rpm,
+            "tpm_limit": self.tpm,
+            "requests_last_minute": len(self._sent),
+            "tokens_last_minute": sum(t for _, t in self._sent),
+            "paused_for": round(max(self._paused_until - now, 0.0), 1),
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+        }
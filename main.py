@@ -5,69 +5,29 @@ and send it to OpenAI `gpt-4o-mini` together with a user-provided prompt.
 Usage:
     OPENAI_API_KEY=... python main.py --prompt "Кратко резюмируй документ"
 
+Batch mode evaluates a directory or a manifest of PDFs (see batch_eval.py)
+and can be re-run to resume an interrupted round:
+    python main.py --batch grant_files/ --prompt-file prompt.txt --out-dir batch_results --concurrency 4
+
 Dependencies are listed in `requirements.txt`.
 """
 from __future__ import annotations
 
 import argparse
-import os
 from pathlib import Path
 
-from openai import OpenAI
-
-from pdf_utils import extract_pdf_text
+from batch_eval import run_batch
+from extraction_cache import extract_pdf_text_cached
+from llm_client import call_with_retries
+from map_reduce import count_message_tokens, fits_context, run_map_reduce
 from prompt_utils import build_messages
+from response_cache import call_model_cached
+from rules_registry import get_rules_registry
 from dotenv import load_dotenv 
 
 load_dotenv()
 
 
-'''def call_model(messages, model: str = "gpt-5-mini", temperature: float = 0.2) -> str:
-    """
-    Call the OpenAI chat completion API and return the assistant reply text.
-    """
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY is not set in the environment.")
-
-    client = OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-    )
-    return response.choices[0].message.content'''
-
-#Вариант через Openrouter
-def call_model(messages, model: str = "openai/gpt-4o") -> str:
-    """
-    Call OpenRouter (OpenAI-compatible) chat completion API and return assistant reply text.
-    """
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENROUTER_API_KEY is not set in the environment.")
-
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://openrouter.ai/api/v1",
-        # Рекомендуемые OpenRouter заголовки (идентификация приложения)
-        default_headers={
-            "HTTP-Referer": os.getenv("OPENROUTER_SITE_URL", "https://cu-grant-analyzis-project.onrender.com"),
-            "X-Title": os.getenv("OPENROUTER_APP_NAME", "CU Grant Analysis Project"),
-        },
-    )
-
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        # Примечание: некоторые модели/провайдеры в OpenRouter могут не поддерживать temperature.
-        # Если словишь 400 — попробуй убрать temperature полностью.
-        # temperature=0.2,
-    )
-
-    return response.choices[0].message.content
-
-
 def main():
     parser = argparse.ArgumentParser(
         description="Parse PDF and query gpt-5 with the PDF content + user prompt."
@@ -80,6 +40,12 @@ def main():
         help="User prompt to pass to the model (e.g., 'Проверь, удовлетворяет ли проект рекомендациям по оформлению заявок.').",
     )
 
+    parser.add_argument(
+        "--prompt-file",
+        type=Path,
+        help="Read the prompt from a UTF-8 text file instead of --prompt.",
+    )
+
     parser.add_argument(
         "--model",
         default="openai/gpt-4o",
@@ -94,11 +60,38 @@ def main():
         help="Path to the PDF file.",
     )
 
+    parser.add_argument(
+        "--batch",
+        type=Path,
+        help="Directory with PDFs or a manifest file (one PDF path per line) to evaluate in batch mode.",
+    )
+
+    parser.add_argument(
+        "--out-dir",
+        type=Path,
+        default=Path("batch_results"),
+        help="Batch mode: where to write per-application JSON results and expert_decisions.csv.",
+    )
+
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Batch mode: max simultaneous model calls (default: 4).",
+    )
+
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Batch mode: re-evaluate applications that already have a completed result.",
+    )
+
+    registry = get_rules_registry()
     parser.add_argument(
         "--organization",
-        default="ФПИ",
-        help="Organization to use (default: ФПИ).",
-        choices=["ФПИ", "ЦУ"],
+        default=registry.default,
+        help=f"Organization to use (default: {registry.default}).",
+        choices=registry.names(),
     )
 
     parser.add_argument(
@@ -108,6 +101,12 @@ def main():
         choices=["application", "presentation"],
     )
 
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not reuse a cached model reply for the same prompt and document.",
+    )
+
     #Температуру в итоге убрали
     '''parser.add_argument(
         "--temperature",
@@ -118,18 +117,54 @@ def main():
 
     args = parser.parse_args()
 
+    prompt = args.prompt
+    if args.prompt_file:
+        prompt = args.prompt_file.read_text(encoding="utf-8").strip()
+
+    if args.batch:
+        if not args.batch.exists():
+            raise FileNotFoundError(f"Batch source not found: {args.batch}")
+        results = run_batch(
+            args.batch,
+            args.out_dir,
+            prompt,
+            model=args.model,
+            organization=args.organization,
+            type=args.type,
+            concurrency=args.concurrency,
+            bypass_cache=args.no_cache,
+            resume=not args.no_resume,
+        )
+        if any(r["status"] != "completed" for r in results):
+            raise SystemExit(1)
+        return
+
     pdf_path: Path = args.pdf
     if not pdf_path.exists():
         raise FileNotFoundError(f"PDF not found: {pdf_path}")
 
-    pdf_text = extract_pdf_text(pdf_path, type=args.type)
+    pdf_text = extract_pdf_text_cached(pdf_path, type=args.type)
     
     print(f'Тип обработки: {args.type}')
     print(f'Начало текста: {pdf_text[:100]}')
-    messages = build_messages(pdf_text, args.prompt, args.organization)
+    messages = build_messages(pdf_text, prompt, args.organization)
     print("Промпт: ", str(messages)[:300])
-    print('Вызываем модель...')
-    reply = call_model(messages, model=args.model)
+    if fits_context(messages):
+        print('Вызываем модель...')
+        reply, cached = call_with_retries(
+            call_model_cached, messages, model=args.model, bypass_cache=args.no_cache
+        )
+        if cached:
+            print("(ответ взят из кэша)")
+    else:
+        print(f"Документ не помещается в контекст (~{count_message_tokens(messages)} токенов), "
+              "оцениваем по фрагментам...")
+        reply = run_map_reduce(
+            pdf_text,
+            prompt,
+            lambda m: call_with_retries(call_model_cached, m, model=args.model, bypass_cache=args.no_cache)[0],
+            organization=args.organization,
+        )
     print(reply)
 
 
@@ -0,0 +1,148 @@
+"""
+Token-aware chunking and map-reduce evaluation of long documents.
+
+When the messages built by `prompt_utils.build_messages` fit into the model
+context they are sent as is (fast path). Otherwise the PDF text is split
+into overlapping chunks along paragraph/section boundaries, every chunk is
+summarised against the expert instruction (map), and a final request
+combines the notes into the answer in the format the instruction asks for
+(reduce), so ui.py receives the same JSON as for a short document.
+Token counts come from `tokens.py`.
+
+Settings (environment variables):
+    LLM_CONTEXT_TOKENS      - max input tokens of one request (default 100000)
+    CHUNK_TOKENS            - size of one chunk in tokens (default 12000)
+    CHUNK_OVERLAP_TOKENS    - overlap between neighbouring chunks (default 500)
+    MAP_MAX_PARALLEL        - max simultaneous map calls per document (default 4)
+"""
+from __future__ import annotations
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from prompt_utils import build_map_messages, build_reduce_messages
+from tokens import CHARS_PER_TOKEN, count_message_tokens, count_tokens
+
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "100000"))
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "12000"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "500"))
+MAP_MAX_PARALLEL = int(os.getenv("MAP_MAX_PARALLEL", "4"))
+
+# Строки, похожие на заголовки разделов: "1.", "2.3", "Раздел", "ГЛАВА", строка капсом
+_HEADING_RE = re.compile(
+    r"^(\d+(\.\d+)*\.?\s+\S|(?i:раздел|глава|часть|приложение)\b|[А-ЯЁA-Z0-9\s\-«»\"]{6,}$)"
+)
+
+
+def fits_context(messages, context_tokens: Optional[int] = None) -> bool:
+    """True if the messages can be sent in one request."""
+    limit = LLM_CONTEXT_TOKENS if context_tokens is None else context_tokens
+    return count_message_tokens(messages) <= limit
+
+
+def _split_long(paragraph: str, max_tokens: int) -> List[str]:
+    """Split a paragraph longer than max_tokens by lines, then by characters."""
+    pieces: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for line in paragraph.splitlines():
+        line_tokens = count_tokens(line)
+        if line_tokens > max_tokens:
+            step = max_tokens * CHARS_PER_TOKEN
+            parts = [line[i:i + step] for i in range(0, len(line), step)]
+        else:
+            parts = [line]
+        for part in parts:
+            part_tokens = count_tokens(part)
+            if current and current_tokens + part_tokens > max_tokens:
+                pieces.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        pieces.append("\n".join(current))
+    return pieces
+
+
+def split_into_chunks(
+    text: str,
+    chunk_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None,
+) -> List[str]:
+    """
+    Split text into chunks of at most `chunk_tokens` tokens.
+
+    Chunks are built from whole paragraphs (blocks separated by blank lines,
+    which also separate PDF pages); a new chunk is started early at a line
+    that looks like a section heading once the current chunk is half full.
+    The last paragraphs of a chunk, up to `overlap_tokens`, are repeated at
+    the start of the next one.
+    """
+    chunk_tokens = CHUNK_TOKENS if chunk_tokens is None else chunk_tokens
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    overlap_tokens = min(overlap_tokens, chunk_tokens // 2)
+
+    paragraphs: List[str] = []
+    for block in re.split(r"\n\s*\n", text):
+        block = block.strip()
+        if not block:
+            continue
+        if count_tokens(block) > chunk_tokens:
+            paragraphs.extend(_split_long(block, chunk_tokens - overlap_tokens))
+        else:
+            paragraphs.append(block)
+
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for paragraph in paragraphs:
+        tokens = count_tokens(paragraph)
+        is_heading = bool(_HEADING_RE.match(paragraph.splitlines()[0].strip()))
+        full = current_tokens + tokens > chunk_tokens
+        at_section = is_heading and current_tokens >= chunk_tokens // 2
+        if current and (full or at_section):
+            chunks.append("\n\n".join(current))
+            # Перекрытие: переносим хвост предыдущего фрагмента
+            tail: List[str] = []
+            tail_tokens = 0
+            for previous in reversed(current):
+                previous_tokens = count_tokens(previous)
+                if tail_tokens + previous_tokens > overlap_tokens:
+                    break
+                tail.insert(0, previous)
+                tail_tokens += previous_tokens
+            if tail_tokens + tokens > chunk_tokens:
+                tail, tail_tokens = [], 0
+            current, current_tokens = tail, tail_tokens
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def run_map_reduce(
+    pdf_text: str,
+    user_prompt: str,
+    call: Callable[[list], str],
+    organization: str = "ФПИ",
+    max_parallel: Optional[int] = None,
+) -> str:
+    """
+    Evaluate a long document with blocking model calls (used by the CLI).
+
+    `call(messages) -> str` performs one model request. Map calls run in a
+    thread pool of `max_parallel` threads, then one reduce call produces
+    the final answer.
+    """
+    chunks = split_into_chunks(pdf_text)
+    map_messages = [
+        build_map_messages(chunk, user_prompt, i, len(chunks), organization=organization)
+        for i, chunk in enumerate(chunks, start=1)
+    ]
+    workers = min(MAP_MAX_PARALLEL if max_parallel is None else max_parallel, len(chunks))
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="map-call") as pool:
+        notes = list(pool.map(call, map_messages))
+    return call(build_reduce_messages(notes, user_prompt, organization=organization))
@@ -0,0 +1,191 @@
+"""
+Process metrics in the Prometheus text format (`GET /metrics`).
+
+A small in-process registry, so the server needs no extra dependency:
+counters and histograms are updated where the work happens (task stages
+in api_server.py, model calls in llm_scheduler.py); values that already
+exist elsewhere — task counts by status, cache hit/miss counters, token
+usage, scheduler load — are read by collectors at scrape time.
+
+Metrics live in the process that does the work. With JOB_QUEUE=sqlite the
+stage and model-call metrics are recorded by workers, which serve them with
+`python -m worker --metrics-port PORT`.
+"""
+from __future__ import annotations
+
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Границы корзин гистограмм по умолчанию, сек: от долей секунды до длинных map-reduce
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """Cumulative histogram (`_bucket`, `_sum`, `_count`) with optional labels."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # labels -> (счётчики по корзинам, сумма, количество)
+        self._values: Dict[Labels, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _labels(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        out = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    out.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), bucket_count))
+                out.append((f"{self.name}_bucket", key + (("le", "+Inf"),), count))
+                out.append((f"{self.name}_sum", key, total))
+                out.append((f"{self.name}_count", key, count))
+        return out
+
+
+class Collected:
+    """
+    Metric whose values are read at scrape time: `collect()` returns a
+    number or a list of (labels, value) pairs.
+    """
+
+    def __init__(self, name: str, help: str, type: str, collect: Callable):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.collect = collect
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        values = self.collect()
+        if values is None:
+            return []
+        if isinstance(values, (int, float)):
+            return [(self.name, (), values)]
+        return [(self.name, _labels(labels), value) for labels, value in values]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def collected(
+        self, name: str, help: str, collect: Callable[[], Optional[Iterable]], type: str = "gauge"
+    ) -> Collected:
+        """Register (or replace) a metric read from `collect()` at scrape time."""
+        return self.register(Collected(name, help, type, collect))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # Сбой одного сборщика не должен ломать весь /metrics
+                print(f"Предупреждение: метрика {metric.name} не собрана: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Метрики, которые обновляются по ходу работы
+TASKS_FINISHED = REGISTRY.counter(
+    "grant_tasks_finished_total", "Tasks finished by this process, by final status."
+)
+TASK_STAGE_SECONDS = REGISTRY.histogram(
+    "grant_task_stage_seconds",
+    "Duration of task pipeline stages (queued, extraction, build_messages, model, total).",
+)
+PDF_PAGES = REGISTRY.histogram(
+    "grant_pdf_pages", "Pages per processed PDF.", buckets=(1, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+MODEL_QUEUE_SECONDS = REGISTRY.histogram(
+    "grant_model_queue_seconds", "Time a model call waited for a slot and the rate budget."
+)
+MODEL_CALL_SECONDS = REGISTRY.histogram(
+    "grant_model_call_seconds", "Duration of one model call attempt."
+)
+MODEL_CALLS = REGISTRY.counter(
+    "grant_model_calls_total", "Model call attempts, by outcome (ok, error)."
+)
+TASKS_COALESCED = REGISTRY.counter(
+    "grant_tasks_coalesced_total", "Tasks attached to an identical task that was already in progress."
+)
+REPLY_REPAIRS = REGISTRY.counter(
+    "grant_reply_repairs_total",
+    "Structured replies needing repair, by kind (fences, truncation, reask, failed).",
+)
@@ -1,72 +1,305 @@
 """
-Парсинг PDF файла в текстовый файл.
+Парсинг PDF файлов в текстовые файлы.
 
-Скрипт обрабатывает один PDF файл и сохраняет извлеченный текст
-в папку 'parsed_texts/' с тем же названием.
+Скрипт принимает PDF файлы, папки и glob-шаблоны, обрабатывает файлы
+параллельно в пуле процессов и сохраняет извлеченный текст в папку
+'parsed_texts/' (или --output-dir) с тем же названием и расширением .txt.
+
+Повторный запуск обрабатывает только изменившиеся файлы: файл пропускается,
+если результат новее исходного PDF или если SHA-256 PDF не изменился с
+прошлой обработки (хэши хранятся в .cache/parse_state.json). Результат
+записывается во временный файл и заменяет прежний только после успешного
+извлечения; файл, обработка которого завершилась ошибкой, отмечается в
+состоянии и при следующем запуске обрабатывается заново. --force
+обрабатывает все файлы заново. В конце печатается сводка: скорость в
+файлах и страницах в секунду и список ошибок.
 
 Использование:
     python parse_pdf_to_text.py file.pdf
+    python parse_pdf_to_text.py grant_files/ --workers 8
+    python parse_pdf_to_text.py "archive/**/*.pdf" --type presentation
 """
 from __future__ import annotations
 
 import argparse
+import glob
+import json
+import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from extraction_cache import file_sha256, write_pdf_text_cached
+from pdf_utils import count_pdf_pages
+
+SCRIPT_DIR = Path(__file__).parent
+DEFAULT_OUTPUT_DIR = SCRIPT_DIR / "parsed_texts"
+STATE_PATH = SCRIPT_DIR / ".cache" / "parse_state.json"
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def collect_pdfs(inputs: List[str], recursive: bool = False) -> Tuple[List[Path], List[str]]:
+    """
+    Раскрывает аргументы командной строки в список PDF файлов.
+
+    Аргумент может быть файлом, папкой (берутся *.pdf, с --recursive —
+    и во вложенных папках) или glob-шаблоном. Возвращает найденные файлы
+    без повторов и список ошибок для аргументов, которые не удалось разобрать.
+    """
+    found: List[Path] = []
+    errors: List[str] = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            pattern = "**/*" if recursive else "*"
+            matches = sorted(p for p in path.glob(pattern) if p.suffix.lower() == ".pdf" and p.is_file())
+            if not matches:
+                errors.append(f"в папке нет PDF файлов: {path}")
+            found.extend(matches)
+        elif path.is_file():
+            if path.suffix.lower() != ".pdf":
+                errors.append(f"указанный файл не является PDF: {path}")
+            else:
+                found.append(path)
+        elif glob.has_magic(item):
+            matches = sorted(
+                Path(p) for p in glob.glob(item, recursive=True)
+                if p.lower().endswith(".pdf") and Path(p).is_file()
+            )
+            if not matches:
+                errors.append(f"шаблону не соответствует ни один PDF файл: {item}")
+            found.extend(matches)
+        else:
+            errors.append(f"файл не найден: {path}")
+
+    unique: List[Path] = []
+    seen = set()
+    for path in found:
+        key = path.resolve()
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique, errors
+
+
+def load_state(path: Path = STATE_PATH) -> Dict[str, Dict]:
+    """Читает хэши ранее обработанных файлов; при ошибке возвращает пустое состояние."""
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state: Dict[str, Dict], path: Path = STATE_PATH) -> None:
+    """Атомарно сохраняет хэши обработанных файлов."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(state, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Предупреждение: не удалось сохранить {path}: {e}", file=sys.stderr)
+
+
+def is_up_to_date(pdf_path: Path, output_path: Path, type: str, entry: Optional[Dict]) -> bool:
+    """
+    True, если результат новее исходного PDF и получен в том же режиме.
+    Если PDF новее результата, решение принимает проверка хэша в `convert_one`.
+    После ошибки обработки результат не считается актуальным, каким бы ни был его mtime.
+    """
+    if entry is not None and (entry.get("failed") or entry.get("type") != type):
+        return False
+    try:
+        return output_path.stat().st_mtime_ns >= pdf_path.stat().st_mtime_ns
+    except OSError:
+        return False
+
+
+def convert_one(
+    pdf_path: str,
+    output_path: str,
+    type: str,
+    known_hash: Optional[str],
+    page_workers: Optional[int],
+) -> Dict:
+    """
+    Worker: извлекает текст одного PDF в файл.
 
-from pdf_utils import extract_pdf_text
+    Если SHA-256 PDF совпадает с `known_hash` и результат существует, файл
+    не обрабатывается (у результата только обновляется mtime).
+    """
+    started = time.perf_counter()
+    content_hash = file_sha256(Path(pdf_path))
+    out = Path(output_path)
+    if known_hash == content_hash and out.exists():
+        os.utime(out)
+        return {"skipped": True, "sha256": content_hash, "pages": 0, "seconds": 0.0}
+
+    num_pages = write_pdf_text_cached(
+        Path(pdf_path), out, type=type, content_hash=content_hash, workers=page_workers
+    )
+    if num_pages is None:
+        # Текст взят из кэша извлечения — страницы считаем без извлечения
+        num_pages = count_pdf_pages(pdf_path)
+    return {
+        "skipped": False,
+        "sha256": content_hash,
+        "pages": num_pages,
+        "seconds": time.perf_counter() - started,
+    }
 
 
 def main():
-    """Основная функция для парсинга одного PDF файла."""
+    """Основная функция для пакетного парсинга PDF файлов."""
     parser = argparse.ArgumentParser(
-        description="Парсит PDF файл и сохраняет текст в текстовый файл."
+        description="Парсит PDF файлы (файлы, папки, glob-шаблоны) и сохраняет текст в текстовые файлы."
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="PDF файлы, папки с PDF или glob-шаблоны (например, \"archive/**/*.pdf\")",
     )
     parser.add_argument(
-        "pdf_file",
+        "--output-dir",
         type=Path,
-        help="Путь к PDF файлу для обработки",
+        default=DEFAULT_OUTPUT_DIR,
+        help="Папка для текстовых файлов (по умолчанию parsed_texts/)",
+    )
+    parser.add_argument(
+        "--type",
+        choices=["application", "presentation"],
+        default="application",
+        help="Режим извлечения текста: заявка или презентация (по умолчанию application)",
     )
-    
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Число параллельно обрабатываемых файлов (по умолчанию {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--recursive",
+        action="store_true",
+        help="Искать PDF и во вложенных папках",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Обработать все файлы заново, даже если результат актуален",
+    )
+
     args = parser.parse_args()
-    
-    pdf_path = Path(args.pdf_file)
-    
-    # Проверяем существование файла
-    if not pdf_path.exists():
-        print(f"✗ Файл не найден: {pdf_path}", file=sys.stderr)
-        sys.exit(1)
-    
-    if not pdf_path.suffix.lower() == ".pdf":
-        print(f"✗ Указанный файл не является PDF: {pdf_path}", file=sys.stderr)
-        sys.exit(1)
-    
-    # Определяем выходную папку
-    script_dir = Path(__file__).parent
-    output_dir = script_dir / "parsed_texts"
-    
+
+    pdf_paths, failures = collect_pdfs(args.inputs, recursive=args.recursive)
+    for message in failures:
+        print(f"✗ {message[0].upper()}{message[1:]}", file=sys.stderr)
+
     # Создаем выходную папку, если её нет
-    output_dir.mkdir(exist_ok=True)
-    
-    try:
-        # Извлекаем текст из PDF
-        print(f"Обработка файла: {pdf_path.name}...")
-        text = extract_pdf_text(pdf_path)
-        
+    output_dir = args.output_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    state = load_state()
+    jobs: List[Tuple[Path, Path, Optional[str]]] = []
+    outputs: Dict[str, Path] = {}
+    skipped = 0
+    for pdf_path in pdf_paths:
         # Создаем имя выходного файла (то же имя, но .txt)
-        output_filename = pdf_path.stem + ".txt"
-        output_path = output_dir / output_filename
-        
-        # Сохраняем текст в файл
-        output_path.write_text(text, encoding="utf-8")
-        
-        print(f"✓ Успешно обработан: {pdf_path.name}")
-        print(f"✓ Результат сохранен: {output_path}")
-        
-    except Exception as e:
-        print(f"✗ Ошибка при обработке {pdf_path.name}: {e}", file=sys.stderr)
+        output_path = output_dir / (pdf_path.stem + ".txt")
+        key = str(output_path.resolve())
+        if key in outputs:
+            message = f"{pdf_path}: имя результата совпадает с {outputs[key]}"
+            print(f"✗ {message}", file=sys.stderr)
+            failures.append(message)
+            continue
+        outputs[key] = pdf_path
+
+        entry = state.get(key)
+        if not args.force and is_up_to_date(pdf_path, output_path, args.type, entry):
+            skipped += 1
+            continue
+        known_hash = None
+        if not args.force and entry is not None and entry.get("type") == args.type:
+            known_hash = entry.get("sha256")
+        jobs.append((pdf_path, output_path, known_hash))
+
+    workers = max(1, min(args.workers, len(jobs)))
+    # Несколько файлов параллельно — внутри файла страницы извлекаются последовательно,
+    # один файл — страницы большого документа извлекаются параллельно (см. pdf_utils.py)
+    page_workers = 1 if workers > 1 else None
+
+    processed = 0
+    pages = 0
+    started = time.perf_counter()
+
+    def on_done(pdf_path: Path, output_path: Path, result: Dict) -> None:
+        nonlocal processed, pages, skipped
+        state[str(output_path.resolve())] = {
+            "source": str(pdf_path.resolve()),
+            "sha256": result["sha256"],
+            "type": args.type,
+        }
+        if result["skipped"]:
+            skipped += 1
+            return
+        processed += 1
+        pages += result["pages"]
+        print(f"✓ {pdf_path.name} → {output_path} ({result['pages']} стр., {result['seconds']:.1f} с)")
+
+    def on_error(pdf_path: Path, output_path: Path, error: Exception) -> None:
+        # Без хэша и с отметкой об ошибке: следующий запуск обработает файл заново
+        state[str(output_path.resolve())] = {
+            "source": str(pdf_path.resolve()),
+            "type": args.type,
+            "failed": True,
+        }
+        message = f"{pdf_path}: {error}"
+        print(f"✗ Ошибка при обработке {message}", file=sys.stderr)
+        failures.append(message)
+
+    try:
+        if workers == 1:
+            for pdf_path, output_path, known_hash in jobs:
+                try:
+                    result = convert_one(str(pdf_path), str(output_path), args.type, known_hash, page_workers)
+                except Exception as e:
+                    on_error(pdf_path, output_path, e)
+                else:
+                    on_done(pdf_path, output_path, result)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(
+                        convert_one, str(pdf_path), str(output_path), args.type, known_hash, page_workers
+                    ): (pdf_path, output_path)
+                    for pdf_path, output_path, known_hash in jobs
+                }
+                for future in as_completed(futures):
+                    pdf_path, output_path = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        on_error(pdf_path, output_path, e)
+                    else:
+                        on_done(pdf_path, output_path, result)
+    finally:
+        save_state(state)
+
+    elapsed = time.perf_counter() - started
+    rate_elapsed = max(elapsed, 1e-6)
+    print()
+    print(f"Обработано файлов: {processed}, страниц: {pages}, пропущено (без изменений): {skipped}, ошибок: {len(failures)}")
+    print(
+        f"Время: {elapsed:.1f} с, скорость: {processed / rate_elapsed:.2f} файлов/с, "
+        f"{pages / rate_elapsed:.1f} страниц/с (процессов: {workers})"
+    )
+    if failures:
+        print("Ошибки:", file=sys.stderr)
+        for message in failures:
+            print(f"  ✗ {message}", file=sys.stderr)
         sys.exit(1)
 
 
 if __name__ == "__main__":
     main()
-
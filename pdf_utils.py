@@ -1,40 +1,163 @@
 from __future__ import annotations
 
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 from pypdf import PdfReader
 
+# Документы от этого числа страниц извлекаются параллельно по диапазонам страниц
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+# Число процессов для параллельного извлечения (1 — всегда последовательно)
+PDF_PARALLEL_WORKERS = int(os.getenv("PDF_PARALLEL_WORKERS", str(min(4, os.cpu_count() or 1))))
 
-def extract_pdf_text(pdf_path: Path, type: str = "application") -> str:
+
+def _page_text(page, type: str) -> str:
+    """Extract and strip the text of one page in the given mode."""
+    if type == "application":
+        text = page.extract_text() or ""
+    elif type == "presentation":
+        # Для презентаций используем layout mode для лучшего извлечения текста
+        text: Optional[str] = page.extract_text(
+            extraction_mode="layout",
+            layout_mode_space_vertically=False,
+        )
+    else:
+        raise ValueError(f"Invalid type: {type}")
+    return (text or "").strip()
+
+
+def extract_page_range(pdf_path: str, type: str, start: int, stop: int) -> List[str]:
+    """Worker: open the PDF independently and extract pages [start, stop)."""
+    reader = PdfReader(pdf_path)
+    return [_page_text(reader.pages[i], type) for i in range(start, stop)]
+
+
+def _split_pages(num_pages: int, parts: int) -> List[tuple]:
+    """Split page indices into `parts` contiguous (start, stop) ranges."""
+    size, rest = divmod(num_pages, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        stop = start + size + (1 if i < rest else 0)
+        if stop > start:
+            ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def page_ranges(num_pages: int, workers: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    Page ranges [start, stop) to extract in parallel: the whole document as
+    one range below PDF_PARALLEL_MIN_PAGES pages, otherwise `workers`
+    (default PDF_PARALLEL_WORKERS) contiguous ranges.
+    """
+    workers = PDF_PARALLEL_WORKERS if workers is None else workers
+    workers = min(workers, num_pages)
+    if workers <= 1 or num_pages < PDF_PARALLEL_MIN_PAGES:
+        return [(0, num_pages)] if num_pages else []
+    return _split_pages(num_pages, workers)
+
+
+def join_pages(texts: Iterable[str]) -> str:
+    """Document text from page texts in order: non-empty pages separated by blank lines."""
+    return "\n\n".join(text for text in texts if text)
+
+
+def iter_pdf_pages(
+    pdf_path: Path, type: str = "application", workers: Optional[int] = None
+) -> Iterator[Tuple[int, str]]:
+    """
+    Lazily extract a PDF page by page.
+
+    Yields (page_number, text) for every page in order, page numbers start
+    at 1; the text is stripped and may be empty. Documents with at least
+    PDF_PARALLEL_MIN_PAGES pages are split into page ranges extracted in a
+    process pool (each worker opens its own reader); pages of the first
+    range are yielded as soon as that range is done.
+
+    Callers that already run inside a worker pool pass `workers=1`, so that
+    pools are not nested; to spread a large document over an existing pool
+    use `extract_pdf_text_in_pool`.
+    """
+    if type not in ("application", "presentation"):
+        raise ValueError(f"Invalid type: {type}")
+
+    reader = PdfReader(str(pdf_path))
+    ranges = page_ranges(len(reader.pages), workers)
+
+    if len(ranges) <= 1:
+        for number, page in enumerate(reader.pages, start=1):
+            yield number, _page_text(page, type)
+        return
+
+    with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+        futures = [
+            pool.submit(extract_page_range, str(pdf_path), type, start, stop)
+            for start, stop in ranges
+        ]
+        for (start, _), future in zip(ranges, futures):
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
+
+
+def count_pdf_pages(pdf_path: Path) -> int:
+    """Number of pages of a PDF (reads the page tree, not the page contents)."""
+    return len(PdfReader(str(pdf_path)).pages)
+
+
+def extract_pdf_text(pdf_path: Path, type: str = "application", workers: Optional[int] = None) -> str:
     """
     Extract plain text from all pages of a PDF using pypdf.
     Returns a single string with page contents separated by blank lines.
     """
-    reader = PdfReader(str(pdf_path))
-    parts: List[str] = []
+    return join_pages(text for _, text in iter_pdf_pages(pdf_path, type, workers))
 
-    if type == "application":
-        for page in reader.pages:
-            text = page.extract_text() or ""
-            cleaned = text.strip()
-            if cleaned:
-                parts.append(cleaned)
-        return "\n\n".join(parts).strip()
-    elif type == "presentation":
-        for page in reader.pages:
-            # Для презентаций используем layout mode для лучшего извлечения текста
-            text: Optional[str] = page.extract_text(
-                extraction_mode="layout",
-                layout_mode_space_vertically=False,
-            )
-
-            cleaned = (text or "").strip()
-            if cleaned:
-                parts.append(cleaned)
-
-        return "\n\n".join(parts).strip()
-    else:
+
+def extract_pdf_text_in_pool(
+    pool: Executor, pdf_path: Path, type: str = "application", workers: Optional[int] = None
+) -> str:
+    """
+    Same as `extract_pdf_text`, but the page ranges (see `page_ranges`) are
+    submitted to an existing process pool shared with other documents
+    instead of a pool of its own. Blocks until all ranges are extracted.
+    """
+    if type not in ("application", "presentation"):
         raise ValueError(f"Invalid type: {type}")
+    ranges = page_ranges(count_pdf_pages(pdf_path), workers)
+    futures = [pool.submit(extract_page_range, str(pdf_path), type, start, stop) for start, stop in ranges]
+    return join_pages(text for future in futures for text in future.result())
 
 
+def write_pdf_text(
+    pdf_path: Path, out_path: Path, type: str = "application", workers: Optional[int] = None
+) -> int:
+    """
+    Write the text of a PDF to `out_path` page by page, without holding the
+    whole document in memory. The file content equals `extract_pdf_text`.
+    Returns the number of pages.
+
+    Pages are streamed into a temporary file next to `out_path` that replaces
+    it only when the whole document has been extracted: a failed extraction
+    leaves the previous file (or no file) instead of a truncated one.
+    """
+    out_path = Path(out_path)
+    tmp_path = out_path.with_name(f"{out_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    num_pages = 0
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            first = True
+            for num_pages, text in iter_pdf_pages(pdf_path, type, workers):
+                if not text:
+                    continue
+                if not first:
+                    f.write("\n\n")
+                f.write(text)
+                first = False
+        os.replace(tmp_path, out_path)
+    finally:
+        # После успешного os.replace временного файла уже нет
+        tmp_path.unlink(missing_ok=True)
+    return num_pages
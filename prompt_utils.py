@@ -1,69 +1,71 @@
 from __future__ import annotations
 
-from pathlib import Path
-from typing import Optional
+import os
+import threading
+from typing import Dict, List, Optional
 
-# Кэш для рекомендаций (загружаются один раз для каждой организации)
-_GRANT_RULES_CACHE: dict[str, str] = {}
+from rules_index import get_rules_index
+from rules_registry import get_rules_registry
+
+# Как вставлять рекомендации в системный промпт:
+#   "relevant" — только RULES_TOP_K разделов, наиболее близких к запросу (BM25, см. rules_index.py)
+#   "full"     — весь текст рекомендаций
+RULES_MODE = os.getenv("RULES_MODE", "relevant")
+RULES_TOP_K = int(os.getenv("RULES_TOP_K", "8"))
+# По чему искать разделы: "prompt" — по инструкции эксперта (префикс промпта одинаков
+# для всех документов раунда и кэшируется провайдером), "document" — по инструкции и тексту документа
+RULES_QUERY = os.getenv("RULES_QUERY", "prompt")
+
+# Последнее выведенное предупреждение по каждой организации: одно и то же
+# предупреждение печатается один раз, а не при каждом построении промпта
+_warnings: Dict[str, Optional[str]] = {}
+_warnings_lock = threading.Lock()
+
+
+def _warn_on_change(organization: str, message: Optional[str]) -> None:
+    """Печатает предупреждение, только если оно отличается от предыдущего для этой организации."""
+    with _warnings_lock:
+        if _warnings.get(organization) == message:
+            return
+        _warnings[organization] = message
+    if message:
+        print(f"Предупреждение: {message}")
 
 
 def _load_grant_rules(organization: str = "ФПИ") -> str:
     """
-    Загружает рекомендации по оформлению заявок из файла в зависимости от организации.
-    Кэширует результат для последующих вызовов.
+    Возвращает рекомендации по оформлению заявок для организации.
+    Организации и их файлы описаны в манифесте parsed_texts/organizations.json;
+    файл перечитывается только после изменения (см. rules_registry.py).
     
     Args:
-        organization: Организация ("ФПИ" или "ЦУ")
+        organization: Название организации из манифеста (например, "ФПИ" или "ЦУ")
     
     Returns:
         Текст рекомендаций или пустая строка, если файл не найден
     """
-    global _GRANT_RULES_CACHE
-    
-    # Проверяем кэш
-    if organization in _GRANT_RULES_CACHE:
-        return _GRANT_RULES_CACHE[organization]
-    
-    # Определяем путь к файлу в зависимости от организации
-    if organization == "ФПИ":
-        rules_filename = "rules_grant.txt"
-    elif organization == "ЦУ":
-        rules_filename = "cu_rules.txt"
-    else:
-        print(f"Предупреждение: неизвестная организация '{organization}'. Используется ФПИ.")
-        rules_filename = "rules_grant.txt"
-    
-    rules_path = Path(__file__).parent / "parsed_texts" / rules_filename
-    
-    if rules_path.exists():
-        try:
-            rules_text = rules_path.read_text(encoding="utf-8").strip()
-            _GRANT_RULES_CACHE[organization] = rules_text
-            return rules_text
-        except Exception as e:
-            # Если не удалось загрузить, возвращаем пустую строку
-            print(f"Предупреждение: не удалось загрузить рекомендации из {rules_path}: {e}")
-            _GRANT_RULES_CACHE[organization] = ""
+    registry = get_rules_registry()
+    entry = registry.get(organization)
+    if entry is None:
+        _warn_on_change(organization, f"неизвестная организация '{organization}'. Используется {registry.default}.")
+        entry = registry.get(registry.default)
+        if entry is None:
             return ""
-    else:
-        # Файл не найден - возвращаем пустую строку
-        print(f"Предупреждение: файл рекомендаций не найден: {rules_path}")
-        _GRANT_RULES_CACHE[organization] = ""
-        return ""
 
+    _warn_on_change(entry.name, entry.error)
+    return entry.text
 
-def build_messages(pdf_text: str, user_prompt: str, organization: str = "ФПИ"):
+
+def _build_system_content(organization: str = "ФПИ", query: Optional[str] = None) -> str:
     """
-    Compose chat messages for the OpenAI API.
-    Автоматически включает рекомендации по оформлению заявок в системный промпт.
-    
-    Args:
-        pdf_text: Текст из PDF файла
-        user_prompt: Промпт пользователя
-        organization: Организация ("ФПИ" или "ЦУ"). По умолчанию "ФПИ"
+    Системный промпт: базовая инструкция и рекомендации организации.
+    Если задан `query` и RULES_MODE="relevant", из рекомендаций берутся только
+    разделы, относящиеся к запросу.
     """
     # Загружаем рекомендации в зависимости от организации
     grant_rules = _load_grant_rules(organization=organization)
+    if grant_rules and query and RULES_MODE == "relevant":
+        grant_rules = get_rules_index(grant_rules).select(query, RULES_TOP_K)
     
     # Формируем системный промпт
     system_content = "Ты — ассистент, который отвечает, опираясь на текст PDF. Отвечай кратко и по делу."
@@ -74,25 +76,116 @@ def build_messages(pdf_text: str, user_prompt: str, organization: str = "ФПИ"
     # Добавляем рекомендации, если они загружены
     if grant_rules:
         system_content += f"\n\nВАЖНО: При оценке заявок ты ДОЛЖЕН учитывать следующие рекомендации по оформлению заявок:\n\n{grant_rules}"
+    return system_content
+
+
+def preload_rules() -> None:
+    """Загружает рекомендации и строит (или читает с диска) их индексы заранее, при старте."""
+    for organization in get_rules_registry().names():
+        grant_rules = _load_grant_rules(organization=organization)
+        if grant_rules and RULES_MODE == "relevant":
+            get_rules_index(grant_rules)
+
+
+def _rules_query(user_prompt: str, document_text: str) -> str:
+    """Запрос для выбора разделов рекомендаций (см. RULES_QUERY)."""
+    if RULES_QUERY == "document":
+        return f"{user_prompt}\n{document_text}"
+    return user_prompt
+
+
+def build_messages(pdf_text: str, user_prompt: str, organization: str = "ФПИ"):
+    """
+    Compose chat messages for the OpenAI API.
+    Автоматически включает рекомендации по оформлению заявок в системный промпт.
+
+    Из рекомендаций берутся только разделы, относящиеся к инструкции
+    (RULES_MODE="relevant"), или весь текст (RULES_MODE="full").
+
+    Порядок сообщений рассчитан на кэширование промпта у провайдера: все
+    сообщения, кроме последнего, одинаковы для всех документов раунда
+    (инструкция, рекомендации организации, критерии эксперта) и образуют
+    побайтно стабильный префикс; текст документа идёт последним.
     
+    Args:
+        pdf_text: Текст из PDF файла
+        user_prompt: Промпт пользователя
+        organization: Организация ("ФПИ" или "ЦУ"). По умолчанию "ФПИ"
+    """
     return [
         {
             "role": "system",
-            "content": system_content,
+            "content": _build_system_content(organization, _rules_query(user_prompt, pdf_text)),
         },
         {
             "role": "user",
-            "content": f"Текст PDF:\n{pdf_text}",
+            "content": f"Инструкция пользователя: {user_prompt}",
         },
         {
             "role": "user",
-            "content": f"Инструкция пользователя: {user_prompt}",
+            "content": f"Текст PDF:\n{pdf_text}\n\nВыполни инструкцию пользователя для этого документа.",
         },
     ]
 
 
+def build_map_messages(
+    chunk_text: str, user_prompt: str, index: int, total: int, organization: str = "ФПИ"
+):
+    """
+    Messages for the map step: notes on one fragment of a long document.
 
+    The model does not answer the instruction yet, it only collects facts
+    from the fragment that are relevant to it. As in `build_messages`, only
+    the last message differs between fragments.
+    """
+    return [
+        {
+            "role": "system",
+            "content": _build_system_content(organization, _rules_query(user_prompt, chunk_text)),
+        },
+        {
+            "role": "user",
+            "content": (
+                "Документ слишком длинный и разбит на фрагменты; итоговый ответ будет составлен позже "
+                "по заметкам ко всем фрагментам. Не отвечай на инструкцию и не используй её формат ответа. "
+                "Выпиши кратким списком все факты из фрагмента, важные для инструкции ниже "
+                "(цели, результаты, сроки, бюджет, команда, риски, соответствие рекомендациям, "
+                "сведения по критериям эксперта). Ничего не добавляй от себя; если важного нет — "
+                "напиши «Нет существенных сведений».\n\n"
+                f"Инструкция пользователя: {user_prompt}"
+            ),
+        },
+        {
+            "role": "user",
+            "content": f"Фрагмент {index} из {total} текста PDF:\n{chunk_text}",
+        },
+    ]
 
 
-
-
+def build_reduce_messages(notes: List[str], user_prompt: str, organization: str = "ФПИ"):
+    """
+    Messages for the reduce step: the final answer from the notes of all
+    fragments, in the format requested by the user prompt.
+    """
+    joined = "\n\n".join(
+        f"Заметки к фрагменту {i} из {len(notes)}:\n{note.strip()}"
+        for i, note in enumerate(notes, start=1)
+    )
+    return [
+        {
+            "role": "system",
+            "content": _build_system_content(organization, _rules_query(user_prompt, joined)),
+        },
+        {
+            "role": "user",
+            "content": f"Инструкция пользователя: {user_prompt}",
+        },
+        {
+            "role": "user",
+            "content": (
+                "Текст PDF был слишком длинным, поэтому ниже приведены заметки по его фрагментам "
+                "по порядку. Считай их полным содержанием документа.\n\n"
+                f"{joined}\n\nВыполни инструкцию пользователя для этого документа."
+            ),
+        },
+    ]
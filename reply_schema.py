@@ -0,0 +1,260 @@
+"""
+Structured evaluation reply: schema, local repair and re-ask of missing fields.
+
+The expert prompt (ui.build_prompt_from_form) asks the model for one JSON
+object with the fields of `FIELDS`. `parse_reply` turns a raw reply into that
+object and repairs the usual defects without another model call: code fences
+or text around the JSON, and a reply cut off at the token limit (the
+incomplete tail is dropped and open arrays/objects are closed). `invalid_fields`
+lists the fields that are still missing or malformed; only those are asked
+for again (`build_repair_messages`) and merged into the reply (`merge_reply`).
+
+Settings (environment variables):
+    JSON_REPAIR_ATTEMPTS  how many times to re-ask for invalid fields (default 1)
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Сколько раз переспрашивать модель о полях, которые не удалось починить локально
+JSON_REPAIR_ATTEMPTS = int(os.getenv("JSON_REPAIR_ATTEMPTS", "1"))
+
+FIELDS = ("summary_bullets", "format_compliance", "strengths", "risks", "expert_criteria", "recommendation")
+SCORES = ["Низкая", "Средняя", "Высокая", "Не определено"]
+DECISIONS = ["поддержать", "отклонить", "на доработку"]
+# "Если данных недостаточно — пиши null или "Не указано"": такие значения допустимы для любого поля
+NOT_SPECIFIED = "Не указано"
+# Заголовок списка критериев в промпте эксперта (см. ui.build_prompt_from_form)
+CRITERIA_HEADER = "Критерии, по которым эксперт принимает решение:"
+# Начало повторного запроса полей; по нему заглушка модели (stub_llm.py) узнаёт, какие поля вернуть
+REPAIR_REQUEST = "Верни JSON-объект только с полями:"
+
+_FENCE_OPEN = re.compile(r"```(?:json|JSON)?")
+# Сколько точек обрезки пробовать с конца при восстановлении оборванного ответа
+_MAX_CUTS = 200
+
+
+def message_text(message: Dict) -> str:
+    # content может быть списком частей (подсказки кэширования, см. llm_client.with_cache_hints)
+    content = message.get("content") or ""
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content)
+
+
+def prompt_criteria(messages: List[Dict]) -> List[str]:
+    """Criteria listed in the expert prompt, in order."""
+    for message in messages:
+        text = message_text(message)
+        if CRITERIA_HEADER not in text:
+            continue
+        criteria = []
+        for line in text.split(CRITERIA_HEADER, 1)[1].splitlines()[1:]:
+            line = line.strip()
+            if not line.startswith("- "):
+                break
+            if line != "- (не задано)":
+                criteria.append(line[2:].strip())
+        return criteria
+    return []
+
+
+def _fence_bodies(text: str) -> List[str]:
+    """
+    Candidate JSON bodies of a reply: the content of the outermost code
+    fence and everything after the opening fence (for a reply cut off before
+    the closing fence), or the text itself if there is no fence.
+    """
+    match = _FENCE_OPEN.search(text)
+    brace = text.find("{")
+    if match is None or 0 <= brace < match.start():
+        # Ограда после начала JSON — это ``` внутри строки, а не блок кода
+        return [text]
+    rest = text[match.end():]
+    # Закрывающей считаем последнюю ограду: ``` может встретиться и внутри строк JSON
+    end = rest.rfind("```")
+    return [rest[:end], rest] if end >= 0 else [rest]
+
+
+def _complete_truncated(text: str) -> Optional[Dict]:
+    """
+    Parse a JSON object cut off in the middle: drop the incomplete last
+    element and close the arrays and objects that are still open.
+    """
+    # Точки, где можно обрезать текст: после открывающей скобки и перед запятой,
+    # вместе с закрывающими скобками, нужными в этой точке
+    cuts: List[Tuple[int, str]] = []
+    stack: List[str] = []
+    in_string = escaped = False
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            cuts.append((i + 1, "".join(reversed(stack))))
+        elif char in "}]":
+            if not stack:
+                break
+            stack.pop()
+            cuts.append((i + 1, "".join(reversed(stack))))
+        elif char == "," and stack:
+            cuts.append((i, "".join(reversed(stack))))
+    for end, closing in reversed(cuts[-_MAX_CUTS:]):
+        try:
+            parsed = json.loads(text[:end] + closing)
+        except ValueError:
+            continue
+        return parsed if isinstance(parsed, dict) else None
+    return None
+
+
+def parse_reply(text: Optional[str]) -> Tuple[Optional[Dict], List[str]]:
+    """
+    The reply as a JSON object (None if nothing can be recovered) and the
+    repairs that were needed: "fences" (code fences or text around the JSON)
+    and "truncation" (the reply was cut off).
+    """
+    text = (text or "").strip()
+    try:
+        parsed = json.loads(text)
+        return (parsed if isinstance(parsed, dict) else None), []
+    except ValueError:
+        pass
+
+    bodies = _fence_bodies(text)
+    repairs = ["fences"] if bodies[0] is not text else []
+    for body in bodies:
+        start = body.find("{")
+        if start < 0:
+            continue
+        try:
+            parsed, end = json.JSONDecoder().raw_decode(body, start)
+        except ValueError:
+            continue
+        if not isinstance(parsed, dict):
+            return None, repairs
+        if (start > 0 and body[:start].strip()) or body[end:].strip():
+            # Валидный объект среди постороннего текста
+            repairs = ["fences"]
+        return parsed, repairs
+
+    body = bodies[-1]
+    start = body.find("{")
+    if start < 0:
+        return None, []
+    if body[:start].strip():
+        repairs = ["fences"]
+    parsed = _complete_truncated(body[start:])
+    if parsed is None:
+        return None, repairs
+    return parsed, repairs + ["truncation"]
+
+
+def _is_unknown(value) -> bool:
+    return value is None or value == NOT_SPECIFIED
+
+
+def _is_bullets(value) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(item, str) for item in value)
+
+
+def _field_valid(name: str, value, criteria: Optional[List[str]] = None) -> bool:
+    if name == "expert_criteria" and criteria and (not isinstance(value, list) or len(value) != len(criteria)):
+        # Ровно один объект на каждый критерий, даже если данных нет: тогда score "Не определено"
+        return False
+    if _is_unknown(value):
+        return True
+    if name in ("summary_bullets", "strengths", "risks"):
+        return _is_bullets(value)
+    if name == "format_compliance":
+        return (
+            isinstance(value, dict)
+            and {"is_compliant", "explanation"} <= value.keys()
+            and (value.get("is_compliant") is None or isinstance(value.get("is_compliant"), bool))
+            and (_is_unknown(value.get("explanation")) or _is_bullets(value.get("explanation")))
+        )
+    if name == "expert_criteria":
+        return isinstance(value, list) and all(
+            isinstance(item, dict)
+            and isinstance(item.get("criterion"), str)
+            and item.get("score") in SCORES
+            and isinstance(item.get("rationale"), str)
+            for item in value
+        )
+    if name == "recommendation":
+        return (
+            isinstance(value, dict)
+            and {"decision", "why"} <= value.keys()
+            and (_is_unknown(value.get("decision")) or value.get("decision") in DECISIONS)
+            and isinstance(value.get("why"), (str, type(None)))
+        )
+    return True
+
+
+def invalid_fields(data: Optional[Dict], criteria: Optional[List[str]] = None) -> List[str]:
+    """
+    Fields of `FIELDS` that are missing from `data` or do not match the
+    schema; with `criteria` (see `prompt_criteria`) expert_criteria must
+    have one entry per criterion.
+    """
+    if data is None:
+        return list(FIELDS)
+    return [name for name in FIELDS if name not in data or not _field_valid(name, data[name], criteria)]
+
+
+def all_unknown(data: Optional[Dict]) -> bool:
+    """True if no field of `data` carries an answer (all null or "Не указано")."""
+    return data is None or all(_is_unknown(data.get(name)) for name in FIELDS)
+
+
+def merge_reply(
+    data: Optional[Dict], fix: Optional[Dict], criteria: Optional[List[str]] = None
+) -> Optional[Dict]:
+    """`data` with the valid fields of `fix` (the answer to a repair request) put in."""
+    if fix is None:
+        return data
+    merged = dict(data or {})
+    for name in FIELDS:
+        if name in fix and _field_valid(name, fix[name], criteria):
+            merged[name] = fix[name]
+    return merged
+
+
+def build_repair_messages(messages: List[Dict], reply: str, fields: List[str]) -> List[Dict]:
+    """
+    Messages asking the model for `fields` only: the original conversation,
+    its reply and a short request. The original messages stay a common
+    prefix, so providers with prompt caching bill them as cached tokens.
+    """
+    return list(messages) + [
+        {"role": "assistant", "content": reply},
+        {
+            "role": "user",
+            "content": (
+                f"{REPAIR_REQUEST} {', '.join(fields)}. "
+                "Эти поля в ответе выше отсутствуют, оборваны или не соответствуют формату. "
+                "Заполни их по тем же правилам и верни только валидный JSON без пояснений."
+            ),
+        },
+    ]
+
+
+def repair_request_fields(messages: List[Dict]) -> List[str]:
+    """Fields requested by `build_repair_messages`, or [] for a regular request."""
+    if not messages:
+        return []
+    content = message_text(messages[-1])
+    if not content.startswith(REPAIR_REQUEST):
+        return []
+    listed = content[len(REPAIR_REQUEST):].split(".", 1)[0]
+    return [name.strip() for name in listed.split(",") if name.strip() in FIELDS]
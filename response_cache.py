@@ -0,0 +1,161 @@
+"""
+Local SQLite cache of model replies.
+
+The key is a SHA-256 of the model name, the exact message list produced by
+`prompt_utils.build_messages`, the temperature and the requested output
+format (text or JSON), so re-running the same prompt on the same document
+returns the stored answer without a model call.
+Entries expire after a TTL; when the table grows beyond the limit the least
+recently used entries are removed.
+
+Settings (environment variables):
+    RESPONSE_CACHE              - "0" to disable the cache (default "1")
+    RESPONSE_CACHE_PATH         - SQLite file (default .cache/responses.sqlite3)
+    RESPONSE_CACHE_TTL          - entry lifetime in seconds (default 7 days)
+    RESPONSE_CACHE_MAX_ENTRIES  - max number of stored replies (default 5000)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from llm_client import call_model
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") == "1"
+RESPONSE_CACHE_PATH = Path(
+    os.getenv("RESPONSE_CACHE_PATH", str(Path(__file__).parent / ".cache" / "responses.sqlite3"))
+)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+
+
+def make_cache_key(messages, model: str, temperature: float, json_output: bool = False) -> str:
+    """Hash model name, messages, temperature and the output format into a stable cache key."""
+    request = {"model": model, "temperature": temperature, "messages": messages}
+    if json_output:
+        # Ключ добавляется только для JSON-ответов, чтобы не сбросить уже накопленный кэш
+        request["json_output"] = True
+    payload = json.dumps(request, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed store of model replies with TTL and max-size eviction."""
+
+    def __init__(self, path: Path, ttl: float, max_entries: int):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a non-expired reply for the key or None."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """Store a reply, then drop expired and least recently used entries."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                """
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters of this process."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide cache, or None if caching is disabled."""
+    global _cache
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES)
+    return _cache
+
+
+def call_model_cached(
+    messages,
+    model: str = "openai/gpt-4o",
+    temperature: float = 0.2,
+    bypass_cache: bool = False,
+    json_output: bool = False,
+) -> Tuple[str, bool]:
+    """
+    Call the model through the response cache.
+
+    Returns (reply, cached). With `bypass_cache=True` the cache is not read,
+    but the fresh reply is still stored for later calls. `json_output`
+    requests a JSON object as in `llm_client.call_model`.
+    """
+    cache = get_response_cache()
+    if cache is None:
+        return call_model(messages, model=model, temperature=temperature, json_output=json_output), False
+
+    key = make_cache_key(messages, model, temperature, json_output)
+    if not bypass_cache:
+        reply = cache.get(key)
+        if reply is not None:
+            return reply, True
+
+    reply = call_model(messages, model=model, temperature=temperature, json_output=json_output)
+    if reply:
+        cache.put(key, reply)
+    return reply, False
@@ -0,0 +1,188 @@
+"""
+Retrieval index over the grant rules files in `parsed_texts/`.
+
+A rules text is split into sections (paragraphs and numbered items, merged
+up to a size limit) and indexed with BM25. `build_messages` can then inject
+only the sections relevant to the expert instruction instead of the whole
+document. The index of a rules text is built once and persisted as JSON
+next to the other caches, keyed by the SHA-256 of the text (and the
+section size), so a restart
+or a second worker process only has to load it.
+
+Settings (environment variables):
+    RULES_INDEX_DIR         - where built indexes are stored (default .cache/rules_index)
+    RULES_SECTION_CHARS     - max size of one section in characters (default 800)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+RULES_INDEX_DIR = Path(
+    os.getenv("RULES_INDEX_DIR", str(Path(__file__).parent / ".cache" / "rules_index"))
+)
+RULES_SECTION_CHARS = int(os.getenv("RULES_SECTION_CHARS", "800"))
+
+# Параметры BM25
+_K1 = 1.5
+_B = 0.75
+# Грубый стемминг: слово обрезается до первых символов, чтобы "заявка"/"заявки"/"заявок" совпадали
+_STEM_LENGTH = 6
+_INDEX_VERSION = 1
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_ITEM_RE = re.compile(r"^\s*(\d+(\.\d+)*[.)]|[-•–])\s+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word stems of the text (digits and one-letter words dropped)."""
+    return [
+        word[:_STEM_LENGTH]
+        for word in _WORD_RE.findall(text.lower().replace("ё", "е"))
+        if len(word) > 1 and not word.isdigit()
+    ]
+
+
+def split_sections(text: str, max_chars: Optional[int] = None) -> List[str]:
+    """
+    Split a rules text into sections.
+
+    Paragraphs are blocks separated by blank lines; a numbered or bulleted
+    item always starts a new section, and consecutive plain paragraphs are
+    merged while the section stays under `max_chars`. Longer paragraphs are
+    split at line boundaries.
+    """
+    max_chars = RULES_SECTION_CHARS if max_chars is None else max_chars
+    blocks: List[str] = []
+    for block in re.split(r"\n\s*\n", text):
+        block = block.strip()
+        if len(block) <= max_chars:
+            blocks.append(block)
+            continue
+        # Слишком длинный абзац делим по строкам
+        part = ""
+        for line in block.splitlines():
+            if part and len(part) + len(line) + 1 > max_chars:
+                blocks.append(part)
+                part = line
+            else:
+                part = f"{part}\n{line}" if part else line
+        blocks.append(part)
+
+    sections: List[str] = []
+    current = ""
+    for block in blocks:
+        if not block:
+            continue
+        starts_item = bool(_ITEM_RE.match(block))
+        if current and (starts_item or len(current) + len(block) + 2 > max_chars):
+            sections.append(current)
+            current = block
+        else:
+            current = f"{current}\n\n{block}" if current else block
+    if current:
+        sections.append(current)
+    return sections
+
+
+class RulesIndex:
+    """BM25 index over the sections of one rules text."""
+
+    def __init__(self, sections: List[str], term_freqs: List[Dict[str, int]]):
+        self.sections = sections
+        self.term_freqs = term_freqs
+        self.lengths = [sum(tf.values()) for tf in term_freqs]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        doc_freq: Counter = Counter()
+        for tf in term_freqs:
+            doc_freq.update(tf.keys())
+        n = len(sections)
+        self.idf = {
+            term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()
+        }
+
+    @classmethod
+    def build(cls, text: str) -> "RulesIndex":
+        sections = split_sections(text)
+        return cls(sections, [dict(Counter(tokenize(s))) for s in sections])
+
+    def to_dict(self) -> Dict:
+        return {"version": _INDEX_VERSION, "sections": self.sections, "term_freqs": self.term_freqs}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RulesIndex":
+        return cls(data["sections"], data["term_freqs"])
+
+    def scores(self, query: str) -> List[float]:
+        """BM25 score of every section for the query."""
+        terms = set(tokenize(query))
+        result = []
+        for tf, length in zip(self.term_freqs, self.lengths):
+            score = 0.0
+            norm = _K1 * (1 - _B + _B * length / self.avg_length) if self.avg_length else _K1
+            for term in terms:
+                freq = tf.get(term)
+                if freq:
+                    score += self.idf[term] * freq * (_K1 + 1) / (freq + norm)
+            result.append(score)
+        return result
+
+    def select(self, query: str, top_k: int) -> str:
+        """
+        Text of the `top_k` most relevant sections, in their original order.
+        Falls back to the first sections when nothing in the query matches.
+        """
+        scores = self.scores(query)
+        ranked = sorted(range(len(scores)), key=lambda i: (-scores[i], i))[:top_k]
+        return "\n\n".join(self.sections[i] for i in sorted(ranked))
+
+
+_indexes: Dict[str, RulesIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _index_path(text_hash: str) -> Path:
+    return RULES_INDEX_DIR / f"{text_hash}.json"
+
+
+def get_rules_index(text: str) -> RulesIndex:
+    """
+    Return the index of a rules text: from memory, from disk, or built and saved.
+    """
+    # Размер разделов входит в ключ: при его изменении индекс строится заново
+    raw = f"{_INDEX_VERSION}:{RULES_SECTION_CHARS}:{text}"
+    text_hash = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    index = _indexes.get(text_hash)
+    if index is not None:
+        return index
+
+    with _indexes_lock:
+        index = _indexes.get(text_hash)
+        if index is not None:
+            return index
+
+        path = _index_path(text_hash)
+        try:
+            index = RulesIndex.from_dict(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError, KeyError):
+            index = None
+
+        if index is None:
+            index = RulesIndex.build(text)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+                tmp_path.write_text(json.dumps(index.to_dict(), ensure_ascii=False), encoding="utf-8")
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Предупреждение: не удалось сохранить индекс рекомендаций {path}: {e}")
+
+        _indexes[text_hash] = index
+        return index
@@ -0,0 +1,182 @@
+"""
+Registry of organizations (funding programs) and their grant rules files.
+
+Organizations are listed in a manifest, `parsed_texts/organizations.json`:
+
+    {
+      "default": "ФПИ",
+      "organizations": [
+        {"name": "ФПИ", "file": "rules_grant.txt"},
+        {"name": "ЦУ", "file": "cu_rules.txt", "title": "..."}
+      ]
+    }
+
+The manifest and every rules file are re-read only when their mtime or size
+changes, so a new program can be added mid-season by dropping its rules
+file next to the manifest and adding an entry, without a restart. A file
+that cannot be read is retried on the next request instead of being cached
+as empty. The token count of each rules text is computed once per version.
+
+Settings (environment variables):
+    RULES_DIR               - directory with the manifest and rules files (default parsed_texts)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from tokens import count_tokens
+
+RULES_DIR = Path(os.getenv("RULES_DIR", str(Path(__file__).parent / "parsed_texts")))
+MANIFEST_NAME = "organizations.json"
+
+# Используется, если манифеста нет или он не читается
+_DEFAULT_MANIFEST = {
+    "default": "ФПИ",
+    "organizations": [
+        {"name": "ФПИ", "file": "rules_grant.txt"},
+        {"name": "ЦУ", "file": "cu_rules.txt"},
+    ],
+}
+
+
+@dataclass
+class RulesEntry:
+    """One organization and the currently loaded version of its rules."""
+
+    name: str
+    path: Path
+    title: str
+    text: str = ""
+    sha256: str = ""
+    tokens: int = 0
+    # (mtime_ns, size) загруженной версии файла; None — файл ещё не прочитан
+    version: Optional[Tuple[int, int]] = None
+    error: Optional[str] = None
+
+
+def _file_version(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class RulesRegistry:
+    """Thread-safe, mtime-aware registry of organizations and their rules."""
+
+    def __init__(self, directory: Path, manifest_name: str = MANIFEST_NAME):
+        self.directory = Path(directory)
+        self.manifest_path = self.directory / manifest_name
+        self.default: str = _DEFAULT_MANIFEST["default"]
+        self._entries: Dict[str, RulesEntry] = {}
+        self._manifest_version: Optional[Tuple[int, int]] = None
+        self._manifest_loaded = False
+        self._lock = threading.RLock()
+
+    def _refresh_manifest(self) -> None:
+        version = _file_version(self.manifest_path)
+        if self._manifest_loaded and version == self._manifest_version:
+            return
+
+        manifest = _DEFAULT_MANIFEST
+        if version is not None:
+            try:
+                manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                print(f"Предупреждение: не удалось прочитать {self.manifest_path}: {e}")
+                # Повторим попытку при следующем обращении
+                version = None
+
+        entries: Dict[str, RulesEntry] = {}
+        for item in manifest.get("organizations", []):
+            name = item.get("name")
+            filename = item.get("file")
+            if not name or not filename:
+                continue
+            path = self.directory / filename
+            old = self._entries.get(name)
+            if old is not None and old.path == path:
+                old.title = item.get("title", name)
+                entries[name] = old
+            else:
+                entries[name] = RulesEntry(name=name, path=path, title=item.get("title", name))
+
+        self._entries = entries
+        self.default = manifest.get("default") or next(iter(entries), "")
+        self._manifest_version = version
+        self._manifest_loaded = version is not None
+
+    def _refresh_entry(self, entry: RulesEntry) -> None:
+        version = _file_version(entry.path)
+        if version is not None and version == entry.version and entry.error is None:
+            return
+        if version is None:
+            entry.text, entry.sha256, entry.tokens, entry.version = "", "", 0, None
+            entry.error = f"файл рекомендаций не найден: {entry.path}"
+            return
+        try:
+            text = entry.path.read_text(encoding="utf-8").strip()
+        except (OSError, UnicodeDecodeError) as e:
+            entry.error = f"не удалось загрузить рекомендации из {entry.path}: {e}"
+            return
+
+        sha256 = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        if sha256 != entry.sha256:
+            entry.text, entry.sha256, entry.tokens = text, sha256, count_tokens(text)
+        entry.version = version
+        entry.error = None
+
+    def names(self) -> List[str]:
+        """Names of all organizations from the manifest."""
+        with self._lock:
+            self._refresh_manifest()
+            return list(self._entries)
+
+    def get(self, organization: str) -> Optional[RulesEntry]:
+        """Entry with up-to-date rules text, or None for an unknown organization."""
+        with self._lock:
+            self._refresh_manifest()
+            entry = self._entries.get(organization)
+            if entry is None:
+                return None
+            self._refresh_entry(entry)
+            return entry
+
+    def list(self) -> List[Dict]:
+        """Public description of every organization (for GET /organizations)."""
+        with self._lock:
+            self._refresh_manifest()
+            result = []
+            for entry in self._entries.values():
+                self._refresh_entry(entry)
+                result.append({
+                    "name": entry.name,
+                    "title": entry.title,
+                    "file": entry.path.name,
+                    "default": entry.name == self.default,
+                    "available": entry.error is None,
+                    "tokens": entry.tokens,
+                    "sha256": entry.sha256,
+                })
+            return result
+
+
+_registry: Optional[RulesRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_rules_registry() -> RulesRegistry:
+    """Return the process-wide registry, creating it on first use."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = RulesRegistry(RULES_DIR)
+    return _registry
@@ -0,0 +1,326 @@
+"""
+Local stand-in for the OpenAI-compatible chat completion API.
+
+Answers chat completions (plain and `stream=true`) with a reply that is
+valid for the JSON format ui.py asks for (`build_prompt_from_form`): one
+`expert_criteria` entry per criterion of the prompt, scores and decisions
+from the allowed values. Token usage is reported as a provider would.
+Latency follows a configurable distribution, and a share of requests can
+fail with 500 or be rate limited with 429 + Retry-After, so retries,
+the scheduler and capacity limits can be exercised without a real model.
+A share of replies can also be malformed (code fences, cut off) to exercise
+the structured-output repair (reply_schema.py).
+
+Two ways to use it:
+
+* built in: LLM_BACKEND=stub makes `llm_client` answer every call in
+  process through `StubTransport`, no network and no API key;
+* as a server, e.g. for benchmark.py or another instance:
+      python -m stub_llm --port 8100 --latency 2 --rate-limit-rate 0.05
+      LLM_BACKEND=openai LLM_BASE_URL=http://127.0.0.1:8100/v1 uvicorn api_server:app
+
+Settings of the built-in stub (environment variables):
+    LLM_STUB_LATENCY          - mean seconds per completion (default 1)
+    LLM_STUB_LATENCY_DIST     - "fixed", "uniform" (0..2x mean) or "lognormal" (default "fixed")
+    LLM_STUB_LATENCY_SIGMA    - sigma of the lognormal distribution (default 0.5)
+    LLM_STUB_ERROR_RATE       - share of requests answered with 500 (default 0)
+    LLM_STUB_RATE_LIMIT_RATE  - share of requests answered with 429 (default 0)
+    LLM_STUB_RETRY_AFTER      - Retry-After of the 429 responses, seconds (default 1)
+    LLM_STUB_MALFORMED_RATE   - share of replies wrapped in code fences or cut off (default 0)
+    LLM_STUB_SEED             - random seed for reproducible runs (default: none)
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from reply_schema import DECISIONS, SCORES, message_text, prompt_criteria, repair_request_fields
+from tokens import count_message_tokens, count_tokens
+
+_STREAM_CHUNKS = 20
+
+
+@dataclass
+class StubModel:
+    """Latency, failures and replies of the fake model."""
+
+    latency: float = 1.0
+    latency_dist: str = "fixed"
+    latency_sigma: float = 0.5
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after: float = 1.0
+    malformed_rate: float = 0.0
+    seed: Optional[int] = None
+    _rng: random.Random = field(init=False, repr=False)
+    _lock: threading.Lock = field(init=False, repr=False)
+
+    def __post_init__(self):
+        if self.latency_dist not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {self.latency_dist}")
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "StubModel":
+        seed = os.getenv("LLM_STUB_SEED")
+        return cls(
+            latency=float(os.getenv("LLM_STUB_LATENCY", "1")),
+            latency_dist=os.getenv("LLM_STUB_LATENCY_DIST", "fixed"),
+            latency_sigma=float(os.getenv("LLM_STUB_LATENCY_SIGMA", "0.5")),
+            error_rate=float(os.getenv("LLM_STUB_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("LLM_STUB_RATE_LIMIT_RATE", "0")),
+            retry_after=float(os.getenv("LLM_STUB_RETRY_AFTER", "1")),
+            malformed_rate=float(os.getenv("LLM_STUB_MALFORMED_RATE", "0")),
+            seed=int(seed) if seed else None,
+        )
+
+    def sample_latency(self) -> float:
+        """Seconds the next completion takes."""
+        if self.latency <= 0:
+            return 0.0
+        with self._lock:
+            if self.latency_dist == "uniform":
+                return self._rng.uniform(0, 2 * self.latency)
+            if self.latency_dist == "lognormal":
+                # mu подобрано так, чтобы среднее распределения было равно latency
+                mu = math.log(self.latency) - self.latency_sigma ** 2 / 2
+                return self._rng.lognormvariate(mu, self.latency_sigma)
+        return self.latency
+
+    def failure(self) -> Optional[Tuple[int, Dict[str, str], Dict]]:
+        """(status, headers, body) of an injected error, or None for a normal reply."""
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            return 429, {"retry-after": f"{self.retry_after:g}"}, {
+                "error": {"message": "Rate limit exceeded (stub)", "type": "rate_limit_error", "code": 429}
+            }
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500, {}, {"error": {"message": "Internal error (stub)", "type": "server_error", "code": 500}}
+        return None
+
+    def reply(self, messages: List[Dict]) -> str:
+        """
+        A reply in the format of ui.build_prompt_from_form; a repair request
+        (reply_schema.build_repair_messages) gets only the requested fields.
+        """
+        with self._lock:
+            rng = random.Random(self._rng.random())
+        criteria = [
+            {
+                "criterion": criterion,
+                "score": rng.choice(SCORES),
+                "rationale": "Оценка сгенерирована заглушкой модели; данные заявки не анализировались",
+            }
+            for criterion in prompt_criteria(messages)
+        ]
+        reply = {
+            "summary_bullets": [
+                "Проект: Не указано",
+                "Цель: Не указано",
+                "Целевая аудитория: Не указано",
+                "Результат: Не указано",
+                "Стадия: Не указано",
+            ],
+            "format_compliance": {
+                "is_compliant": rng.random() < 0.5,
+                "explanation": [
+                    "Ответ сгенерирован заглушкой модели",
+                    "Соответствие рекомендациям не проверялось",
+                    "Структура ответа соответствует формату",
+                ],
+            },
+            "strengths": ["Не указано", "Не указано", "Не указано"],
+            "risks": ["Не указано", "Не указано", "Не указано"],
+            "expert_criteria": criteria,
+            "recommendation": {
+                "decision": rng.choice(DECISIONS),
+                "why": "Решение выбрано заглушкой модели случайно. Оно не основано на тексте заявки.",
+            },
+        }
+        fields = repair_request_fields(messages)
+        if fields:
+            return json.dumps({name: reply[name] for name in fields}, ensure_ascii=False)
+        text = json.dumps(reply, ensure_ascii=False)
+        if rng.random() < self.malformed_rate:
+            # Типичные дефекты ответов моделей: JSON в блоке кода или ответ, оборванный на лимите токенов
+            if rng.random() < 0.5:
+                return f"```json\n{text}\n```"
+            return text[:int(len(text) * 0.9)]
+        return text
+
+    def usage(self, messages: List[Dict], reply: str) -> Dict[str, int]:
+        prompt_tokens = count_message_tokens([{"content": message_text(m)} for m in messages])
+        completion_tokens = count_tokens(reply)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def completion(self, body: Dict, reply: str) -> Dict:
+        """Non-streaming response body."""
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": self.usage(body.get("messages", []), reply),
+        }
+
+    def stream_events(self, body: Dict, reply: str) -> List[str]:
+        """Server-sent events of a streaming response, the last one with usage."""
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "stub")
+        size = max(1, -(-len(reply) // _STREAM_CHUNKS))
+        events = []
+        for i in range(0, len(reply), size):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": reply[i:i + size]}, "finish_reason": None}],
+            }
+            events.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [],
+            "usage": self.usage(body.get("messages", []), reply),
+        }
+        events.append(f"data: {json.dumps(final)}\n\n")
+        events.append("data: [DONE]\n\n")
+        return events
+
+
+class _DelayedStream(httpx.SyncByteStream):
+    """Body of a streaming response: events spread over the completion latency."""
+
+    def __init__(self, events: List[str], delay: float):
+        self.events = events
+        self.delay = delay
+
+    def __iter__(self) -> Iterator[bytes]:
+        for event in self.events:
+            time.sleep(self.delay)
+            yield event.encode("utf-8")
+
+
+class StubTransport(httpx.BaseTransport):
+    """httpx transport that answers chat completions with `StubModel` (LLM_BACKEND=stub)."""
+
+    def __init__(self, model: StubModel):
+        self.model = model
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        if not request.url.path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": {"message": "Not found (stub)"}})
+        body = json.loads(request.read() or b"{}")
+        failure = self.model.failure()
+        if failure is not None:
+            status, headers, error = failure
+            return httpx.Response(status, headers=headers, json=error)
+
+        latency = self.model.sample_latency()
+        reply = self.model.reply(body.get("messages", []))
+        if not body.get("stream"):
+            time.sleep(latency)
+            return httpx.Response(200, json=self.model.completion(body, reply))
+        events = self.model.stream_events(body, reply)
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            stream=_DelayedStream(events, latency / len(events)),
+        )
+
+
+def create_app(model: StubModel):
+    """FastAPI app serving `POST /v1/chat/completions` with `model`."""
+    app = FastAPI(title="Stub LLM")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        failure = model.failure()
+        if failure is not None:
+            status, headers, error = failure
+            return JSONResponse(error, status_code=status, headers=headers)
+
+        latency = model.sample_latency()
+        reply = model.reply(body.get("messages", []))
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return model.completion(body, reply)
+
+        events = model.stream_events(body, reply)
+
+        async def delayed():
+            for event in events:
+                await asyncio.sleep(latency / len(events))
+                yield event
+
+        return StreamingResponse(delayed(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    defaults = StubModel.from_env()
+    parser = argparse.ArgumentParser(description="Local stub of the chat completion API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=defaults.latency,
+                        help="Mean seconds per completion (default: 1).")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "lognormal"], default=defaults.latency_dist)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate,
+                        help="Share of requests answered with 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate,
+                        help="Share of requests answered with 429.")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after,
+                        help="Retry-After of the 429 responses, seconds.")
+    parser.add_argument("--malformed-rate", type=float, default=defaults.malformed_rate,
+                        help="Share of replies wrapped in code fences or cut off.")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args()
+
+    model = StubModel(
+        latency=args.latency,
+        latency_dist=args.latency_dist,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(model), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
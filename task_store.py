@@ -0,0 +1,347 @@
+"""
+Storage of task records for the API server.
+
+A task record is a plain dict (status, message, result, error, ...). Finished
+tasks ("completed" / "error") expire after a TTL, and when the store holds
+more than the limit the least recently used finished tasks are evicted, so
+memory does not grow over a long-running contest round.
+
+The same store type keeps batch records (see `get_batch_store`); a batch
+record lists its task ids and expires TTL seconds after submission.
+
+Two backends are available:
+    memory  - in-process OrderedDict (default, lost on restart)
+    sqlite  - local SQLite file, results survive restarts and are shared
+              with worker processes (required with JOB_QUEUE=sqlite)
+
+Settings (environment variables):
+    TASK_STORE              - "memory" or "sqlite" (default "memory")
+    TASK_STORE_PATH         - SQLite file (default .cache/tasks.sqlite3)
+    TASK_TTL                - lifetime of finished tasks in seconds (default 24 h)
+    TASK_MAX_ENTRIES        - max number of stored tasks (default 2000)
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+TASK_STORE_BACKEND = os.getenv("TASK_STORE", "memory")
+TASK_STORE_PATH = Path(
+    os.getenv("TASK_STORE_PATH", str(Path(__file__).parent / ".cache" / "tasks.sqlite3"))
+)
+TASK_TTL = float(os.getenv("TASK_TTL", str(24 * 3600)))
+TASK_MAX_ENTRIES = int(os.getenv("TASK_MAX_ENTRIES", "2000"))
+
+FINISHED_STATUSES = ("completed", "error")
+# Чтение задачи обновляет last_access не чаще раза в столько секунд: опрос статуса не должен писать в SQLite
+ACCESS_RESOLUTION = 60.0
+
+
+class TaskStore(ABC):
+    """Interface of a task store; all methods are thread-safe."""
+
+    @abstractmethod
+    def create(self, task_id: str, record: Dict[str, Any]) -> None:
+        """Store a new record, replacing any previous one with the same id."""
+
+    @abstractmethod
+    def update(self, task_id: str, **fields: Any) -> None:
+        """Merge fields into an existing record (no-op if the task was evicted)."""
+
+    @abstractmethod
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the record or None if unknown or expired."""
+
+    @abstractmethod
+    def list(self) -> List[Dict[str, Any]]:
+        """Short summaries (task_id, status, message) of all stored tasks."""
+
+    def __contains__(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of stored records."""
+
+    def data_version(self) -> int:
+        """A number that changes when another process modifies the store."""
+        return 0
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryTaskStore(TaskStore):
+    """In-process store with TTL for finished tasks and LRU eviction."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._tasks: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._finished_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _expired(self, task_id: str, now: float) -> bool:
+        finished_at = self._finished_at.get(task_id)
+        return finished_at is not None and finished_at < now - self.ttl
+
+    def _drop(self, task_id: str) -> None:
+        self._tasks.pop(task_id, None)
+        self._finished_at.pop(task_id, None)
+
+    def _evict(self, now: float) -> None:
+        for task_id in [t for t in self._finished_at if self._expired(t, now)]:
+            self._drop(task_id)
+        if len(self._tasks) <= self.max_entries:
+            return
+        # Вытесняем только завершённые задачи, начиная с давно не запрашиваемых
+        for task_id in [t for t in self._tasks if t in self._finished_at]:
+            if len(self._tasks) <= self.max_entries:
+                break
+            self._drop(task_id)
+
+    def create(self, task_id: str, record: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._tasks[task_id] = dict(record, created_at=now)
+            self._finished_at.pop(task_id, None)
+            self._evict(now)
+
+    def update(self, task_id: str, **fields: Any) -> None:
+        now = time.time()
+        with self._lock:
+            record = self._tasks.get(task_id)
+            if record is None:
+                return
+            record.update(fields)
+            if record.get("status") in FINISHED_STATUSES:
+                self._finished_at.setdefault(task_id, now)
+            self._tasks.move_to_end(task_id)
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            if self._expired(task_id, now):
+                self._drop(task_id)
+                return None
+            record = self._tasks.get(task_id)
+            if record is None:
+                return None
+            self._tasks.move_to_end(task_id)
+            return dict(record)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._evict(time.time())
+            return [
+                {"task_id": task_id, "status": r["status"], "message": r.get("message", "")}
+                for task_id, r in self._tasks.items()
+            ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._tasks)
+
+
+class SqliteTaskStore(TaskStore):
+    """
+    SQLite-backed store. Unless `recover_interrupted` is False (tasks are run
+    by queue workers), tasks left unfinished by a previous run are marked as errors.
+
+    The file is shared with worker processes, so `update` reads and writes the
+    record in one immediate transaction. `get` refreshes the LRU timestamp at
+    most once per ACCESS_RESOLUTION seconds, so status polling stays read-only.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        ttl: float,
+        max_entries: int,
+        table: str = "tasks",
+        recover_interrupted: bool = True,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.table = table
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        # WAL: API и воркеры читают задачи, не блокируя друг друга
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                message TEXT NOT NULL,
+                data TEXT NOT NULL,
+                finished_at REAL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        if recover_interrupted:
+            self._recover_interrupted()
+        self._conn.commit()
+
+    def _recover_interrupted(self) -> None:
+        now = time.time()
+        rows = self._conn.execute(
+            f"SELECT task_id, data FROM {self.table} WHERE finished_at IS NULL"
+        ).fetchall()
+        for task_id, data in rows:
+            record = json.loads(data)
+            record.update(
+                status="error",
+                error="Task was interrupted by a server restart",
+                message="Task was interrupted by a server restart",
+            )
+            self._write(task_id, record, now)
+
+    def _write(self, task_id: str, record: Dict[str, Any], now: float) -> None:
+        finished = record.get("status") in FINISHED_STATUSES
+        self._conn.execute(
+            f"""
+            INSERT INTO {self.table} (task_id, status, message, data, finished_at, last_access)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(task_id) DO UPDATE SET
+                status = excluded.status,
+                message = excluded.message,
+                data = excluded.data,
+                finished_at = COALESCE({self.table}.finished_at, excluded.finished_at),
+                last_access = excluded.last_access
+            """,
+            (
+                task_id,
+                record.get("status", ""),
+                record.get("message", ""),
+                json.dumps(record, ensure_ascii=False),
+                now if finished else None,
+                now,
+            ),
+        )
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute(f"DELETE FROM {self.table} WHERE finished_at < ?", (now - self.ttl,))
+        self._conn.execute(
+            f"""
+            DELETE FROM {self.table} WHERE task_id IN (
+                SELECT task_id FROM {self.table} WHERE finished_at IS NOT NULL
+                ORDER BY last_access DESC LIMIT -1 OFFSET MAX(0, ? - (
+                    SELECT COUNT(*) FROM {self.table} WHERE finished_at IS NULL
+                ))
+            )
+            """,
+            (self.max_entries,),
+        )
+
+    def create(self, task_id: str, record: Dict[str, Any]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE task_id = ?", (task_id,))
+            self._write(task_id, dict(record, created_at=now), now)
+            self._evict(now)
+            self._conn.commit()
+
+    def update(self, task_id: str, **fields: Any) -> None:
+        now = time.time()
+        with self._lock:
+            # Блокировка на запись берётся до чтения: иначе параллельное обновление
+            # из другого процесса (воркер, API) затрётся старой копией записи
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT data FROM {self.table} WHERE task_id = ?", (task_id,)
+                ).fetchone()
+                if row is not None:
+                    record = json.loads(row[0])
+                    record.update(fields)
+                    self._write(task_id, record, now)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT data, last_access FROM {self.table} "
+                "WHERE task_id = ? AND (finished_at IS NULL OR finished_at >= ?)",
+                (task_id, now - self.ttl),
+            ).fetchone()
+            if row is None:
+                return None
+            data, last_access = row
+            if now - last_access >= ACCESS_RESOLUTION:
+                self._conn.execute(f"UPDATE {self.table} SET last_access = ? WHERE task_id = ?", (now, task_id))
+                self._conn.commit()
+            return json.loads(data)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            self._evict(time.time())
+            self._conn.commit()
+            rows = self._conn.execute(
+                f"SELECT task_id, status, message FROM {self.table} ORDER BY last_access"
+            ).fetchall()
+        return [{"task_id": t, "status": s, "message": m} for t, s, m in rows]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def data_version(self) -> int:
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_stores: Dict[str, TaskStore] = {}
+_stores_lock = threading.Lock()
+
+
+def _get_store(table: str, recover_interrupted: bool) -> TaskStore:
+    store = _stores.get(table)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(table)
+            if store is None:
+                if TASK_STORE_BACKEND == "sqlite":
+                    store = SqliteTaskStore(
+                        TASK_STORE_PATH, TASK_TTL, TASK_MAX_ENTRIES, table=table,
+                        recover_interrupted=recover_interrupted,
+                    )
+                elif TASK_STORE_BACKEND == "memory":
+                    store = MemoryTaskStore(TASK_TTL, TASK_MAX_ENTRIES)
+                else:
+                    raise ValueError(f"Unknown TASK_STORE backend: {TASK_STORE_BACKEND}")
+                _stores[table] = store
+    return store
+
+
+def get_task_store(recover_interrupted: bool = True) -> TaskStore:
+    """
+    Return the process-wide task store, creating it on first use.
+    `recover_interrupted` is passed to `SqliteTaskStore` by the first call:
+    False when unfinished tasks are picked up again by queue workers.
+    """
+    return _get_store("tasks", recover_interrupted)
+
+
+def get_batch_store(recover_interrupted: bool = True) -> TaskStore:
+    """Return the process-wide store of batch records, creating it on first use."""
+    return _get_store("batches", recover_interrupted)
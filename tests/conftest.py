@@ -0,0 +1,14 @@
+"""Shared pytest setup: the modules under test live in the repository root."""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def grant_pdf() -> Path:
+    """A small text PDF from grant_files/ (4 pages)."""
+    return ROOT / "grant_files" / "application_project.pdf"
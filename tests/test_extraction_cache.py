@@ -0,0 +1,86 @@
+"""Content-addressed cache of extracted PDF text."""
+import os
+
+import pytest
+
+import extraction_cache
+from extraction_cache import ExtractionCache, extract_pdf_text_cached, file_sha256, write_pdf_text_cached
+from pdf_utils import extract_pdf_text
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ExtractionCache(tmp_path / "extraction", max_bytes=1024 * 1024)
+    monkeypatch.setattr(extraction_cache, "EXTRACTION_CACHE_ENABLED", True)
+    monkeypatch.setattr(extraction_cache, "_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """Count real extractions behind the cache."""
+    calls = []
+
+    def counting(pdf_path, type="application", workers=None):
+        calls.append(pdf_path)
+        return extract_pdf_text(pdf_path, type=type, workers=workers)
+
+    monkeypatch.setattr(extraction_cache, "extract_pdf_text", counting)
+    return calls
+
+
+def test_get_and_put(cache):
+    key = cache.make_key("abc", "application")
+    assert cache.get(key) is None
+    cache.put(key, "текст")
+    assert cache.get(key) == "текст"
+    assert cache.stats() == {"hits": 1, "misses": 1}
+
+
+def test_key_depends_on_hash_and_mode():
+    keys = {
+        ExtractionCache.make_key("abc", "application"),
+        ExtractionCache.make_key("abc", "presentation"),
+        ExtractionCache.make_key("abd", "application"),
+    }
+    assert len(keys) == 3
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ExtractionCache(tmp_path, max_bytes=1000)
+    for i, name in enumerate(("first", "second", "third")):
+        cache.put(name, "x" * 100)
+        os.utime(cache._entry_path(name), (1000 + i, 1000 + i))
+    # Чтение обновляет mtime: "first" становится самой свежей записью
+    assert cache.get("first") is not None
+    cache.max_bytes = 250
+    cache.evict()
+    assert cache.get("second") is None
+    assert cache.get("first") is not None and cache.get("third") is not None
+
+
+def test_extract_is_cached_by_content(cache, extractions, grant_pdf, tmp_path):
+    text = extract_pdf_text_cached(grant_pdf)
+    copy = tmp_path / "renamed.pdf"
+    copy.write_bytes(grant_pdf.read_bytes())
+    # Тот же файл под другим именем берётся из кэша
+    assert extract_pdf_text_cached(copy) == text
+    assert extract_pdf_text_cached(grant_pdf, content_hash=file_sha256(grant_pdf)) == text
+    assert len(extractions) == 1
+    assert text == extract_pdf_text(grant_pdf)
+
+
+def test_extract_without_cache(monkeypatch, extractions, grant_pdf):
+    monkeypatch.setattr(extraction_cache, "EXTRACTION_CACHE_ENABLED", False)
+    extract_pdf_text_cached(grant_pdf)
+    extract_pdf_text_cached(grant_pdf)
+    assert len(extractions) == 2
+
+
+def test_write_uses_and_fills_the_cache(cache, grant_pdf, tmp_path):
+    first, second = tmp_path / "first.txt", tmp_path / "second.txt"
+    assert write_pdf_text_cached(grant_pdf, first) == 4
+    # Повторная запись копирует текст из кэша и не знает числа страниц
+    assert write_pdf_text_cached(grant_pdf, second) is None
+    assert first.read_text(encoding="utf-8") == second.read_text(encoding="utf-8") == extract_pdf_text(grant_pdf)
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == ["first.txt", "second.txt"]
@@ -0,0 +1,47 @@
+"""Dispatch order of the in-memory queue and of the SQLite job queue positions."""
+from fair_queue import PRIORITIES, FairQueue, dispatch_order
+
+
+def test_higher_priority_goes_first():
+    items = [("a", 1, "x", 1.0), ("b", 2, "y", 2.0), ("c", 0, "x", 0.0)]
+    assert dispatch_order(items, {}) == ["b", "a", "c"]
+
+
+def test_groups_take_turns_within_a_priority():
+    # Эксперт x отправил три файла раньше, чем эксперт y — один
+    items = [("x1", 1, "x", 1.0), ("x2", 1, "x", 2.0), ("x3", 1, "x", 3.0), ("y1", 1, "y", 4.0)]
+    assert dispatch_order(items, {}) == ["x1", "y1", "x2", "x3"]
+
+
+def test_least_recently_served_group_goes_first():
+    items = [("x1", 1, "x", 1.0), ("y1", 1, "y", 2.0)]
+    assert dispatch_order(items, {"x": 10.0, "y": 5.0}) == ["y1", "x1"]
+
+
+def test_fair_queue_pop_follows_dispatch_order():
+    queue = FairQueue()
+    for item_id, group in (("x1", "x"), ("x2", "x"), ("y1", "y")):
+        queue.push(item_id, PRIORITIES["normal"], group)
+    queue.push("urgent", PRIORITIES["high"], "z")
+    assert queue.position("urgent") == 0
+    assert [queue.pop() for _ in range(4)] == ["urgent", "x1", "y1", "x2"]
+    assert queue.pop() is None
+
+
+def test_raise_priority_moves_a_waiting_item_ahead():
+    """Regression: a coalesced high-priority upload must not wait behind a low-priority leader."""
+    queue = FairQueue()
+    queue.push("leader", PRIORITIES["low"], "bulk")
+    queue.push("other", PRIORITIES["normal"], "someone")
+    assert queue.order() == ["other", "leader"]
+    queue.raise_priority("leader", PRIORITIES["high"])
+    assert queue.order() == ["leader", "other"]
+
+
+def test_raise_priority_never_lowers():
+    queue = FairQueue()
+    queue.push("a", PRIORITIES["high"], "x")
+    queue.push("b", PRIORITIES["normal"], "y")
+    queue.raise_priority("a", PRIORITIES["low"])
+    queue.raise_priority("missing", PRIORITIES["high"])
+    assert queue.order() == ["a", "b"]
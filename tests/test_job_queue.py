@@ -0,0 +1,129 @@
+"""Leases, heartbeats, reaping, dispatch order and followers of the SQLite job queue."""
+import time
+
+import pytest
+
+from fair_queue import PRIORITIES
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(lease_seconds=60.0, max_attempts=3):
+        queue = JobQueue(tmp_path / "jobs.sqlite3", lease_seconds, max_attempts)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.close()
+
+
+def test_claimed_job_is_leased_to_one_worker(make_queue):
+    queue = make_queue()
+    queue.enqueue("job", {"prompt": "p"})
+    job = queue.claim("w1")
+    assert job.job_id == "job" and job.payload == {"prompt": "p"} and job.attempts == 1
+    assert queue.claim("w2") is None
+    assert queue.stats() == {"queued": 0, "leased": 1}
+
+
+def test_claim_order_is_priority_then_fair_share(make_queue):
+    queue = make_queue()
+    queue.enqueue("x1", {}, PRIORITIES["normal"], "x")
+    queue.enqueue("x2", {}, PRIORITIES["normal"], "x")
+    queue.enqueue("y1", {}, PRIORITIES["normal"], "y")
+    queue.enqueue("low", {}, PRIORITIES["low"], "z")
+    queue.enqueue("high", {}, PRIORITIES["high"], "z")
+    positions, running, _ = queue.positions()
+    claimed = [queue.claim("w").job_id for _ in range(5)]
+    assert claimed == ["high", "x1", "y1", "x2", "low"]
+    assert sorted(positions, key=positions.get) == claimed
+    assert running == 0
+
+
+def test_queue_is_shared_between_connections(make_queue):
+    api, worker = make_queue(), make_queue()
+    api.enqueue("job", {})
+    assert worker.claim("w1").job_id == "job"
+    assert api.claim("w2") is None
+
+
+def test_expired_lease_is_delivered_again(make_queue):
+    queue = make_queue(lease_seconds=0.05)
+    queue.enqueue("job", {})
+    assert queue.claim("w1").attempts == 1
+    time.sleep(0.1)
+    job = queue.claim("w2")
+    assert job.job_id == "job" and job.attempts == 2
+    # Первый воркер потерял аренду: его heartbeat и complete ничего не меняют
+    assert not queue.heartbeat("job", "w1")
+    queue.complete("job", "w1")
+    assert queue.stats()["leased"] == 1
+
+
+def test_heartbeat_extends_the_lease(make_queue):
+    queue = make_queue(lease_seconds=0.2)
+    queue.enqueue("job", {})
+    queue.claim("w1")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert queue.heartbeat("job", "w1")
+    assert queue.claim("w2") is None
+
+
+def test_reap_gives_up_after_max_attempts(make_queue):
+    queue = make_queue(lease_seconds=0.05, max_attempts=2)
+    queue.enqueue("job", {}, fingerprint="same")
+    queue.enqueue("follower", {}, fingerprint="same")
+    for worker_id in ("w1", "w2"):
+        assert queue.claim(worker_id) is not None
+        # Пока у задачи остаются попытки, её не бросают
+        assert queue.reap() == {}
+        time.sleep(0.1)
+    assert queue.claim("w3") is None
+    assert queue.reap() == {"job": ["follower"]}
+    assert queue.stats() == {"queued": 0, "leased": 0}
+
+
+def test_duplicate_job_becomes_a_follower(make_queue):
+    queue = make_queue()
+    assert queue.enqueue("leader", {}, fingerprint="same") is None
+    assert queue.enqueue("f1", {}, fingerprint="same") == "leader"
+    queue.claim("w1")
+    # Дубликат, пришедший во время выполнения, тоже присоединяется
+    assert queue.enqueue("f2", {}, fingerprint="same") == "leader"
+    assert queue.claim("w2") is None
+    assert sorted(queue.complete("leader", "w1")) == ["f1", "f2"]
+    # После завершения такая же задача снова выполняется сама
+    assert queue.enqueue("again", {}, fingerprint="same") is None
+
+
+def test_follower_raises_leader_priority(make_queue):
+    """Regression: attaching an urgent follower must not leave it behind a bulk round."""
+    queue = make_queue()
+    queue.enqueue("leader", {}, PRIORITIES["low"], "bulk", fingerprint="same")
+    queue.enqueue("other", {}, PRIORITIES["normal"], "someone")
+    assert queue.enqueue("urgent", {}, PRIORITIES["high"], "expert", fingerprint="same") == "leader"
+    assert queue.claim("w").job_id == "leader"
+
+
+def test_follower_does_not_lower_leader_priority(make_queue):
+    queue = make_queue()
+    queue.enqueue("leader", {}, PRIORITIES["high"], "expert", fingerprint="same")
+    queue.enqueue("other", {}, PRIORITIES["normal"], "someone")
+    queue.enqueue("bulk", {}, PRIORITIES["low"], "bulk", fingerprint="same")
+    assert queue.claim("w").job_id == "leader"
+
+
+def test_completed_job_is_removed_and_timed(make_queue):
+    queue = make_queue()
+    queue.enqueue("job", {})
+    queue.claim("w1")
+    queue.complete("job", "w1")
+    positions, running, average = queue.positions()
+    assert positions == {} and running == 0
+    assert average is not None and average >= 0
+    assert queue.stats() == {"queued": 0, "leased": 0}
@@ -0,0 +1,72 @@
+"""JSON mode fallback of the model client."""
+import json
+
+import httpx
+import openai
+import pytest
+from openai import OpenAI
+
+import llm_client
+
+REPLY = {
+    "id": "c1",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "m",
+    "choices": [
+        {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "{}"}}
+    ],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+}
+
+
+@pytest.fixture
+def requests_sent(monkeypatch):
+    """
+    Route the client to a fake API: model "strict" rejects `response_format`,
+    model "tiny" rejects every request as too long.
+    """
+    sent = []
+
+    def handle(request):
+        body = json.loads(request.content)
+        sent.append(body)
+        if body["model"] == "strict" and "response_format" in body:
+            error = {"error": {"message": "response_format is not supported", "code": 400}}
+            return httpx.Response(400, json=error)
+        if body["model"] == "tiny":
+            return httpx.Response(400, json={"error": {"message": "context length exceeded", "code": 400}})
+        return httpx.Response(200, json=REPLY)
+
+    client = OpenAI(
+        api_key="test",
+        base_url="http://llm.test/v1",
+        max_retries=0,
+        http_client=httpx.Client(transport=httpx.MockTransport(handle)),
+    )
+    monkeypatch.setattr(llm_client, "_client", client)
+    monkeypatch.setattr(llm_client, "_json_mode_rejected", set())
+    monkeypatch.setattr(llm_client, "LLM_JSON_MODE", True)
+    yield sent
+    client.close()
+
+
+def test_json_mode_is_requested(requests_sent):
+    assert llm_client.call_model([{"role": "user", "content": "q"}], model="m", json_output=True) == "{}"
+    assert requests_sent[0]["response_format"] == {"type": "json_object"}
+
+
+def test_rejected_json_mode_is_retried_without_it_and_remembered(requests_sent):
+    messages = [{"role": "user", "content": "q"}]
+    assert llm_client.call_model(messages, model="strict", json_output=True) == "{}"
+    assert ["response_format" in body for body in requests_sent] == [True, False]
+    # Повторный вызов сразу идёт без response_format
+    llm_client.call_model(messages, model="strict", json_output=True)
+    assert len(requests_sent) == 3 and "response_format" not in requests_sent[2]
+
+
+def test_unrelated_bad_request_is_raised(requests_sent):
+    with pytest.raises(openai.BadRequestError):
+        llm_client.call_model([{"role": "user", "content": "q"}], model="tiny", json_output=True)
+    assert len(requests_sent) == 1
+    assert llm_client._json_mode_rejected == set()
@@ -0,0 +1,151 @@
+"""Rate budget, Retry-After handling and retries of the model scheduler."""
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+import llm_scheduler
+from llm_client import retry_delay
+from llm_scheduler import ModelScheduler
+
+
+def api_error(status_code, headers=None):
+    response = httpx.Response(
+        status_code, headers=headers or {}, request=httpx.Request("POST", "https://llm.test/v1/chat/completions")
+    )
+    error_class = openai.RateLimitError if status_code == 429 else openai.APIStatusError
+    if status_code == 400:
+        error_class = openai.BadRequestError
+    elif status_code >= 500:
+        error_class = openai.InternalServerError
+    return error_class("error", response=response, body=None)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_rpm_budget_delay():
+    async def check():
+        scheduler = ModelScheduler(None, max_concurrent=4, rpm=2)
+        scheduler._sent.extend([(0.0, 0), (5.0, 0)])
+        # Третий запрос ждёт, пока первый выйдет из минутного окна
+        assert scheduler._budget_delay(0, 10.0) == pytest.approx(50.0)
+        assert scheduler._budget_delay(0, 61.0) <= 0
+
+    run(check())
+
+
+def test_tpm_budget_delay():
+    async def check():
+        scheduler = ModelScheduler(None, max_concurrent=4, tpm=1000)
+        scheduler._sent.extend([(0.0, 600), (5.0, 300)])
+        assert scheduler._budget_delay(100, 10.0) <= 0
+        assert scheduler._budget_delay(300, 10.0) == pytest.approx(50.0)
+        # Вызов больше всего бюджета ждёт, пока окно не опустеет
+        assert scheduler._budget_delay(2000, 10.0) == pytest.approx(55.0)
+
+    run(check())
+
+
+def test_rpm_limit_spaces_calls(monkeypatch):
+    monkeypatch.setattr(llm_scheduler, "_WINDOW", 0.2)
+
+    async def check():
+        scheduler = ModelScheduler(None, max_concurrent=4, rpm=1)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(scheduler.run(lambda i=i: i) for i in range(3)))
+        return results, time.perf_counter() - started
+
+    results, elapsed = run(check())
+    assert results == [0, 1, 2]
+    assert elapsed >= 0.4
+
+
+def test_retry_delay_honours_retry_after():
+    assert retry_delay(api_error(429, {"retry-after": "7"}), 0) == 7.0
+    assert retry_delay(api_error(429, {"retry-after-ms": "1500"}), 0) == 1.5
+    assert retry_delay(api_error(503, {"retry-after": "2"}), 3) == 2.0
+    assert retry_delay(api_error(400), 0) is None
+    assert retry_delay(ValueError("bug"), 0) is None
+
+
+def test_rate_limit_pauses_and_retries():
+    calls = []
+
+    def flaky():
+        calls.append(time.perf_counter())
+        if len(calls) == 1:
+            raise api_error(429, {"retry-after": "0.2"})
+        return "ok"
+
+    async def check():
+        scheduler = ModelScheduler(None, max_concurrent=2, max_retries=3)
+        retries = []
+        reply = await scheduler.run(flaky, on_retry=lambda attempt, delay, error: retries.append((attempt, delay)))
+        return scheduler, reply, retries
+
+    scheduler, reply, retries = run(check())
+    assert reply == "ok"
+    assert retries == [(1, 0.2)]
+    assert calls[1] - calls[0] >= 0.2
+    assert scheduler.rate_limited == 1 and scheduler.retries == 1
+
+
+def test_rate_limit_pauses_other_calls():
+    attempts = []
+
+    def limited():
+        attempts.append("limited")
+        if attempts.count("limited") == 1:
+            raise api_error(429, {"retry-after": "0.3"})
+        return "limited"
+
+    async def check():
+        scheduler = ModelScheduler(None, max_concurrent=2)
+        first = asyncio.ensure_future(scheduler.run(limited))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        # Пока действует Retry-After, новый вызов не отправляется
+        second = await scheduler.run(lambda: "other")
+        return await first, second, time.perf_counter() - started
+
+    first, second, waited = run(check())
+    assert (first, second) == ("limited", "other")
+    assert waited >= 0.2
+
+
+def test_non_retryable_error_is_raised():
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise api_error(400)
+
+    async def check():
+        scheduler = ModelScheduler(None, max_concurrent=1)
+        with pytest.raises(openai.BadRequestError):
+            await scheduler.run(bad_request)
+        return scheduler
+
+    scheduler = run(check())
+    assert len(calls) == 1 and scheduler.retries == 0
+    assert scheduler.running == 0
+
+
+def test_retries_are_limited():
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise api_error(503, {"retry-after": "0"})
+
+    async def check():
+        scheduler = ModelScheduler(None, max_concurrent=1, max_retries=2)
+        with pytest.raises(openai.InternalServerError):
+            await scheduler.run(failing)
+
+    run(check())
+    assert len(calls) == 3
@@ -0,0 +1,75 @@
+"""Splitting long documents into chunks and map-reduce evaluation."""
+import threading
+
+import map_reduce
+from map_reduce import fits_context, run_map_reduce, split_into_chunks
+from tokens import count_tokens
+
+
+def paragraphs(count, words=40, prefix="абзац"):
+    return [f"{prefix} {i}: " + " ".join(f"слово{j}" for j in range(words)) for i in range(count)]
+
+
+def test_short_text_is_one_chunk():
+    text = "\n\n".join(paragraphs(3))
+    assert split_into_chunks(text, chunk_tokens=10_000, overlap_tokens=0) == ["\n\n".join(paragraphs(3))]
+
+
+def test_chunks_respect_the_token_limit_and_keep_paragraphs():
+    parts = paragraphs(30)
+    chunks = split_into_chunks("\n\n".join(parts), chunk_tokens=400, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 400 for chunk in chunks)
+    # Без перекрытия каждый абзац попадает ровно в один фрагмент, целиком и по порядку
+    assert [p for chunk in chunks for p in chunk.split("\n\n")] == parts
+
+
+def test_overlap_repeats_the_tail_of_the_previous_chunk():
+    chunks = split_into_chunks("\n\n".join(paragraphs(30)), chunk_tokens=400, overlap_tokens=150)
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.split("\n\n")[0] in previous.split("\n\n")
+
+
+def test_section_heading_starts_a_new_chunk_once_half_full():
+    parts = paragraphs(4) + ["2. Бюджет проекта"] + paragraphs(2, prefix="бюджет")
+    chunks = split_into_chunks("\n\n".join(parts), chunk_tokens=count_tokens("\n\n".join(parts)), overlap_tokens=0)
+    assert len(chunks) == 2
+    assert chunks[1].startswith("2. Бюджет проекта")
+
+
+def test_long_paragraph_is_split():
+    text = "\n".join(" ".join(f"строка{i}слово{j}" for j in range(30)) for i in range(40))
+    chunks = split_into_chunks(text, chunk_tokens=300, overlap_tokens=50)
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 300 for chunk in chunks)
+
+
+def test_fits_context():
+    messages = [{"role": "user", "content": "x" * 3000}]
+    assert fits_context(messages, context_tokens=100_000)
+    assert not fits_context(messages, context_tokens=100)
+
+
+def test_run_map_reduce_reduces_notes_in_chunk_order(monkeypatch):
+    monkeypatch.setattr(map_reduce, "CHUNK_TOKENS", 300)
+    monkeypatch.setattr(map_reduce, "CHUNK_OVERLAP_TOKENS", 0)
+    text = "\n\n".join(paragraphs(20))
+    chunks = split_into_chunks(text)
+    lock = threading.Lock()
+    calls = []
+
+    def call(messages):
+        last = messages[-1]["content"]
+        with lock:
+            calls.append(last)
+        if last.startswith("Фрагмент"):
+            # "Фрагмент i из n текста PDF:" — заметка помнит номер фрагмента
+            return f"заметка {last.split()[1]}"
+        return "итог"
+
+    assert run_map_reduce(text, "Оцени заявку.", call, max_parallel=3) == "итог"
+    assert len(calls) == len(chunks) + 1
+    reduce_prompt = calls[-1]
+    positions = [reduce_prompt.index(f"заметка {i}") for i in range(1, len(chunks) + 1)]
+    assert positions == sorted(positions)
@@ -0,0 +1,108 @@
+"""Page-parallel and page-streaming PDF extraction."""
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from pypdf import PdfReader, PdfWriter
+
+import pdf_utils
+from pdf_utils import extract_pdf_text, extract_pdf_text_in_pool, iter_pdf_pages, page_ranges, write_pdf_text
+
+
+@pytest.fixture
+def mixed_pdf(grant_pdf, tmp_path):
+    """The grant PDF twice over with blank pages in between: 11 pages, 3 of them empty."""
+    writer = PdfWriter()
+    for _ in range(2):
+        for page in PdfReader(str(grant_pdf)).pages:
+            writer.add_page(page)
+        writer.add_blank_page(width=595, height=842)
+    writer.insert_blank_page(width=595, height=842, index=1)
+    path = tmp_path / "mixed.pdf"
+    with open(path, "wb") as f:
+        writer.write(f)
+    return path
+
+
+@pytest.fixture
+def parallel_from_2_pages(monkeypatch):
+    monkeypatch.setattr(pdf_utils, "PDF_PARALLEL_MIN_PAGES", 2)
+
+
+def sequential_pages(path):
+    reader = PdfReader(str(path))
+    return [(page.extract_text() or "").strip() for page in reader.pages]
+
+
+def test_page_ranges(monkeypatch):
+    monkeypatch.setattr(pdf_utils, "PDF_PARALLEL_MIN_PAGES", 40)
+    assert page_ranges(0, 4) == []
+    assert page_ranges(39, 4) == [(0, 39)]
+    assert page_ranges(100, 1) == [(0, 100)]
+    assert page_ranges(42, 4) == [(0, 11), (11, 22), (22, 32), (32, 42)]
+    monkeypatch.setattr(pdf_utils, "PDF_PARALLEL_MIN_PAGES", 1)
+    # Диапазонов не больше, чем страниц
+    assert page_ranges(3, 8) == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_parallel_pages_keep_their_order(mixed_pdf, parallel_from_2_pages):
+    pages = list(iter_pdf_pages(mixed_pdf, workers=3))
+    assert [number for number, _ in pages] == list(range(1, 12))
+    assert [text for _, text in pages] == sequential_pages(mixed_pdf)
+
+
+def test_parallel_text_equals_sequential(mixed_pdf, parallel_from_2_pages):
+    sequential = extract_pdf_text(mixed_pdf, workers=1)
+    # Пустые страницы не дают лишних пустых строк, страницы разделены одной пустой строкой
+    assert sequential == "\n\n".join(text for text in sequential_pages(mixed_pdf) if text)
+    assert extract_pdf_text(mixed_pdf, workers=3) == sequential
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        assert extract_pdf_text_in_pool(pool, mixed_pdf, workers=4) == sequential
+
+
+def test_invalid_type_is_rejected(grant_pdf):
+    with pytest.raises(ValueError):
+        extract_pdf_text(grant_pdf, type="scan")
+    with ProcessPoolExecutor(max_workers=1) as pool, pytest.raises(ValueError):
+        extract_pdf_text_in_pool(pool, grant_pdf, type="scan")
+
+
+def test_pages_are_streamed_lazily(grant_pdf, monkeypatch):
+    extracted = []
+    page_text = pdf_utils._page_text
+
+    def recording(page, type):
+        extracted.append(page)
+        return page_text(page, type)
+
+    monkeypatch.setattr(pdf_utils, "_page_text", recording)
+    pages = iter_pdf_pages(grant_pdf, workers=1)
+    assert next(pages)[0] == 1
+    # Следующая страница извлекается только по запросу
+    assert len(extracted) == 1
+    assert [number for number, _ in pages] == [2, 3, 4]
+
+
+def test_write_pdf_text_equals_extract(mixed_pdf, tmp_path):
+    out = tmp_path / "mixed.txt"
+    assert write_pdf_text(mixed_pdf, out, workers=1) == 11
+    assert out.read_text(encoding="utf-8") == extract_pdf_text(mixed_pdf, workers=1)
+
+
+def test_failed_write_keeps_the_previous_file(grant_pdf, tmp_path, monkeypatch):
+    out = tmp_path / "grant.txt"
+    out.write_text("прежний результат", encoding="utf-8")
+    page_text = pdf_utils._page_text
+    calls = []
+
+    def failing_on_second_page(page, type):
+        calls.append(page)
+        if len(calls) == 2:
+            raise RuntimeError("broken page")
+        return page_text(page, type)
+
+    monkeypatch.setattr(pdf_utils, "_page_text", failing_on_second_page)
+    with pytest.raises(RuntimeError):
+        write_pdf_text(grant_pdf, out, workers=1)
+    # Ни обрезанного результата, ни временного файла
+    assert out.read_text(encoding="utf-8") == "прежний результат"
+    assert [p.name for p in tmp_path.iterdir()] == ["grant.txt"]
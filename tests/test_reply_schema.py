@@ -0,0 +1,127 @@
+"""Local repair, validation and re-ask of structured evaluation replies."""
+import json
+
+from reply_schema import (
+    CRITERIA_HEADER,
+    FIELDS,
+    all_unknown,
+    build_repair_messages,
+    invalid_fields,
+    merge_reply,
+    parse_reply,
+    prompt_criteria,
+    repair_request_fields,
+)
+
+CRITERIA = ["Новизна", "Бюджет"]
+MESSAGES = [
+    {"role": "system", "content": "Ты — ассистент."},
+    {"role": "user", "content": f"Инструкция пользователя: Оцени заявку.\n{CRITERIA_HEADER}\n- Новизна\n- Бюджет\n\nОтвет в JSON."},
+    {"role": "user", "content": "Текст PDF:\n..."},
+]
+
+
+def valid_reply():
+    return {
+        "summary_bullets": ["Проект о ```коде```"],
+        "format_compliance": {"is_compliant": True, "explanation": ["Все разделы на месте"]},
+        "strengths": ["Команда"],
+        "risks": ["Сроки"],
+        "expert_criteria": [
+            {"criterion": "Новизна", "score": "Высокая", "rationale": "Новый метод"},
+            {"criterion": "Бюджет", "score": "Средняя", "rationale": "Обоснован частично"},
+        ],
+        "recommendation": {"decision": "поддержать", "why": "Сильная команда"},
+    }
+
+
+def test_prompt_criteria():
+    assert prompt_criteria(MESSAGES) == CRITERIA
+    assert prompt_criteria([{"role": "user", "content": "без критериев"}]) == []
+
+
+def test_plain_json_needs_no_repair():
+    data = valid_reply()
+    assert parse_reply(json.dumps(data, ensure_ascii=False)) == (data, [])
+    assert invalid_fields(data, CRITERIA) == []
+
+
+def test_fenced_reply_with_fence_inside_a_string():
+    """Regression: the outermost fence is matched, not the first ``` inside a JSON string."""
+    data = valid_reply()
+    text = f"Вот оценка:\n```json\n{json.dumps(data, ensure_ascii=False, indent=2)}\n```\nГотово."
+    assert parse_reply(text) == (data, ["fences"])
+
+
+def test_unfenced_reply_with_fence_inside_a_string():
+    data = valid_reply()
+    assert parse_reply("Вот: " + json.dumps(data, ensure_ascii=False)) == (data, ["fences"])
+
+
+def test_truncated_reply_is_completed():
+    text = json.dumps(valid_reply(), ensure_ascii=False)
+    cut = text[: text.index('"recommendation"') + 30]
+    data, repairs = parse_reply(cut)
+    assert repairs == ["truncation"]
+    assert data["expert_criteria"] == valid_reply()["expert_criteria"]
+    assert invalid_fields(data, CRITERIA) == ["recommendation"]
+
+
+def test_truncated_fenced_reply_with_fence_inside_a_string():
+    """Regression: a reply cut off before the closing fence is still recovered."""
+    text = "```json\n" + json.dumps(valid_reply(), ensure_ascii=False, indent=2)
+    cut = text[: text.index('"risks"') + 12]
+    data, repairs = parse_reply(cut)
+    assert repairs == ["fences", "truncation"]
+    assert data["summary_bullets"] == ["Проект о ```коде```"]
+    assert set(invalid_fields(data, CRITERIA)) == {"risks", "expert_criteria", "recommendation"}
+
+
+def test_unrecoverable_reply():
+    assert parse_reply("Не могу оценить заявку.") == (None, [])
+    assert invalid_fields(None) == list(FIELDS)
+
+
+def test_invalid_values_are_reported():
+    data = valid_reply()
+    data["strengths"] = "одной строкой"
+    data["recommendation"] = {"decision": "может быть", "why": ""}
+    assert invalid_fields(data, CRITERIA) == ["strengths", "recommendation"]
+
+
+def test_unknown_values_are_valid():
+    data = {name: "Не указано" for name in FIELDS}
+    data["risks"] = None
+    assert invalid_fields(data) == []
+    assert all_unknown(data)
+    assert not all_unknown(valid_reply())
+
+
+def test_expert_criteria_needs_one_entry_per_criterion():
+    """An unknown expert_criteria does not bypass the criteria count."""
+    data = valid_reply()
+    data["expert_criteria"] = None
+    assert invalid_fields(data, CRITERIA) == ["expert_criteria"]
+    data["expert_criteria"] = valid_reply()["expert_criteria"][:1]
+    assert invalid_fields(data, CRITERIA) == ["expert_criteria"]
+    assert invalid_fields(data) == []
+
+
+def test_repair_messages_round_trip():
+    messages = build_repair_messages(MESSAGES, "{}", ["risks", "recommendation"])
+    assert messages[: len(MESSAGES)] == MESSAGES
+    assert repair_request_fields(messages) == ["risks", "recommendation"]
+    assert repair_request_fields(MESSAGES) == []
+
+
+def test_merge_takes_only_valid_fields_of_the_fix():
+    data = valid_reply()
+    del data["risks"]
+    data["recommendation"] = "оборвано"
+    fix = {"risks": ["Бюджет"], "recommendation": {"decision": "не знаю", "why": None}, "extra": 1}
+    merged = merge_reply(data, fix, CRITERIA)
+    assert merged["risks"] == ["Бюджет"]
+    assert merged["recommendation"] == "оборвано"
+    assert "extra" not in merged
+    assert invalid_fields(merged, CRITERIA) == ["recommendation"]
+    assert merge_reply(data, None, CRITERIA) is data
@@ -0,0 +1,84 @@
+"""Cache of model replies keyed on the exact request."""
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, call_model_cached, make_cache_key
+
+MESSAGES = [{"role": "system", "content": "Правила"}, {"role": "user", "content": "Текст PDF:\n..."}]
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path / "responses.sqlite3", ttl=3600, max_entries=100)
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(response_cache, "_cache", cache)
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def model_calls(monkeypatch):
+    calls = []
+
+    def fake_call_model(messages, model, temperature, json_output=False):
+        calls.append((model, json_output))
+        return f"ответ {len(calls)}"
+
+    monkeypatch.setattr(response_cache, "call_model", fake_call_model)
+    return calls
+
+
+def test_key_covers_every_request_parameter():
+    base = make_cache_key(MESSAGES, "m", 0.2)
+    assert base == make_cache_key([dict(m) for m in MESSAGES], "m", 0.2)
+    other_messages = MESSAGES[:1] + [{"role": "user", "content": "Другой текст"}]
+    variants = {
+        make_cache_key(MESSAGES, "other", 0.2),
+        make_cache_key(MESSAGES, "m", 0.7),
+        make_cache_key(other_messages, "m", 0.2),
+        make_cache_key(MESSAGES, "m", 0.2, json_output=True),
+    }
+    assert base not in variants and len(variants) == 4
+
+
+def test_expired_entries_are_not_returned(tmp_path):
+    cache = ResponseCache(tmp_path / "r.sqlite3", ttl=-1, max_entries=10)
+    cache.put("k", "ответ")
+    assert cache.get("k") is None
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    cache = ResponseCache(tmp_path / "r.sqlite3", ttl=3600, max_entries=2)
+    for key in ("a", "b"):
+        now[0] += 1
+        cache.put(key, key)
+    now[0] += 1
+    assert cache.get("a") == "a"
+    now[0] += 1
+    cache.put("c", "c")
+    assert [cache.get(key) for key in ("a", "b", "c")] == ["a", None, "c"]
+    cache.close()
+
+
+def test_call_model_cached(cache, model_calls):
+    assert call_model_cached(MESSAGES, model="m") == ("ответ 1", False)
+    assert call_model_cached(MESSAGES, model="m") == ("ответ 1", True)
+    # JSON-ответ кэшируется отдельно от текстового
+    assert call_model_cached(MESSAGES, model="m", json_output=True) == ("ответ 2", False)
+    assert model_calls == [("m", False), ("m", True)]
+    assert cache.stats() == {"hits": 1, "misses": 2}
+
+
+def test_bypass_cache_refreshes_the_entry(cache, model_calls):
+    call_model_cached(MESSAGES, model="m")
+    assert call_model_cached(MESSAGES, model="m", bypass_cache=True) == ("ответ 2", False)
+    assert call_model_cached(MESSAGES, model="m") == ("ответ 2", True)
+
+
+def test_empty_reply_is_not_cached(cache, monkeypatch):
+    monkeypatch.setattr(response_cache, "call_model", lambda *args, **kwargs: "")
+    assert call_model_cached(MESSAGES, model="m") == ("", False)
+    assert cache.get(make_cache_key(MESSAGES, "m", 0.2)) is None
@@ -0,0 +1,79 @@
+"""Sections and BM25 retrieval over the grant rules."""
+import json
+
+import pytest
+
+import rules_index
+from rules_index import RulesIndex, get_rules_index, split_sections, tokenize
+
+RULES = """Общие положения. Заявка подаётся в электронном виде.
+
+1. Бюджет проекта должен быть обоснован: расходы на оборудование и оплату труда.
+
+2. Команда проекта: указываются руководитель и исполнители, их опыт.
+
+3. Календарный план содержит этапы, сроки и результаты каждого этапа.
+
+4. Презентация проекта не длиннее 10 слайдов."""
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(rules_index, "RULES_INDEX_DIR", tmp_path)
+    monkeypatch.setattr(rules_index, "_indexes", {})
+    return tmp_path
+
+
+def test_tokenize_stems_words():
+    # Числа и однобуквенные слова отбрасываются, ё приравнивается к е
+    assert tokenize("Отчёт в 2024 году") == ["отчет", "году"]
+    assert tokenize("Бюджетирование, бюджетный") == ["бюджет", "бюджет"]
+
+
+def test_numbered_items_start_sections():
+    sections = split_sections(RULES, max_chars=800)
+    assert len(sections) == 5
+    assert sections[1].startswith("1. Бюджет")
+    assert "\n\n".join(sections) == RULES
+
+
+def test_long_paragraph_is_split_by_lines():
+    text = "\n".join(f"строка {i} " + "слово " * 10 for i in range(20))
+    sections = split_sections(text, max_chars=200)
+    assert len(sections) > 1
+    assert all(len(section) <= 200 for section in sections)
+
+
+def test_select_returns_relevant_sections_in_original_order():
+    index = RulesIndex.build(RULES)
+    selected = index.select("Проверь бюджет и календарный план, сроки этапов", top_k=2)
+    assert selected.split("\n\n") == [
+        "1. Бюджет проекта должен быть обоснован: расходы на оборудование и оплату труда.",
+        "3. Календарный план содержит этапы, сроки и результаты каждого этапа.",
+    ]
+
+
+def test_select_falls_back_to_first_sections():
+    index = RulesIndex.build(RULES)
+    assert index.select("ничего общего", top_k=1) == split_sections(RULES)[0]
+
+
+def test_index_is_built_once_and_persisted(index_dir, monkeypatch):
+    index = get_rules_index(RULES)
+    assert get_rules_index(RULES) is index
+    files = list(index_dir.glob("*.json"))
+    assert len(files) == 1
+    assert json.loads(files[0].read_text(encoding="utf-8"))["sections"] == index.sections
+
+    # Новый процесс загружает индекс с диска, не строя его заново
+    monkeypatch.setattr(rules_index, "_indexes", {})
+    monkeypatch.setattr(RulesIndex, "build", classmethod(lambda cls, text: pytest.fail("rebuilt")))
+    assert get_rules_index(RULES).sections == index.sections
+
+
+def test_changed_rules_get_a_new_index(index_dir):
+    first = get_rules_index(RULES)
+    second = get_rules_index(RULES + "\n\n5. Отчёт сдаётся через год.")
+    assert second is not first
+    assert len(second.sections) == len(first.sections) + 1
+    assert len(list(index_dir.glob("*.json"))) == 2
@@ -0,0 +1,107 @@
+"""Hot reload of the organization manifest and rules files."""
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+import prompt_utils
+import rules_registry
+from rules_registry import RulesRegistry
+
+
+def write_manifest(directory, organizations, default=None):
+    manifest = {"organizations": [{"name": name, "file": file} for name, file in organizations]}
+    if default:
+        manifest["default"] = default
+    path = directory / "organizations.json"
+    path.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def touch(path, seconds):
+    """Move the mtime of `path` forward, as an edit a little later would."""
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + int(seconds * 1e9)))
+
+
+@pytest.fixture
+def registry(tmp_path):
+    write_manifest(tmp_path, [("ФПИ", "fpi.txt")], default="ФПИ")
+    (tmp_path / "fpi.txt").write_text("Правила ФПИ", encoding="utf-8")
+    return RulesRegistry(tmp_path)
+
+
+def test_rules_are_read_once_per_version(registry, monkeypatch):
+    assert registry.get("ФПИ").text == "Правила ФПИ"
+    reads = []
+    read_text = Path.read_text
+
+    def counting(self, *args, **kwargs):
+        reads.append(self.name)
+        return read_text(self, *args, **kwargs)
+
+    monkeypatch.setattr(Path, "read_text", counting)
+    for _ in range(3):
+        registry.get("ФПИ")
+    assert reads == []
+
+
+def test_changed_rules_file_is_reloaded(registry, tmp_path):
+    entry = registry.get("ФПИ")
+    old_hash = entry.sha256
+    rules = tmp_path / "fpi.txt"
+    rules.write_text("Новые правила ФПИ", encoding="utf-8")
+    touch(rules, 1)
+    entry = registry.get("ФПИ")
+    assert entry.text == "Новые правила ФПИ"
+    assert entry.sha256 != old_hash and entry.tokens > 0
+
+
+def test_new_organization_is_picked_up_from_the_manifest(registry, tmp_path):
+    assert registry.names() == ["ФПИ"]
+    (tmp_path / "cu.txt").write_text("Правила ЦУ", encoding="utf-8")
+    manifest = write_manifest(tmp_path, [("ФПИ", "fpi.txt"), ("ЦУ", "cu.txt")], default="ФПИ")
+    touch(manifest, 1)
+    assert registry.names() == ["ФПИ", "ЦУ"]
+    assert registry.get("ЦУ").text == "Правила ЦУ"
+    assert [item["available"] for item in registry.list()] == [True, True]
+
+
+def test_missing_file_is_retried_until_it_appears(tmp_path):
+    write_manifest(tmp_path, [("ЦУ", "cu.txt")])
+    registry = RulesRegistry(tmp_path)
+    entry = registry.get("ЦУ")
+    assert entry.text == "" and "не найден" in entry.error
+    assert registry.list()[0]["available"] is False
+    (tmp_path / "cu.txt").write_text("Правила ЦУ", encoding="utf-8")
+    entry = registry.get("ЦУ")
+    assert entry.text == "Правила ЦУ" and entry.error is None
+
+
+def test_broken_manifest_falls_back_to_the_builtin_list(tmp_path, capsys):
+    (tmp_path / "organizations.json").write_text("{не json", encoding="utf-8")
+    registry = RulesRegistry(tmp_path)
+    assert registry.names() == ["ФПИ", "ЦУ"]
+    assert registry.default == "ФПИ"
+    assert "не удалось прочитать" in capsys.readouterr().out
+
+
+def test_rules_warning_is_printed_once_per_change(tmp_path, monkeypatch, capsys):
+    write_manifest(tmp_path, [("ЦУ", "cu.txt")], default="ЦУ")
+    monkeypatch.setattr(rules_registry, "_registry", RulesRegistry(tmp_path))
+    monkeypatch.setattr(prompt_utils, "_warnings", {})
+    for _ in range(3):
+        assert prompt_utils._load_grant_rules("ЦУ") == ""
+    assert capsys.readouterr().out.count("файл рекомендаций не найден") == 1
+
+    (tmp_path / "cu.txt").write_text("Правила ЦУ", encoding="utf-8")
+    assert prompt_utils._load_grant_rules("ЦУ") == "Правила ЦУ"
+    (tmp_path / "cu.txt").unlink()
+    for _ in range(3):
+        prompt_utils._load_grant_rules("ЦУ")
+    # Файл снова пропал — об этом предупреждаем ещё раз, но тоже однажды
+    assert capsys.readouterr().out.count("файл рекомендаций не найден") == 1
+    for _ in range(2):
+        prompt_utils._load_grant_rules("Неизвестная")
+    assert capsys.readouterr().out.count("неизвестная организация") == 1
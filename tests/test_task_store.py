@@ -0,0 +1,143 @@
+"""TTL, LRU eviction and cross-process updates of the task stores."""
+import multiprocessing
+
+import pytest
+
+import task_store
+from task_store import ACCESS_RESOLUTION, MemoryTaskStore, SqliteTaskStore, TaskStore
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(task_store.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    stores = []
+
+    def make(ttl=3600.0, max_entries=100):
+        if request.param == "memory":
+            store = MemoryTaskStore(ttl, max_entries)
+        else:
+            store = SqliteTaskStore(tmp_path / "tasks.sqlite3", ttl, max_entries)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def test_task_store_is_abstract():
+    with pytest.raises(TypeError):
+        TaskStore()
+
+
+def test_create_update_get(make_store):
+    store = make_store()
+    store.create("t", {"status": "pending", "message": "queued"})
+    store.update("t", status="processing", message="working")
+    record = store.get("t")
+    assert record["status"] == "processing" and record["message"] == "working"
+    assert "created_at" in record
+    assert "t" in store and len(store) == 1
+    assert store.list() == [{"task_id": "t", "status": "processing", "message": "working"}]
+
+
+def test_update_of_unknown_task_is_ignored(make_store):
+    store = make_store()
+    store.update("missing", status="completed")
+    assert store.get("missing") is None and len(store) == 0
+
+
+def test_finished_tasks_expire_after_ttl(make_store, clock):
+    store = make_store(ttl=60)
+    store.create("done", {"status": "pending", "message": ""})
+    store.create("running", {"status": "pending", "message": ""})
+    store.update("done", status="completed")
+    clock.now += 61
+    assert store.get("done") is None
+    # Незавершённые задачи не истекают
+    assert store.get("running") is not None
+
+
+def test_only_finished_tasks_are_evicted_least_recently_used_first(make_store, clock):
+    store = make_store(max_entries=3)
+    for task_id in ("a", "b", "c"):
+        clock.now += ACCESS_RESOLUTION
+        store.create(task_id, {"status": "pending", "message": ""})
+        store.update(task_id, status="completed")
+    clock.now += ACCESS_RESOLUTION
+    # Чтение делает задачу "a" недавно использованной
+    assert store.get("a") is not None
+    clock.now += ACCESS_RESOLUTION
+    store.create("d", {"status": "pending", "message": ""})
+    store.create("e", {"status": "pending", "message": ""})
+    assert [store.get(t) is not None for t in ("a", "b", "c", "d", "e")] == [True, False, False, True, True]
+
+
+def test_sqlite_get_updates_last_access_lazily(tmp_path, clock):
+    store = SqliteTaskStore(tmp_path / "tasks.sqlite3", 3600, 100)
+    store.create("t", {"status": "pending", "message": ""})
+    changes = store._conn.total_changes
+    clock.now += ACCESS_RESOLUTION / 2
+    # Частый опрос статуса только читает базу
+    for _ in range(5):
+        assert store.get("t") is not None
+    assert store._conn.total_changes == changes
+    clock.now += ACCESS_RESOLUTION
+    store.get("t")
+    assert store._conn.total_changes == changes + 1
+    store.close()
+
+
+def _update_many(path, prefix, count):
+    store = SqliteTaskStore(path, 3600, 100, recover_interrupted=False)
+    for i in range(count):
+        store.update("t", **{f"{prefix}{i}": i})
+    store.close()
+
+
+def test_sqlite_updates_from_several_processes_are_not_lost(tmp_path):
+    path = tmp_path / "tasks.sqlite3"
+    store = SqliteTaskStore(path, 3600, 100)
+    store.create("t", {"status": "processing", "message": ""})
+    processes = [
+        multiprocessing.Process(target=_update_many, args=(path, prefix, 30)) for prefix in ("x", "y", "z")
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    record = store.get("t")
+    assert sum(1 for key in record if key[0] in "xyz") == 90
+    store.close()
+
+
+def test_sqlite_recovers_interrupted_tasks(tmp_path):
+    path = tmp_path / "tasks.sqlite3"
+    store = SqliteTaskStore(path, 3600, 100)
+    store.create("running", {"status": "processing", "message": ""})
+    store.create("done", {"status": "completed", "message": "ok"})
+    store.close()
+
+    # С очередью задач незавершённые задачи доделывают воркеры
+    queued = SqliteTaskStore(path, 3600, 100, recover_interrupted=False)
+    assert queued.get("running")["status"] == "processing"
+    queued.close()
+
+    restarted = SqliteTaskStore(path, 3600, 100)
+    assert restarted.get("running")["status"] == "error"
+    assert restarted.get("done")["status"] == "completed"
+    restarted.close()
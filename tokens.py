@@ -0,0 +1,39 @@
+"""
+Token counting for prompts and documents.
+
+Counts are exact when `tiktoken` is installed (o200k_base, the encoding of
+the gpt-4o family) and estimated at about three characters per token
+otherwise.
+"""
+from __future__ import annotations
+
+# Служебные токены на каждое сообщение чата (роль, разделители)
+_TOKENS_PER_MESSAGE = 4
+CHARS_PER_TOKEN = 3
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+        except ImportError:
+            _encoding = False
+        else:
+            _encoding = tiktoken.get_encoding("o200k_base")
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in the text (exact with tiktoken, estimated otherwise)."""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def count_message_tokens(messages) -> int:
+    """Number of input tokens of a chat message list."""
+    return sum(count_tokens(m["content"]) + _TOKENS_PER_MESSAGE for m in messages)
@@ -1,5 +1,6 @@
 import os
 import time
+import uuid
 from dataclasses import dataclass
 from typing import Dict, List, Optional
 from dotenv import load_dotenv 
@@ -27,6 +28,9 @@ class TaskItem:
     message: str = ""
     result: Optional[str] = None
     error: Optional[str] = None
+    batch_id: Optional[str] = None
+    partial_result: Optional[str] = None
+    parsed: Optional[Dict] = None
 
 
 
@@ -39,19 +43,43 @@ def api_health() -> bool:
         return False
 
 
-def api_upload_pdf(pdf_bytes: bytes, filename: str, prompt: str, model: str, temperature: float, organization: str = "ФПИ", pdf_type: str = "application") -> str:
-    files = {"file": (filename, pdf_bytes, "application/pdf")}
+# Список организаций запрашивается не при каждом перезапуске скрипта Streamlit, а раз в 5 минут
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_organizations() -> List[str]:
+    r = requests.get(f"{API_URL}/organizations", timeout=30)
+    r.raise_for_status()
+    return [o["name"] for o in r.json().get("organizations", [])]
+
+
+def api_organizations() -> List[str]:
+    # Список организаций берётся с сервера; при недоступности API — встроенный.
+    # Ошибки st.cache_data не кэширует: после восстановления API список подтянется сразу
+    try:
+        return _fetch_organizations() or ["ФПИ", "ЦУ"]
+    except Exception:
+        return ["ФПИ", "ЦУ"]
+
+
+def api_upload_batch(pdf_files: List, prompt: str, model: str, temperature: float, organization: str = "ФПИ", pdf_type: str = "application", bypass_cache: bool = False, submitter: str = "") -> Dict:
+    # Все файлы раунда отправляются одним запросом POST /batch
+    files = [("files", (f.name, f.getvalue(), "application/pdf")) for f in pdf_files]
     data = {
-        "prompt": prompt, 
-        "model": model, 
+        "prompt": prompt,
+        "model": model,
         "temperature": str(temperature),
         "organization": organization,
-        "pdf_type": pdf_type
+        "pdf_type": pdf_type,
+        "bypass_cache": str(bypass_cache).lower(),
+        "output_format": "json",
+        # Сервер копит частичный ответ модели, его видно до завершения задачи
+        "stream": "true",
+        # Одна заявка — обычный приоритет, большой раунд — низкий, чтобы не задерживать других экспертов
+        "priority": "normal" if len(pdf_files) == 1 else "low",
+        "submitter": submitter,
     }
-    # Увеличенный таймаут для загрузки больших файлов на Render
-    r = requests.post(f"{API_URL}/upload", files=files, data=data, timeout=180)
+    r = requests.post(f"{API_URL}/batch", files=files, data=data, timeout=600)
     r.raise_for_status()
-    return r.json()["task_id"]
+    return r.json()
 
 
 def api_get_result(task_id: str) -> Dict:
@@ -61,6 +89,57 @@ def api_get_result(task_id: str) -> Dict:
     return r.json()
 
 
+def api_stream_events(task_ids: List[str], max_seconds: float = 60.0):
+    """
+    Consume the server's /events SSE stream for the given tasks.
+
+    Yields (event, payload) pairs: "status", "result", "missing", "done".
+    Stops after `max_seconds` so the Streamlit script can rerun and redraw.
+    """
+    deadline = time.monotonic() + max_seconds
+    params = {"task_ids": ",".join(task_ids)}
+    # Таймаут чтения больше интервала keep-alive сервера
+    with requests.get(f"{API_URL}/events", params=params, stream=True, timeout=(30, 60)) as r:
+        r.raise_for_status()
+        event, data_lines = "message", []
+        for line in r.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if line == "":
+                if data_lines:
+                    yield event, json.loads("\n".join(data_lines))
+                    if event == "done":
+                        return
+                event, data_lines = "message", []
+                if time.monotonic() > deadline:
+                    return
+                continue
+            if line.startswith(":"):
+                if time.monotonic() > deadline:
+                    return
+                continue
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data_lines.append(value)
+
+
+def apply_task_payload(t: "TaskItem", payload: Dict) -> None:
+    t.status = payload.get("status", t.status)
+    t.message = payload.get("message", "")
+    if t.status == "pending" and payload.get("queue_position") is not None:
+        wait = payload.get("estimated_wait")
+        t.message = f"В очереди: {payload['queue_position'] + 1}" + (f", ожидание ~{wait:.0f} с" if wait is not None else "")
+    t.partial_result = payload.get("partial_result")
+    if t.status == "completed":
+        t.result = payload.get("result")
+        t.parsed = payload.get("parsed")
+    if t.status == "error":
+        t.error = payload.get("error", "Unknown error")
+
+
 def build_prompt_from_form(cfg: Dict) -> str:
     out_format = """\
 Верни ответ СТРОГО в JSON (один JSON-объект, без ```
@@ -125,6 +204,12 @@ def parse_model_json(text: str) -> dict:
     # Минимально: ожидаем “чистый JSON”
     return json.loads(text)
 
+def as_list(value) -> list:
+    # Модель может вернуть null или "Не указано" вместо списка
+    if isinstance(value, list):
+        return value
+    return [value] if isinstance(value, str) and value else []
+
 def wrap_rationale(text: str, max_line_len: int = 70) -> str:
     if not text:
         return ""
@@ -160,6 +245,9 @@ def ensure_state():
         st.session_state.tasks: List[TaskItem] = []
     if "decisions" not in st.session_state:
         st.session_state.decisions = {}  # task_id -> {"decision":..., "comment":...}
+    if "submitter_id" not in st.session_state:
+        # Сервер чередует задачи разных сессий, чтобы один большой раунд не занимал всю очередь
+        st.session_state.submitter_id = uuid.uuid4().hex
 
 
 # UI
@@ -185,10 +273,11 @@ with st.sidebar:
     ]
     model = st.selectbox("Model", options=model_options, index=0)
     temperature = st.slider("Temperature", 0.0, 1.5, 0.2, 0.05)
+    bypass_cache = st.checkbox("Не использовать кэш ответов", value=False)
     
     st.divider()
     st.subheader("Организация и тип документа")
-    organization = st.selectbox("Организация", options=["ФПИ", "ЦУ"], index=0)
+    organization = st.selectbox("Организация", options=api_organizations(), index=0)
     pdf_type_display = st.selectbox("Тип документа", options=["Заявка", "Презентация"], index=0)
     # Маппинг: "Заявка" -> "application", "Презентация" -> "presentation"
     pdf_type = "application" if pdf_type_display == "Заявка" else "presentation"
@@ -276,38 +365,45 @@ with tabs[1]:
 
     if st.button("🚀 Запустить обработку PDF", disabled=not can_run):
         created: List[TaskItem] = []
-        progress = st.progress(0)
 
-        for i, f in enumerate(pdf_files, start=1):
-            try:
-                task_id = api_upload_pdf(
-                    pdf_bytes=f.getvalue(),
-                    filename=f.name,
+        try:
+            with st.spinner(f"Отправляем {len(pdf_files)} файл(ов) одним запросом..."):
+                batch = api_upload_batch(
+                    pdf_files,
                     prompt=st.session_state.generated_prompt,
                     model=model,
                     temperature=temperature,
                     organization=organization,
                     pdf_type=pdf_type,
+                    bypass_cache=bypass_cache,
+                    submitter=st.session_state.submitter_id,
                 )
-                created.append(TaskItem(filename=f.name, task_id=task_id))
-            except Timeout:
-                created.append(TaskItem(
-                    filename=f.name, 
-                    task_id="—", 
-                    status="error", 
-                    error="Таймаут при загрузке. Сервер может быть занят или перегружен. Попробуйте позже."
-                ))
-            except RequestException as e:
-                created.append(TaskItem(
-                    filename=f.name, 
-                    task_id="—", 
-                    status="error", 
-                    error=f"Ошибка сети при загрузке: {str(e)}"
-                ))
-            except Exception as e:
-                created.append(TaskItem(filename=f.name, task_id="—", status="error", error=str(e)))
-
-            progress.progress(i / len(pdf_files))
+            for item in batch["tasks"]:
+                if item.get("task_id"):
+                    created.append(TaskItem(filename=item["filename"], task_id=item["task_id"], batch_id=batch["batch_id"]))
+                else:
+                    created.append(TaskItem(
+                        filename=item["filename"],
+                        task_id="—",
+                        status="error",
+                        error=item.get("error") or "Файл отклонён сервером",
+                    ))
+        except Timeout:
+            created = [TaskItem(
+                filename=f.name, 
+                task_id="—", 
+                status="error", 
+                error="Таймаут при загрузке. Сервер может быть занят или перегружен. Попробуйте позже."
+            ) for f in pdf_files]
+        except RequestException as e:
+            created = [TaskItem(
+                filename=f.name, 
+                task_id="—", 
+                status="error", 
+                error=f"Ошибка сети при загрузке: {str(e)}"
+            ) for f in pdf_files]
+        except Exception as e:
+            created = [TaskItem(filename=f.name, task_id="—", status="error", error=str(e)) for f in pdf_files]
 
         st.session_state.tasks.extend([t for t in created if t.task_id != "—"])
 
@@ -332,12 +428,7 @@ with tabs[2]:
                     if t.task_id and t.task_id != "—" and t.status not in ("completed", "error"):
                         try:
                             payload = api_get_result(t.task_id)
-                            t.status = payload.get("status", t.status)
-                            t.message = payload.get("message", "")
-                            if t.status == "completed":
-                                t.result = payload.get("result")
-                            if t.status == "error":
-                                t.error = payload.get("error", "Unknown error")
+                            apply_task_payload(t, payload)
                         except Timeout:
                             # Не меняем статус на error при таймауте - возможно, обработка еще идет
                             t.message = "Таймаут запроса. Сервер может быть занят. Попробуйте обновить позже."
@@ -348,34 +439,30 @@ with tabs[2]:
                             t.status = "error"
                             t.error = str(e)
 
-            auto_poll = st.checkbox("Авто-обновление (каждые 3 сек)", value=False)
+            auto_poll = st.checkbox("Авто-обновление (сервер присылает статусы сам)", value=False)
             if auto_poll:
-                # короткий безопасный поллинг без бесконечного цикла
-                for _ in range(3):
-                    any_pending = any(t.status in ("pending", "processing") for t in st.session_state.tasks)
-                    if not any_pending:
-                        break
-                    for t in st.session_state.tasks:
-                        if t.status in ("pending", "processing"):
-                            try:
-                                payload = api_get_result(t.task_id)
-                                t.status = payload.get("status", t.status)
-                                t.message = payload.get("message", "")
-                                if t.status == "completed":
-                                    t.result = payload.get("result")
-                                if t.status == "error":
-                                    t.error = payload.get("error", "Unknown error")
-                            except Timeout:
-                                # Не меняем статус на error при таймауте - возможно, обработка еще идет
-                                t.message = "Таймаут запроса. Сервер может быть занят."
-                            except RequestException as e:
-                                t.status = "error"
-                                t.error = f"Ошибка сети: {str(e)}"
-                            except Exception as e:
-                                t.status = "error"
-                                t.error = str(e)
-                    time.sleep(3)
-                st.rerun()
+                # Одно потоковое соединение /events вместо опроса каждой задачи
+                by_id = {t.task_id: t for t in st.session_state.tasks if t.status in ("pending", "processing")}
+                if by_id:
+                    stream_ok = True
+                    with st.spinner("Ждём результаты от сервера..."):
+                        try:
+                            for event, payload in api_stream_events(list(by_id)):
+                                t = by_id.get(payload.get("task_id"))
+                                if t is None:
+                                    continue
+                                if event in ("status", "result"):
+                                    apply_task_payload(t, payload)
+                                elif event == "missing":
+                                    t.status = "error"
+                                    t.error = "Задача не найдена на сервере (возможно, устарела)"
+                        except Timeout:
+                            pass
+                        except RequestException as e:
+                            stream_ok = False
+                            st.warning(f"Поток событий прерван: {str(e)}")
+                    if stream_ok:
+                        st.rerun()
 
         with colR:
             st.subheader("Экспорт решений")
@@ -419,36 +506,39 @@ with tabs[2]:
 
             if selected.status != "completed":
                 st.info("Результат появится после завершения обработки.")
+                if selected.partial_result:
+                    st.markdown("**Ответ модели (генерируется):**")
+                    st.code(selected.partial_result)
             else:
                 st.markdown("**Ответ модели:**")
                 # Используем чистый Markdown для правильного рендеринга заголовков и форматирования
                 # Streamlit автоматически добавит прокрутку для длинного контента
                 #st.markdown(selected.result or "")
                 try:
-                    data = parse_model_json(selected.result or "")
+                    data = selected.parsed or parse_model_json(selected.result or "")
 
                     st.subheader("Краткое резюме")
-                    st.markdown("\n".join([f"- {x}" for x in data.get("summary_bullets", [])]))
+                    st.markdown("\n".join([f"- {x}" for x in as_list(data.get("summary_bullets"))]))
 
                     # 2) format_compliance
                     st.subheader("Соответствие оформлению")
-                    fc = data.get("format_compliance", {}) or {}
+                    fc = data.get("format_compliance") if isinstance(data.get("format_compliance"), dict) else {}
                     is_ok = fc.get("is_compliant", None)
                     st.write("Да" if is_ok is True else ("Нет" if is_ok is False else "Не определено"))
                     #st.write(fc.get("explanation", ""))
-                    st.markdown("\n".join([f"- {x}" for x in fc.get("explanation", [])]))
+                    st.markdown("\n".join([f"- {x}" for x in as_list(fc.get("explanation"))]))
 
                     # 3) strengths
                     st.subheader("Сильные стороны")
-                    st.markdown("\n".join([f"- {x}" for x in data.get("strengths", [])]))
+                    st.markdown("\n".join([f"- {x}" for x in as_list(data.get("strengths"))]))
 
                     # 4) risks
                     st.subheader("Риски / красные флаги")
-                    st.markdown("\n".join([f"- {x}" for x in data.get("risks", [])]))
+                    st.markdown("\n".join([f"- {x}" for x in as_list(data.get("risks"))]))
 
                     # 5) criteria table (как было)
                     st.subheader("Ответы по критериям эксперта")
-                    rows = data.get("expert_criteria", [])
+                    rows = [r for r in as_list(data.get("expert_criteria")) if isinstance(r, dict)]
                     df = pd.DataFrame(rows, columns=["criterion", "score", "rationale"]).rename(columns={
                         "criterion": "Критерий",
                         "score": "Оценка",
@@ -481,7 +571,7 @@ with tabs[2]:
 
                     # 6) recommendation (как было)
                     st.subheader("Рекомендация")
-                    rec = data.get("recommendation", {}) or {}
+                    rec = data.get("recommendation") if isinstance(data.get("recommendation"), dict) else {}
                     st.write(f"Итог: {rec.get('decision','')}")
                     st.write(rec.get("why",""))
 
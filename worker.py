@@ -0,0 +1,188 @@
+"""
+Worker process for the durable job queue (JOB_QUEUE=sqlite, see job_queue.py).
+
+Claims jobs queued by the API server and processes them with the same code
+as the API's inline mode (`api_server.process_pdf_task`), at most
+`--concurrency` jobs at a time. While a job runs its lease is renewed every
+third of JOB_LEASE_SECONDS; a job whose worker died is re-delivered once the
+lease expires. SIGINT/SIGTERM stop claiming new jobs and let running ones finish.
+When a job is done, tasks that were attached to it as identical submissions
+receive the same result (`api_server.share_result`).
+
+Several workers can run on one machine (to use more cores) or on several
+machines that share the `.cache/` and `uploads/` directories.
+
+Stage latencies and model-call metrics are recorded in the worker process;
+`--metrics-port` serves them in the Prometheus format (see metrics.py).
+
+Usage:
+    JOB_QUEUE=sqlite TASK_STORE=sqlite python -m worker --concurrency 4 [--metrics-port 9100]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+import api_server
+from job_queue import (
+    JOB_LEASE_SECONDS,
+    JOB_POLL_INTERVAL,
+    JOB_QUEUE_BACKEND,
+    Job,
+    JobQueue,
+    get_job_queue,
+)
+from metrics import REGISTRY
+from task_store import FINISHED_STATUSES, TASK_STORE_BACKEND
+
+
+async def run_job(queue: JobQueue, job: Job, worker_id: str) -> None:
+    """Process one job, renewing its lease until it is done."""
+    loop = asyncio.get_running_loop()
+    task_data = api_server.task_results.get(job.job_id)
+    if task_data is None or task_data["status"] in FINISHED_STATUSES:
+        # Задача устарела или уже была доделана до падения предыдущего воркера
+        followers = await loop.run_in_executor(None, queue.complete, job.job_id, worker_id)
+        api_server.share_result(job.job_id, followers)
+        return
+
+    payload = dict(job.payload)
+    pdf_path = Path(payload.pop("pdf_path"))
+    if job.attempts > 1:
+        api_server.set_task_state(
+            job.job_id, message=f"Restarted after a worker failure (attempt {job.attempts})"
+        )
+    processing = asyncio.create_task(api_server.process_pdf_task(job.job_id, pdf_path, **payload))
+
+    while not processing.done():
+        await asyncio.wait({processing}, timeout=JOB_LEASE_SECONDS / 3)
+        if processing.done():
+            break
+        renewed = await loop.run_in_executor(None, queue.heartbeat, job.job_id, worker_id)
+        if not renewed:
+            print(f"Предупреждение: аренда задачи {job.job_id} потеряна, её может взять другой воркер")
+
+    await processing
+    followers = await loop.run_in_executor(None, queue.complete, job.job_id, worker_id)
+    # Одинаковые задачи, присоединённые к этой, получают тот же результат
+    api_server.share_result(job.job_id, followers)
+
+
+async def fail_abandoned(queue: JobQueue) -> None:
+    """Mark tasks whose every delivery was lost to a crashed worker as failed."""
+    loop = asyncio.get_running_loop()
+    abandoned = await loop.run_in_executor(None, queue.reap)
+    for job_id, followers in abandoned.items():
+        api_server.set_task_state(
+            job_id,
+            status="error",
+            error="Task was interrupted by worker failures too many times",
+            message="Task was interrupted by worker failures too many times",
+        )
+        api_server.share_result(job_id, followers)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Не засоряем вывод воркера строкой на каждый опрос Prometheus
+        pass
+
+
+def serve_metrics(port: int) -> ThreadingHTTPServer:
+    """Serve GET /metrics of this worker in a background thread."""
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+async def run_worker(concurrency: int, metrics_port: Optional[int] = None) -> None:
+    loop = asyncio.get_running_loop()
+    queue = get_job_queue()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    stopping = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:
+            # Windows: остановка по KeyboardInterrupt
+            pass
+
+    slots = asyncio.Semaphore(concurrency)
+    running = set()
+    metrics_server = serve_metrics(metrics_port) if metrics_port else None
+    print(f"Воркер {worker_id} запущен, одновременно задач: {concurrency}")
+    async with api_server.runtime():
+        while not stopping.is_set():
+            await slots.acquire()
+            job = None
+            try:
+                await fail_abandoned(queue)
+                job = await loop.run_in_executor(None, queue.claim, worker_id)
+            finally:
+                if job is None:
+                    slots.release()
+            if job is None:
+                try:
+                    await asyncio.wait_for(stopping.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(run_job(queue, job, worker_id))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+        if running:
+            print(f"Остановка: ждём завершения задач ({len(running)})...")
+            await asyncio.gather(*running, return_exceptions=True)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    print(f"Воркер {worker_id} остановлен")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker that processes queued PDF tasks.")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Max jobs processed at the same time (default: 4).",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics of this worker on http://0.0.0.0:PORT/metrics.",
+    )
+    args = parser.parse_args()
+
+    if JOB_QUEUE_BACKEND != "sqlite":
+        raise SystemExit("Воркер работает только с очередью: задайте JOB_QUEUE=sqlite")
+    if TASK_STORE_BACKEND != "sqlite":
+        raise SystemExit("Воркеру нужно общее с API хранилище задач: задайте TASK_STORE=sqlite")
+    asyncio.run(run_worker(max(1, args.concurrency), args.metrics_port))
+
+
+if __name__ == "__main__":
+    main()